@@ -4,30 +4,28 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from database import get_db
-from sqlalchemy.orm import Session
+from database import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from config import settings
+from typing import Optional
+from auth_cache import Principal, principal_cache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Raising bcrypt_rounds upgrades stored hashes as their users log in
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(token: str):
+def _decode_token(token: str):
+    """(username, expiry as a UNIX timestamp) of a valid token; raises 401 otherwise"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -38,18 +36,44 @@ def verify_token(token: str):
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        return username
+        return username, payload.get("exp")
     except JWTError:
         raise credentials_exception
 
+async def resolve_principal(db: AsyncSession, token: str) -> Optional[Principal]:
+    """The user behind a token, from the principal cache when possible.
+
+    Raises 401 for an invalid token; None if its user no longer exists.
+    """
+    from crud import get_user_by_username
+
+    username = principal_cache.get_username(token)
+    if username is None:
+        username, expires_at = _decode_token(token)
+        principal_cache.set_username(token, username, expires_at)
+
+    principal = principal_cache.get_principal(username)
+    if principal is None:
+        user = await get_user_by_username(db, username=username)
+        if user is None:
+            return None
+        principal = Principal.from_user(user)
+        principal_cache.set_principal(principal)
+    return principal
+
+async def get_user_id_from_token(db: AsyncSession, token: str):
+    """Resolve a bearer token to a user ID, None if the token is invalid"""
+    try:
+        principal = await resolve_principal(db, token)
+    except HTTPException:
+        return None
+    return principal.id if principal else None
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    from crud import get_user_by_username
-    
-    username = verify_token(token)
-    user = get_user_by_username(db, username=username)
-    if user is None:
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    principal = await resolve_principal(db, token)
+    if principal is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
\ No newline at end of file
+    return principal
\ No newline at end of file
@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional, Tuple
+from config import settings
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as request handlers see it, detached from any session"""
+    id: int
+    username: str
+    full_name: str
+    email: str
+    email_verified: bool
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(user.id, user.username, user.full_name, user.email, bool(user.email_verified))
+
+class TTLCache:
+    """Bounded LRU whose entries also expire"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # key -> (expires_at, value)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+class PrincipalCache:
+    """Decoded tokens and the users behind them, so authenticated requests skip the JWT decode and user query.
+
+    Tokens map to their username until the cache TTL or the token's own expiry,
+    whichever comes first. Principals are keyed by username and dropped by
+    invalidate() when a user changes. The cache is per process: another
+    worker may serve a changed user's old data for up to ttl seconds.
+    """
+
+    def __init__(self, enabled: bool, ttl: float, max_entries: int):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.tokens = TTLCache(max_entries)
+        self.principals = TTLCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get_username(self, token: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        return self.tokens.get(token)
+
+    def set_username(self, token: str, username: str, token_expires_at: Optional[float]):
+        if not self.enabled:
+            return
+        ttl = self.ttl
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl > 0:
+            self.tokens.set(token, username, ttl)
+
+    def get_principal(self, username: str) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+        principal = self.principals.get(username)
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    def set_principal(self, principal: Principal):
+        if self.enabled:
+            self.principals.set(principal.username, principal, self.ttl)
+
+    def invalidate(self, username: str):
+        """Forget a user whose row changed; their next request reloads it"""
+        self.principals.pop(username)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "tokens": len(self.tokens),
+            "principals": len(self.principals),
+            "evictions": self.tokens.evictions + self.principals.evictions,
+        }
+
+# Global instance
+principal_cache = PrincipalCache(
+    settings.auth_cache_enabled,
+    settings.auth_cache_ttl_seconds,
+    settings.auth_cache_max_entries
+)
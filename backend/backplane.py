@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+import struct
+import uuid
+from collections import deque
+from typing import Callable, Dict, Optional, Set
+from urllib.parse import urlparse
+from config import settings
+
+# Big-endian length of the JSON body that follows, on backplane stream links
+FRAME_HEADER = struct.Struct(">I")
+
+# Handler called with (channel, payload) for every message on a subscribed channel
+MessageHandler = Callable[[str, dict], None]
+# Handler called with (user_id, online) when a user's presence across all processes flips
+PresenceHandler = Callable[[int, bool], None]
+
+class Backplane:
+    """Carries chat/user channel messages and presence between app processes.
+
+    publish, subscribe and set_presence never block: backends buffer or send
+    non-blocking so ConnectionManager can call them from the request path.
+    """
+
+    def __init__(self, on_message: MessageHandler, on_presence: Optional[PresenceHandler] = None):
+        self.node_id = uuid.uuid4().hex[:12]
+        self.on_message = on_message
+        self.on_presence = on_presence
+        self.subscriptions: Set[str] = set()
+        # user_id -> number of local sockets
+        self.local_presence: Dict[int, int] = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, channel: str):
+        self.subscriptions.add(channel)
+
+    def unsubscribe(self, channel: str):
+        self.subscriptions.discard(channel)
+
+    def publish(self, channel: str, payload: dict):
+        raise NotImplementedError
+
+    def set_presence(self, user_id: int, online: bool):
+        was_online = self.is_online(user_id)
+        if online:
+            self.local_presence[user_id] = self.local_presence.get(user_id, 0) + 1
+        elif user_id in self.local_presence:
+            self.local_presence[user_id] -= 1
+            if self.local_presence[user_id] <= 0:
+                del self.local_presence[user_id]
+        self._presence_changed(user_id, was_online)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.local_presence
+
+    def _presence_changed(self, user_id: int, was_online: bool):
+        online = self.is_online(user_id)
+        if online != was_online and self.on_presence is not None:
+            self.on_presence(user_id, online)
+
+    def _deliver(self, channel: str, payload: dict):
+        if channel in self.subscriptions:
+            self.on_message(channel, payload)
+
+    def stats(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "backend": type(self).__name__,
+            "subscriptions": len(self.subscriptions),
+            "local_users": len(self.local_presence),
+        }
+
+class InProcessBackplane(Backplane):
+    """Single-process backend: publish is a direct local delivery"""
+
+    def publish(self, channel: str, payload: dict):
+        self._deliver(channel, payload)
+
+class _PeerLink:
+    """Ordered outbound stream to one peer, with a bounded buffer.
+
+    Frames are length-prefixed JSON, each stamped with the link's seq so the
+    peer can count what was lost. Writes wait for the socket to drain; what
+    piles up meanwhile stays queued until max_buffer_bytes, then new frames
+    are dropped and counted.
+    """
+
+    def __init__(self, node_id: str, path: str, max_buffer_bytes: int, on_failed: Callable[["_PeerLink", bool], None]):
+        self.node_id = node_id
+        self.path = path
+        self.max_buffer_bytes = max_buffer_bytes
+        self.on_failed = on_failed
+        self.seq = 0
+        self.buffered_bytes = 0
+        self.frames_sent = 0
+        self.dropped = 0
+        self._frames: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, envelope: dict) -> bool:
+        self.seq += 1
+        data = json.dumps({**envelope, "seq": self.seq}).encode()
+        if self.buffered_bytes + len(data) > self.max_buffer_bytes:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"Backplane peer {self.node_id} is not keeping up, {self.dropped} frames dropped")
+            return False
+        self._frames.append(data)
+        self.buffered_bytes += len(data)
+        self._wakeup.set()
+        return True
+
+    async def _run(self):
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except OSError as e:
+            # Refused: the peer exited without removing its socket
+            self.on_failed(self, isinstance(e, ConnectionRefusedError))
+            return
+        try:
+            while self._frames or not self._closing:
+                if not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                while self._frames:
+                    data = self._frames.popleft()
+                    self.buffered_bytes -= len(data)
+                    writer.write(FRAME_HEADER.pack(len(data)) + data)
+                    self.frames_sent += 1
+                await writer.drain()
+        except OSError as e:
+            print(f"Backplane link to {self.node_id} failed: {e!r}")
+            self.on_failed(self, False)
+        finally:
+            writer.close()
+
+    async def close(self, timeout: float):
+        """Send what is queued (up to timeout), then hang up"""
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+
+    def cancel(self):
+        self._task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "buffered_frames": len(self._frames),
+            "buffered_bytes": self.buffered_bytes,
+            "frames_sent": self.frames_sent,
+            "dropped": self.dropped,
+        }
+
+class UnixSocketBackplane(Backplane):
+    """Peer-to-peer backend for several workers on one machine.
+
+    Every process listens on a stream socket in a shared directory and keeps
+    one outbound link (see _PeerLink) to every other socket found there;
+    publishing queues the message on each link. Receivers drop messages for
+    channels they have no local subscribers for.
+    """
+
+    PEER_REFRESH_SECONDS = 1.0
+    STOP_FLUSH_SECONDS = 1.0
+
+    def __init__(self, on_message: MessageHandler, directory: str, max_buffer_bytes: int,
+                 on_presence: Optional[PresenceHandler] = None):
+        super().__init__(on_message, on_presence)
+        self.directory = directory
+        self.path = os.path.join(directory, f"{self.node_id}.sock")
+        self.max_buffer_bytes = max_buffer_bytes
+        # node_id -> outbound link
+        self.links: Dict[str, _PeerLink] = {}
+        # node_id -> users with at least one socket on that node
+        self.remote_presence: Dict[str, Set[int]] = {}
+        self.frames_received = 0
+        # Frames peers sent us that never arrived (gaps in their link seq)
+        self.frames_missed = 0
+        self._server = None
+        self._refresh_task = None
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        # Each new link opens with a hello, so presence is swapped with existing nodes right away
+        self._refresh_peers()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        print(f"Backplane node {self.node_id} listening on {self.path}")
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._server is not None:
+            self._broadcast({"kind": "bye"})
+            self._server.close()
+            self._server = None
+            await asyncio.gather(*(link.close(self.STOP_FLUSH_SECONDS) for link in self.links.values()))
+            self.links.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def publish(self, channel: str, payload: dict):
+        self._deliver(channel, payload)
+        self._broadcast({"kind": "message", "channel": channel, "payload": payload})
+
+    def set_presence(self, user_id: int, online: bool):
+        was_online = user_id in self.local_presence
+        super().set_presence(user_id, online)
+        if was_online != (user_id in self.local_presence):
+            self._broadcast({"kind": "presence", "user_id": user_id, "online": not was_online})
+
+    def is_online(self, user_id: int) -> bool:
+        if user_id in self.local_presence:
+            return True
+        return any(user_id in users for users in self.remote_presence.values())
+
+    def _set_remote_users(self, node_id: str, users: Optional[Set[int]]):
+        """Replace a peer's online users (None: the peer is gone), reporting whose presence flipped"""
+        changed = self.remote_presence.get(node_id, set()) ^ (users or set())
+        was_online = {user_id: self.is_online(user_id) for user_id in changed}
+        if users is None:
+            self.remote_presence.pop(node_id, None)
+        else:
+            self.remote_presence[node_id] = users
+        for user_id in changed:
+            self._presence_changed(user_id, was_online[user_id])
+
+    def _link(self, node_id: str) -> _PeerLink:
+        link = self.links.get(node_id)
+        if link is None:
+            path = os.path.join(self.directory, f"{node_id}.sock")
+            link = self.links[node_id] = _PeerLink(node_id, path, self.max_buffer_bytes, self._link_failed)
+            self._send(link, {"kind": "hello", "users": list(self.local_presence)})
+        return link
+
+    def _link_failed(self, link: _PeerLink, stale: bool):
+        # Forget the peer and its presence; a live one is linked again on the next refresh
+        if self.links.get(link.node_id) is link:
+            del self.links[link.node_id]
+        self._set_remote_users(link.node_id, None)
+        if stale and os.path.exists(link.path):
+            try:
+                os.remove(link.path)
+            except OSError:
+                pass
+
+    def _refresh_peers(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        live_nodes = {
+            name[:-len(".sock")] for name in names
+            if name.endswith(".sock") and name != f"{self.node_id}.sock"
+        }
+        for node_id in live_nodes:
+            self._link(node_id)
+        for node_id in list(self.links):
+            if node_id not in live_nodes:
+                self.links.pop(node_id).cancel()
+        for node_id in list(self.remote_presence):
+            if node_id not in live_nodes:
+                self._set_remote_users(node_id, None)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.PEER_REFRESH_SECONDS)
+            self._refresh_peers()
+
+    def _broadcast(self, envelope: dict):
+        if self._server is None:
+            return
+        for link in list(self.links.values()):
+            self._send(link, envelope)
+
+    def _send(self, link: _PeerLink, envelope: dict):
+        envelope["node"] = self.node_id
+        link.send(envelope)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Read one peer's link until it hangs up"""
+        last_seq = 0
+        try:
+            while True:
+                (size,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                envelope = json.loads(await reader.readexactly(size))
+                self.frames_received += 1
+                missed = envelope["seq"] - last_seq - 1
+                if missed > 0:
+                    self.frames_missed += missed
+                    print(f"Backplane lost {missed} frames from node {envelope['node']}")
+                last_seq = envelope["seq"]
+                try:
+                    self._handle(envelope)
+                except Exception as e:
+                    print(f"Backplane message dropped: {e!r}")
+        except asyncio.IncompleteReadError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Backplane peer connection failed: {e!r}")
+        finally:
+            writer.close()
+
+    def _handle(self, envelope: dict):
+        node_id = envelope["node"]
+        kind = envelope["kind"]
+
+        if kind == "message":
+            self._deliver(envelope["channel"], envelope["payload"])
+        elif kind == "presence":
+            users = set(self.remote_presence.get(node_id, ()))
+            if envelope["online"]:
+                users.add(envelope["user_id"])
+            else:
+                users.discard(envelope["user_id"])
+            self._set_remote_users(node_id, users)
+        elif kind == "hello":
+            self._set_remote_users(node_id, set(envelope["users"]))
+            self._send(self._link(node_id), {"kind": "presence_sync", "users": list(self.local_presence)})
+        elif kind == "presence_sync":
+            self._set_remote_users(node_id, set(envelope["users"]))
+        elif kind == "bye":
+            link = self.links.pop(node_id, None)
+            if link is not None:
+                link.cancel()
+            self._set_remote_users(node_id, None)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "frames_received": self.frames_received,
+            "frames_missed": self.frames_missed,
+            "dropped": sum(link.dropped for link in self.links.values()),
+            "peers": {node_id: link.stats() for node_id, link in self.links.items()},
+            "remote_users": {node_id: len(users) for node_id, users in self.remote_presence.items()},
+        })
+        return stats
+
+def create_backplane(url: str, on_message: MessageHandler, on_presence: Optional[PresenceHandler] = None) -> Backplane:
+    """Build a backplane from a URL: memory:// or unix:///path/to/dir"""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return InProcessBackplane(on_message, on_presence)
+    if parsed.scheme == "unix":
+        return UnixSocketBackplane(on_message, parsed.path, settings.backplane_peer_buffer_bytes, on_presence)
+    raise ValueError(f"Unsupported backplane URL: {url}")
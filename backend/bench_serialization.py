@@ -0,0 +1,103 @@
+# bench_serialization.py - compare pydantic validation with the fast_json path
+# Usage: python bench_serialization.py [rows]
+import os
+import sys
+import timeit
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+os.environ.setdefault("SECRET_KEY", "bench")  # config requires one; nothing here uses it
+
+from pydantic import TypeAdapter
+import fast_json
+import models
+import schemas
+from chat_crud import message_dict
+
+def sample_messages(count: int) -> List[models.Message]:
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        models.Message(
+            id=i, chat_id=1, sender_id=1 + i % 2, content=f"Message number {i} — ça va? <b>\"quoted\"</b>",
+            sent_at=start + timedelta(seconds=i, microseconds=i * 7), is_read=i % 3 == 0,
+            read_at=start + timedelta(minutes=i) if i % 3 == 0 else None
+        )
+        for i in range(count)
+    ]
+
+# What a column select returns; the old path loaded whole ORM objects
+MessageRow = namedtuple("MessageRow", "content id sender_id sent_at is_read read_at")
+
+def as_rows(messages: List[models.Message]) -> List[MessageRow]:
+    return [MessageRow(**message_dict(m)) for m in messages]
+
+def sample_chats(count: int, messages: List[models.Message]) -> List[dict]:
+    return [
+        {
+            "id": i,
+            "user1_id": 1,
+            "user2_id": i + 2,
+            "created_at": datetime(2025, 6, 1, 12, 0, 0),
+            "last_message_at": messages[i % len(messages)].sent_at,
+            "other_user": {"id": i + 2, "username": f"user{i}", "full_name": f"User Number {i}"},
+            "last_message": message_dict(messages[i % len(messages)]) if i % 4 else None,
+            "last_read_message_id": i - 1 if i % 3 else None,
+            "unread_count": i % 7
+        }
+        for i in range(count)
+    ]
+
+def sample_files(count: int) -> List[dict]:
+    return [
+        {
+            "filename": f"photo_{i}.jpg", "file_size": 1000 + i, "mime_type": "image/jpeg", "id": i,
+            "chat_id": 1, "uploaded_by": 1, "uploaded_at": datetime(2026, 2, 3, 4, 5, 6, i),
+            "download_url": f"/uploads/chat_1/{i}.jpg"
+        }
+        for i in range(count)
+    ]
+
+def bench(name: str, pydantic_path, fast_path, number: int):
+    expected, actual = pydantic_path(), fast_path()
+    match = "identical" if expected == actual else "DIFFERENT"
+    slow = timeit.timeit(pydantic_path, number=number) / number
+    fast = timeit.timeit(fast_path, number=number) / number
+    print(f"{name:<10} pydantic {slow * 1000:8.3f} ms   fast_json {fast * 1000:8.3f} ms   "
+          f"x{slow / fast:5.1f}   output {match}")
+    return expected == actual
+
+def paths(rows: int) -> dict:
+    """Endpoint name -> (pydantic path, fast_json path), both producing the response body"""
+    messages = sample_messages(rows)
+    message_rows = as_rows(messages)
+    chats = sample_chats(rows, messages)
+    files = sample_files(rows)
+    page_adapter = TypeAdapter(schemas.MessagePage)
+    chats_adapter = TypeAdapter(List[schemas.ChatPublic])
+    files_adapter = TypeAdapter(List[schemas.FilePublic])
+    return {
+        "messages": (
+            lambda: page_adapter.dump_json(page_adapter.validate_python(
+                {"messages": messages, "prev_cursor": "bTE", "next_cursor": None}, from_attributes=True
+            )),
+            lambda: fast_json.dumps(
+                {"messages": [message_dict(row) for row in message_rows], "prev_cursor": "bTE", "next_cursor": None}
+            )
+        ),
+        "chats": (
+            lambda: chats_adapter.dump_json(chats_adapter.validate_python(chats, from_attributes=True)),
+            lambda: fast_json.dumps([fast_json.chat_dict(chat) for chat in chats])
+        ),
+        "files": (
+            lambda: files_adapter.dump_json(files_adapter.validate_python(files, from_attributes=True)),
+            lambda: fast_json.dumps(files)
+        ),
+    }
+
+if __name__ == "__main__":
+    ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    number = max(10, 20000 // ROWS)
+    print(f"{ROWS} rows, orjson {'available' if fast_json.orjson else 'missing (pydantic_core fallback)'}")
+    results = [bench(name, *pair, number) for name, pair in paths(ROWS).items()]
+    sys.exit(0 if all(results) else 1)
@@ -1,155 +1,450 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, and_, func, case, select, update, tuple_, literal, bindparam, Integer
+from sqlalchemy.exc import IntegrityError
 import models
 import schemas
-from typing import List, Optional
+import base64
+from message_search import index_messages
+import message_archive
+from typing import List, Optional, Tuple
+from datetime import datetime, timezone
 
-def get_chat_between_users(db: Session, user1_id: int, user2_id: int):
+async def get_chat_between_users(db: AsyncSession, user1_id: int, user2_id: int):
     """Find chat between two users (order doesn't matter)"""
-    return db.query(models.Chat).filter(
+    return await db.scalar(select(models.Chat).where(
         or_(
             and_(models.Chat.user1_id == user1_id, models.Chat.user2_id == user2_id),
             and_(models.Chat.user1_id == user2_id, models.Chat.user2_id == user1_id)
         )
-    ).first()
+    ).limit(1))
 
-def create_chat(db: Session, user1_id: int, user2_id: int):
+async def create_chat(db: AsyncSession, user1_id: int, user2_id: int):
     """Create a new chat between two users"""
     # Ensure consistent ordering to avoid duplicate chats
     smaller_id, larger_id = sorted([user1_id, user2_id])
     
     db_chat = models.Chat(user1_id=smaller_id, user2_id=larger_id)
     db.add(db_chat)
-    db.commit()
-    db.refresh(db_chat)
-    
-    # Add other_user data directly to the chat object
-    other_user_id = user2_id if user1_id == smaller_id else user1_id
-    other_user = db.query(models.User).filter(models.User.id == other_user_id).first()
-    
-    db_chat.other_user = {
-        "id": other_user.id,
-        "username": other_user.username,
-        "full_name": other_user.full_name
-    }
-    
+    await db.flush()
+    # Read state of both participants lives next to the chat from the start
+    db.add_all([
+        models.ChatReadState(chat_id=db_chat.id, user_id=smaller_id),
+        models.ChatReadState(chat_id=db_chat.id, user_id=larger_id)
+    ])
+    await db.commit()
+    await db.refresh(db_chat)
     return db_chat
 
-def create_message(db: Session, message: schemas.MessageCreate, chat_id: int, sender_id: int):
-    """Create a new message in a chat"""
-    db_message = models.Message(
-        content=message.content,
-        chat_id=chat_id,
-        sender_id=sender_id
+async def get_chat_for_user(db: AsyncSession, chat_id: int, user_id: int):
+    """Get a chat only if the user is one of its participants"""
+    chat = await db.get(models.Chat, chat_id)
+    if not chat or (chat.user1_id != user_id and chat.user2_id != user_id):
+        return None
+    return chat
+
+async def get_chat_version(db: AsyncSession, chat_id: int, user_id: int) -> Optional[int]:
+    """The chat's version if the user is one of its participants, else None"""
+    return await db.scalar(select(models.Chat.version).where(
+        models.Chat.id == chat_id,
+        or_(models.Chat.user1_id == user_id, models.Chat.user2_id == user_id)
+    ))
+
+async def get_chat_list_version(db: AsyncSession, user_id: int) -> Tuple[int, int]:
+    """(number of chats, sum of their versions): changes whenever the user's chat list does"""
+    count, total = (await db.execute(select(
+        func.count(models.Chat.id), func.coalesce(func.sum(models.Chat.version), 0)
+    ).where(
+        or_(models.Chat.user1_id == user_id, models.Chat.user2_id == user_id)
+    ))).one()
+    return count, total
+
+async def get_message_by_client_id(db: AsyncSession, sender_id: int, client_msg_id: str):
+    """Find a message a sender already stored under their client-generated ID"""
+    return await db.scalar(select(models.Message).where(
+        models.Message.sender_id == sender_id,
+        models.Message.client_msg_id == client_msg_id
+    ))
+
+async def get_chat_partner_ids(db: AsyncSession, user_id: int):
+    """IDs of every user who shares a chat with this user"""
+    other_user_id = case(
+        (models.Chat.user1_id == user_id, models.Chat.user2_id),
+        else_=models.Chat.user1_id
     )
-    db.add(db_message)
-    
-    # Update chat's last message timestamp
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-    chat.last_message_at = db_message.sent_at
-    
-    db.commit()
-    db.refresh(db_message)
-    return db_message
+    rows = await db.scalars(select(other_user_id).where(
+        or_(models.Chat.user1_id == user_id, models.Chat.user2_id == user_id)
+    ))
+    return set(rows)
+
+async def create_messages(db: AsyncSession, items: List[Tuple[schemas.MessageCreate, int, int]]):
+    """Create a batch of (message, chat_id, sender_id) in one transaction.
+
+    The inserts, the chats' last_message_at and the read state counters each
+    go out as one statement batch. Returns (message, created) per item; a
+    retried send with a stored client_msg_id gets that message with
+    created=False. Raises IntegrityError if another transaction stored the
+    same client_msg_id meanwhile.
+    """
+    keys = {(sender_id, message.client_msg_id) for message, _, sender_id in items if message.client_msg_id is not None}
+    stored = {}
+    if keys:
+        rows = await db.scalars(select(models.Message).where(
+            tuple_(models.Message.sender_id, models.Message.client_msg_id).in_(keys)
+        ))
+        stored = {(row.sender_id, row.client_msg_id): row for row in rows}
+
+    # Set here rather than by the server default, so nothing has to be read back
+    sent_at = datetime.now(timezone.utc)
+    results, new_messages = [], []
+    for message, chat_id, sender_id in items:
+        key = (sender_id, message.client_msg_id)
+        if message.client_msg_id is not None and key in stored:
+            results.append((stored[key], False))
+            continue
+        db_message = models.Message(
+            content=message.content,
+            chat_id=chat_id,
+            sender_id=sender_id,
+            client_msg_id=message.client_msg_id,
+            sent_at=sent_at,
+            is_read=False
+        )
+        if message.client_msg_id is not None:
+            stored[key] = db_message
+        new_messages.append(db_message)
+        results.append((db_message, True))
+    if not new_messages:
+        return results
+
+    db.add_all(new_messages)
+    await db.flush()
+    await index_messages(db, [(m.id, m.content) for m in new_messages])
+
+    # Per chat and sender: how many were sent
+    sent = {}
+    for m in new_messages:
+        sent[(m.chat_id, m.sender_id)] = sent.get((m.chat_id, m.sender_id), 0) + 1
+
+    chats = models.Chat.__table__.c
+    await db.execute(
+        update(models.Chat.__table__).where(chats.id == bindparam("b_chat_id")).values(
+            last_message_at=bindparam("b_sent_at"),
+            version=chats.version + 1
+        ),
+        [{"b_chat_id": chat_id, "b_sent_at": sent_at} for chat_id in {m.chat_id for m in new_messages}]
+    )
+    # The recipient has more unread messages
+    states = models.ChatReadState.__table__.c
+    await db.execute(
+        update(models.ChatReadState.__table__).where(
+            states.chat_id == bindparam("b_chat_id"),
+            states.user_id != bindparam("b_sender_id")
+        ).values(unread_count=states.unread_count + bindparam("b_count", type_=Integer)),
+        [
+            {"b_chat_id": chat_id, "b_sender_id": sender_id, "b_count": count}
+            for (chat_id, sender_id), count in sent.items()
+        ]
+    )
+    await db.commit()
+    return results
+
+async def create_message(db: AsyncSession, message: schemas.MessageCreate, chat_id: int, sender_id: int):
+    """Create a new message in a chat.
+
+    Returns (message, created). A retried send with the same client_msg_id
+    returns the stored message with created=False.
+    """
+    try:
+        return (await create_messages(db, [(message, chat_id, sender_id)]))[0]
+    except IntegrityError:
+        await db.rollback()
+        if message.client_msg_id is None:
+            raise
+        # A concurrent retry stored the same client_msg_id first
+        return await get_message_by_client_id(db, sender_id, message.client_msg_id), False
+
+def message_columns(message=models.Message):
+    """The columns of schemas.MessagePublic, in its field order"""
+    return (message.content, message.id, message.sender_id, message.sent_at, message.is_read, message.read_at)
 
-def get_user_chats(db: Session, user_id: int):
-    """Get all chats for a user with the other user's info"""
-    chats = db.query(models.Chat).filter(
+def message_dict(row) -> dict:
+    """A selected message row (or archived Message) in schemas.MessagePublic's shape"""
+    return {
+        "content": row.content,
+        "id": row.id,
+        "sender_id": row.sender_id,
+        "sent_at": row.sent_at,
+        "is_read": row.is_read,
+        "read_at": row.read_at
+    }
+
+async def get_user_chats(db: AsyncSession, user_id: int, chat_id: Optional[int] = None):
+    """Get all chats for a user with the other user's info and the last message.
+
+    One query over just the columns of schemas.ChatPublic: the other
+    participant and the user's read state are joined in, and the last
+    message is found with a correlated subquery per chat. Returns dicts in
+    ChatPublic's shape. Pass chat_id to get one chat.
+    """
+    other_user = aliased(models.User)
+    last_message = aliased(models.Message)
+
+    other_user_id = case(
+        (models.Chat.user1_id == user_id, models.Chat.user2_id),
+        else_=models.Chat.user1_id
+    )
+    last_message_id = select(models.Message.id).where(
+        models.Message.chat_id == models.Chat.id
+    ).order_by(
+        models.Message.sent_at.desc(), models.Message.id.desc()
+    ).limit(1).correlate(models.Chat).scalar_subquery()
+
+    query = select(
+        models.Chat.id, models.Chat.user1_id, models.Chat.user2_id, models.Chat.created_at, models.Chat.last_message_at,
+        other_user.id.label("other_id"), other_user.username.label("other_username"),
+        other_user.full_name.label("other_full_name"),
+        *(column.label(f"message_{column.key}") for column in message_columns(last_message)),
+        models.ChatReadState.last_read_message_id, models.ChatReadState.unread_count
+    ).join(
+        other_user, other_user.id == other_user_id
+    ).outerjoin(
+        last_message, last_message.id == last_message_id
+    ).outerjoin(
+        models.ChatReadState,
+        and_(models.ChatReadState.chat_id == models.Chat.id, models.ChatReadState.user_id == user_id)
+    ).where(
         or_(models.Chat.user1_id == user_id, models.Chat.user2_id == user_id)
-    ).order_by(models.Chat.last_message_at.desc()).all()
-    
-    # Enhance with other user's info and last message
-    enhanced_chats = []
-    for chat in chats:
-        # Determine who the other user is
-        other_user_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
-        other_user = db.query(models.User).filter(models.User.id == other_user_id).first()
-        
-        # Get last message if exists
-        last_message = db.query(models.Message).filter(
-            models.Message.chat_id == chat.id
-        ).order_by(models.Message.sent_at.desc()).first()
-        
-        # Create enhanced chat data
-        chat_data = {
-            "id": chat.id,
-            "user1_id": chat.user1_id,
-            "user2_id": chat.user2_id,
-            "created_at": chat.created_at,
-            "last_message_at": chat.last_message_at,
+    )
+    if chat_id is not None:
+        query = query.where(models.Chat.id == chat_id)
+    rows = await db.execute(query.order_by(models.Chat.last_message_at.desc()))
+
+    return [
+        {
+            "id": row.id,
+            "user1_id": row.user1_id,
+            "user2_id": row.user2_id,
+            "created_at": row.created_at,
+            "last_message_at": row.last_message_at,
             "other_user": {
-                "id": other_user.id,
-                "username": other_user.username,
-                "full_name": other_user.full_name
+                "id": row.other_id,
+                "username": row.other_username,
+                "full_name": row.other_full_name
             },
-            "last_message": last_message
+            "last_message": {
+                "content": row.message_content,
+                "id": row.message_id,
+                "sender_id": row.message_sender_id,
+                "sent_at": row.message_sent_at,
+                "is_read": row.message_is_read,
+                "read_at": row.message_read_at
+            } if row.message_id is not None else None,
+            "last_read_message_id": row.last_read_message_id,
+            "unread_count": row.unread_count or 0
         }
-        enhanced_chats.append(chat_data)
-    
-    return enhanced_chats
+        for row in rows
+    ]
 
-def get_chat_messages(db: Session, chat_id: int, user_id: int):
-    """Get all messages for a chat if user is participant"""
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-    
-    if not chat or (chat.user1_id != user_id and chat.user2_id != user_id):
+def encode_message_cursor(message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"m{message_id}".encode()).decode().rstrip("=")
+
+def decode_message_cursor(cursor: str) -> int:
+    """Raises ValueError for a malformed cursor"""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    if not raw.startswith("m"):
+        raise ValueError("Invalid cursor")
+    return int(raw[1:])
+
+async def get_chat_messages(db: AsyncSession, chat_id: int, user_id: int, limit: int = 50,
+                            before: Optional[int] = None, after: Optional[int] = None):
+    """Get one page of a chat's messages, oldest first, if user is participant.
+
+    Keyset pagination on (sent_at, id): before/after are message IDs taken from
+    a cursor. Without either, the latest page is returned. Pages continue into
+    archived segments once the messages table runs out. Messages are rows of
+    message_columns() (or archived Message objects). Returns (messages,
+    has_older, has_newer), or None if the chat is not the user's.
+    """
+    if await get_chat_for_user(db, chat_id, user_id) is None:
         return None
-    
-    return db.query(models.Message).filter(
-        models.Message.chat_id == chat_id
-    ).order_by(models.Message.sent_at).all()
 
-def mark_messages_as_read(db: Session, message_ids: List[int], reader_id: int):
-    """Mark messages as read by a user"""
-    messages = db.query(models.Message).filter(
-        models.Message.id.in_(message_ids),
-        models.Message.sender_id != reader_id  # Can't mark own messages as read
-    ).all()
-    
-    for message in messages:
-        message.is_read = True
-        message.read_at = func.now()
-    
-    db.commit()
-    return messages
+    position = tuple_(models.Message.sent_at, models.Message.id)
+    query = select(*message_columns()).where(models.Message.chat_id == chat_id)
+
+    def cursor_position(message_id: int):
+        # Compare against the stored sent_at rather than a re-bound copy, so
+        # SQLite's text timestamps compare exactly
+        sent_at = select(models.Message.sent_at).where(
+            models.Message.id == message_id
+        ).scalar_subquery()
+        return tuple_(sent_at, literal(message_id))
+
+    async def is_hot(message_id: int) -> bool:
+        return await db.scalar(select(models.Message.id).where(
+            models.Message.id == message_id, models.Message.chat_id == chat_id
+        )) is not None
+
+    oldest_first = query.order_by(models.Message.sent_at, models.Message.id)
+
+    if after is not None:
+        if await is_hot(after):
+            rows = (await db.execute(oldest_first.where(position > cursor_position(after)).limit(limit + 1))).all()
+        else:
+            # Archived messages all precede the messages table; a purged cursor continues from its start
+            rows = await message_archive.archived_after(db, chat_id, after, limit + 1) or []
+            if len(rows) <= limit:
+                rows += (await db.execute(oldest_first.limit(limit + 1 - len(rows)))).all()
+        return rows[:limit], True, len(rows) > limit
+
+    if before is not None and not await is_hot(before):
+        rows = await message_archive.archived_before(db, chat_id, before, limit + 1)
+        return rows[-limit:], len(rows) > limit, True
+
+    if before is not None:
+        query = query.where(position < cursor_position(before))
+    rows = list(reversed((await db.execute(query.order_by(
+        models.Message.sent_at.desc(), models.Message.id.desc()
+    ).limit(limit + 1))).all()))
+    if len(rows) <= limit:
+        rows = await message_archive.archived_before(db, chat_id, None, limit + 1 - len(rows)) + rows
+    has_older = len(rows) > limit
+    return rows[-limit:], has_older, before is not None
+
+async def mark_messages_as_read(db: AsyncSession, message_ids: List[int], reader_id: int):
+    """Mark messages as read by a user with one UPDATE.
+
+    Returns one summary per affected chat: chat_id, first/last message ID,
+    count and read_at.
+    """
+    if not message_ids:
+        return []
 
-def get_unread_message_count(db: Session, user_id: int):
-    """Get count of unread messages for a user"""
-    return db.query(models.Message).join(models.Chat).filter(
-        models.Message.sender_id == user_id,
+    reader_chats = select(models.Chat.id).where(
+        or_(models.Chat.user1_id == reader_id, models.Chat.user2_id == reader_id)
+    )
+    readable = and_(
+        models.Message.id.in_(message_ids),
+        models.Message.sender_id != reader_id,  # Can't mark own messages as read
         models.Message.is_read == False,
-        or_(
-            models.Chat.user1_id != user_id,
-            models.Chat.user2_id != user_id
+        models.Message.chat_id.in_(reader_chats.scalar_subquery())
+    )
+
+    return await _read_messages(db, readable, reader_id)
+
+async def mark_chat_read_up_to(db: AsyncSession, chat_id: int, reader_id: int, up_to_message_id: int):
+    """Mark every message from the other participant in a chat with id <= up_to_message_id as read.
+
+    A client paging through history never holds every unread ID, so it
+    reports its newest visible message instead. Returns the same summaries
+    as mark_messages_as_read (at most one), or None if the chat is not the
+    reader's.
+    """
+    if await get_chat_for_user(db, chat_id, reader_id) is None:
+        return None
+    readable = and_(
+        models.Message.chat_id == chat_id,
+        models.Message.id <= up_to_message_id,
+        models.Message.sender_id != reader_id,
+        models.Message.is_read == False
+    )
+    return await _read_messages(db, readable, reader_id)
+
+async def _read_messages(db: AsyncSession, readable, reader_id: int):
+    """Flip the unread messages matching readable, then move the reader's watermarks and counters"""
+    # Only the rows this UPDATE flipped count; a concurrent read of the same messages gets none of them
+    read_at = datetime.now(timezone.utc)
+    flipped = (await db.execute(
+        update(models.Message).where(readable).values(is_read=True, read_at=read_at)
+        .returning(models.Message.chat_id, models.Message.id),
+        execution_options={"synchronize_session": False}
+    )).all()
+    if not flipped:
+        await db.commit()
+        return []
+
+    # chat_id -> (first, last, count)
+    summaries = {}
+    for chat_id, message_id in flipped:
+        first_id, last_id, count = summaries.get(chat_id, (message_id, message_id, 0))
+        summaries[chat_id] = (min(first_id, message_id), max(last_id, message_id), count + 1)
+
+    await db.execute(
+        update(models.Chat).where(models.Chat.id.in_(list(summaries))).values(
+            version=models.Chat.version + 1
+        ),
+        execution_options={"synchronize_session": False}
+    )
+    states = models.ChatReadState.__table__.c
+    read = bindparam("b_count", type_=Integer)
+    last_read = bindparam("b_last_id", type_=Integer)
+    await db.execute(
+        update(models.ChatReadState.__table__).where(
+            states.chat_id == bindparam("b_chat_id"),
+            states.user_id == reader_id
+        ).values(
+            # CASE rather than max()/GREATEST(), which differ between SQLite and PostgreSQL
+            last_read_message_id=case(
+                (or_(states.last_read_message_id.is_(None), states.last_read_message_id < last_read), last_read),
+                else_=states.last_read_message_id
+            ),
+            unread_count=case((states.unread_count > read, states.unread_count - read), else_=0)
+        ),
+        [
+            {"b_chat_id": chat_id, "b_last_id": last_id, "b_count": count}
+            for chat_id, (_, last_id, count) in summaries.items()
+        ]
+    )
+    await db.commit()
+
+    return [
+        {
+            "chat_id": chat_id,
+            "first_message_id": first_id,
+            "last_message_id": last_id,
+            "count": count,
+            "read_at": read_at
+        }
+        for chat_id, (first_id, last_id, count) in summaries.items()
+    ]
+
+async def get_unread_message_count(db: AsyncSession, user_id: int):
+    """Get count of unread messages for a user, summed from the per-chat counters"""
+    return await db.scalar(
+        select(func.coalesce(func.sum(models.ChatReadState.unread_count), 0)).where(
+            models.ChatReadState.user_id == user_id
         )
-    ).count()
+    )
     
     
-def create_file_record(db: Session, file_data: dict):
+async def create_file_record(db: AsyncSession, file_data: dict):
     """Create file record in database"""
     db_file = models.File(**file_data)
     db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
+    await db.commit()
+    await db.refresh(db_file)
     return db_file
 
-def get_file_by_id(db: Session, file_id: int):
+async def get_file_by_id(db: AsyncSession, file_id: int):
     """Get file by ID"""
-    return db.query(models.File).filter(models.File.id == file_id).first()
+    return await db.get(models.File, file_id)
 
-def get_chat_files(db: Session, chat_id: int):
-    """Get all files in a chat"""
-    return db.query(models.File).filter(models.File.chat_id == chat_id).order_by(models.File.uploaded_at.desc()).all()
+async def get_chat_files(db: AsyncSession, chat_id: int):
+    """Get all files in a chat, as rows of the columns schemas.FilePublic needs"""
+    return (await db.execute(select(
+        models.File.filename, models.File.file_size, models.File.mime_type, models.File.id,
+        models.File.chat_id, models.File.uploaded_by, models.File.uploaded_at, models.File.file_path
+    ).where(models.File.chat_id == chat_id).order_by(models.File.uploaded_at.desc()))).all()
 
-def delete_file_record(db: Session, file_id: int, user_id: int):
+async def delete_file_record(db: AsyncSession, file_id: int, user_id: int):
     """Delete file record from database"""
-    file = db.query(models.File).filter(
+    file = await db.scalar(select(models.File).where(
         models.File.id == file_id,
         models.File.uploaded_by == user_id
-    ).first()
+    ))
     
     if file:
-        db.delete(file)
-        db.commit()
+        await db.delete(file)
+        await db.commit()
         return True
     return False
\ No newline at end of file
@@ -0,0 +1,66 @@
+# Builders for the event dicts pushed to WebSocket clients, shared by the
+# HTTP routers and the WebSocket handlers so both send identical frames.
+from fast_json import isoformat
+import models
+
+def message_payload(db_message: models.Message) -> dict:
+    return {
+        "id": db_message.id,
+        "content": db_message.content,
+        "sender_id": db_message.sender_id,
+        "sent_at": isoformat(db_message.sent_at),
+        "is_read": db_message.is_read
+    }
+
+def new_message_event(db_message: models.Message, chat_id: int) -> dict:
+    return {
+        "type": "new_message",
+        "message": message_payload(db_message),
+        "chat_id": chat_id
+    }
+
+def message_ack_event(db_message: models.Message, chat_id: int, client_msg_id: str, duplicate: bool) -> dict:
+    """Sent back to the sender once a WebSocket send_message is stored"""
+    return {
+        "type": "message_ack",
+        "client_msg_id": client_msg_id,
+        "chat_id": chat_id,
+        "message": message_payload(db_message),
+        "duplicate": duplicate
+    }
+
+def message_error_event(client_msg_id, chat_id, detail: str) -> dict:
+    return {
+        "type": "message_error",
+        "client_msg_id": client_msg_id,
+        "chat_id": chat_id,
+        "detail": detail
+    }
+
+def chat_error_event(chat_id, detail: str) -> dict:
+    """Sent back when a join_chat, resume or typing frame is refused"""
+    return {
+        "type": "chat_error",
+        "chat_id": chat_id,
+        "detail": detail
+    }
+
+def frame_error_event(frame_type, detail: str) -> dict:
+    """Sent back for a frame that could not be decoded or is missing what its type needs"""
+    return {
+        "type": "error",
+        "frame_type": frame_type,
+        "detail": detail
+    }
+
+def messages_read_event(summary: dict, reader_id: int) -> dict:
+    """One receipt per chat: every message from first_message_id to last_message_id was read"""
+    return {
+        "type": "messages_read",
+        "chat_id": summary["chat_id"],
+        "reader_id": reader_id,
+        "first_message_id": summary["first_message_id"],
+        "last_message_id": summary["last_message_id"],
+        "count": summary["count"],
+        "read_at": isoformat(summary["read_at"])
+    }
@@ -0,0 +1,73 @@
+"""Conditional GET for versioned responses.
+
+A handler works out a cheap version token first (one aggregate query),
+turns it into an ETag, and hands conditional_response a render function.
+A matching If-None-Match gets 304 without loading or serializing anything;
+otherwise the body comes from the render cache, or is rendered and cached.
+"""
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from fastapi import Request, Response
+from config import settings
+
+class RenderCache:
+    """Bounded LRU of rendered JSON bodies keyed by ETag; a new version means a new key"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, etag: str) -> Optional[bytes]:
+        body = self._entries.get(etag)
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(etag)
+        return body
+
+    def set(self, etag: str, body: bytes):
+        self._entries[etag] = body
+        self._entries.move_to_end(etag)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": sum(len(body) for body in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+# Global instance
+render_cache = RenderCache(settings.render_cache_max_entries)
+
+def make_etag(*parts) -> str:
+    return '"' + ".".join(str(part) for part in parts) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match calls for"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+async def conditional_response(request: Request, etag: str, render: Callable[[], Awaitable[bytes]]) -> Response:
+    # Clients must revalidate every time, but may keep the body
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        render_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    body = render_cache.get(etag)
+    if body is None:
+        body = await render()
+        render_cache.set(etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
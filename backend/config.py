@@ -1,5 +1,6 @@
 # config.py - SECURE VERSION
 from pydantic_settings import BaseSettings
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
 
@@ -7,10 +8,81 @@ class Settings(BaseSettings):
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # bcrypt work factor, and the dedicated pool that runs it
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    # Logins/registrations waiting beyond this are refused with 503
+    password_hash_max_queue: int = 32
+    # Decoded tokens and their users are cached per process for this long
+    auth_cache_enabled: bool = True
+    auth_cache_ttl_seconds: float = 60.0
+    auth_cache_max_entries: int = 10000
+    # Connection pool of the async engine, per worker process
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    # Wait this long for a free connection before failing the request
+    db_pool_timeout_seconds: float = 30.0
+    # Replace connections older than this, before the server or a proxy drops them
+    db_pool_recycle_seconds: int = 1800
+    # SQLite profile, applied to every connection of a file database
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size_bytes: int = 256 * 1024 * 1024
+    sqlite_cache_size_kib: int = 64 * 1024
+    # Funnel all writes of a process through one connection instead of racing for the lock
+    sqlite_single_writer: bool = True
+    # Write transactions that may wait for the writer before callers are held back
+    db_write_queue_size: int = 1000
+    # Rendered chat list and history bodies kept per process, keyed by ETag
+    render_cache_max_entries: int = 1024
+    # Sends arriving within this window are committed together, up to the batch size
+    message_batch_window_ms: float = 2.0
+    message_batch_max_size: int = 256
+    # Move messages older than this into compressed per-chat segments; unset disables the archiver
+    archive_after_days: Optional[int] = None
+    archive_interval_seconds: float = 3600.0
+    archive_codec: Literal["zlib", "lzma"] = "zlib"
+    archive_segment_size: int = 500
+    # Segments written per archiver run, each in its own write transaction
+    archive_max_segments_per_run: int = 200
+    # Delete archived segments whose newest message is older than this; unset keeps them forever
+    message_retention_days: Optional[int] = None
+    purge_batch_size: int = 100
+    # Apply pending schema migrations at startup (single-process setups)
+    auto_migrate: bool = True
     
     # For production - get from environment
     environment: str = "development"
     frontend_url: str = "http://localhost:3000"
+    # Required as X-Admin-Token for /admin endpoints; unset hides them
+    admin_token: Optional[str] = None
+    # Open /admin without a token when admin_token is unset; local debugging only
+    admin_allow_unauthenticated: bool = False
+
+    # WebSocket fan-out: each connection gets a bounded outbound queue
+    ws_send_queue_size: int = 256
+    ws_slow_consumer_policy: Literal["drop_oldest", "coalesce", "disconnect"] = "drop_oldest"
+    ws_send_timeout_seconds: float = 10.0
+    # Quiet sockets get a ping; no inbound frame (pong or other) for the timeout reaps them
+    ws_ping_interval_seconds: float = 20.0
+    ws_idle_timeout_seconds: float = 60.0
+    # The first frame must be {"type": "auth", "token": ...}; sockets that don't send it in time are closed
+    ws_auth_timeout_seconds: float = 10.0
+    # A typing indicator with no refresh for this long is reported as stopped
+    typing_timeout_seconds: float = 5.0
+    # Events kept per chat (and chats kept) so reconnecting clients can resume from a seq
+    replay_buffer_size: int = 256
+    replay_max_chats: int = 10000
+    # Online/offline changes shorter than this (reloads, blips) are not announced
+    presence_debounce_seconds: float = 3.0
+    # Offline users whose last_seen is remembered; the longest-offline are forgotten first
+    presence_max_last_seen: int = 100000
+
+    # Cross-process broadcast: memory:// for one worker, unix:///some/dir for several on one host
+    backplane_url: str = "memory://"
+    # Frames waiting for one peer process; past this its new frames are dropped and counted
+    backplane_peer_buffer_bytes: int = 8 * 1024 * 1024
     
     class Config:
         env_file = ".env"
@@ -1,22 +1,22 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 import schemas
-import auth
+from user_search import index_user
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username))
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email))
 
-def create_user(db: Session, user: schemas.UserCreate):
+async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
     # Check for both username AND email uniqueness
-    if get_user_by_username(db, user.username):
+    if await get_user_by_username(db, user.username):
         raise ValueError("Username already registered")
-    if get_user_by_email(db, user.email):
+    if await get_user_by_email(db, user.email):
         raise ValueError("Email already registered")
-    
-    hashed_password = auth.get_password_hash(user.password)
+
     db_user = models.User(
         full_name=user.full_name,
         username=user.username,
@@ -24,6 +24,28 @@ def create_user(db: Session, user: schemas.UserCreate):
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
\ No newline at end of file
+    await db.flush()
+    await index_user(db, db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def update_user_full_name(db: AsyncSession, user_id: int, full_name: str):
+    user = await db.get(models.User, user_id)
+    user.full_name = full_name
+    await index_user(db, user)
+    # The name shows in the other participant's chat list
+    await db.execute(
+        update(models.Chat).where(
+            or_(models.Chat.user1_id == user_id, models.Chat.user2_id == user_id)
+        ).values(version=models.Chat.version + 1),
+        execution_options={"synchronize_session": False}
+    )
+    await db.commit()
+    await db.refresh(user)
+    return user
+
+async def update_password_hash(db: AsyncSession, user_id: int, hashed_password: str):
+    user = await db.get(models.User, user_id)
+    user.hashed_password = hashed_password
+    await db.commit()
@@ -1,16 +1,103 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config import settings
 
+# Async drivers for the configured database: aiosqlite locally, asyncpg in production
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str):
+    """The database_url with its driver swapped for the async one"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend])
+
+def is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+def pool_options(url: str) -> dict:
+    # An in-memory SQLite database lives in a single connection, nothing to size
+    if make_url(url).get_backend_name() == "sqlite" and not is_sqlite_file(url):
+        return {}
+    options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+    }
+    if is_sqlite_file(url):
+        # Older SQLAlchemy releases default aiosqlite files to NullPool, which takes no sizing
+        options["poolclass"] = AsyncAdaptedQueuePool
+    return options
+
+def apply_sqlite_profile(sync_engine, read_only: bool = False, immediate: bool = False):
+    """Connect-time pragmas for SQLite serving concurrent requests.
+
+    WAL lets readers run alongside the writer, synchronous=NORMAL is durable
+    enough under WAL, busy_timeout waits out other processes' writes, and
+    mmap/cache keep hot pages in memory. read_only connections refuse
+    writes; immediate ones take the write lock when their transaction begins.
+    """
+    @event.listens_for(sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        if immediate:
+            # Let SQLAlchemy's begin event below issue BEGIN itself
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_bytes)}")
+        # Negative means KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size={-int(settings.sqlite_cache_size_kib)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    if immediate:
+        @event.listens_for(sync_engine, "begin")
+        def begin_immediate(conn):
+            # A deferred transaction that later writes can fail with SQLITE_BUSY instead of waiting
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+# SQLite with one writer connection fed by db_writer; readers share the pool
+SQLITE_SINGLE_WRITER = is_sqlite_file(settings.database_url) and settings.sqlite_single_writer
+
+# Sync engine, for migrations and scripts only; request handlers use the async one
 engine = create_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = create_async_engine(async_database_url(settings.database_url), **pool_options(settings.database_url))
+# Objects stay usable after commit; lazy loads are not available on AsyncSession anyway
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+if is_sqlite_file(settings.database_url):
+    apply_sqlite_profile(engine)
+    apply_sqlite_profile(async_engine.sync_engine, read_only=SQLITE_SINGLE_WRITER)
+
+if SQLITE_SINGLE_WRITER:
+    write_engine = create_async_engine(
+        async_database_url(settings.database_url), poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0
+    )
+    apply_sqlite_profile(write_engine.sync_engine, immediate=True)
+    WriteSessionLocal = async_sessionmaker(write_engine, expire_on_commit=False, autoflush=False)
+else:
+    write_engine = async_engine
+    WriteSessionLocal = AsyncSessionLocal
+
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import asyncio
+from typing import Awaitable, Callable, Optional, TypeVar
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import SQLITE_SINGLE_WRITER, WriteSessionLocal
+
+T = TypeVar("T")
+WriteJob = Callable[[AsyncSession], Awaitable[T]]
+
+class DatabaseWriter:
+    """Write transactions, each given its own session.
+
+    On SQLite they are queued and run one at a time on the single writer
+    connection, so concurrent requests never race for the database lock.
+    Other databases handle concurrent writers themselves, so jobs run
+    straight away on a pooled session.
+    """
+
+    def __init__(self, serialize: bool, max_queue: int):
+        self.serialize = serialize
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, job: WriteJob) -> T:
+        """Run job(session) as a write transaction and return its result"""
+        if not self.serialize:
+            async with WriteSessionLocal() as db:
+                return await job(db)
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._work())
+        future = asyncio.get_running_loop().create_future()
+        # Waits here when the queue is full, pushing back on callers
+        await self._queue.put((job, future))
+        return await future
+
+    async def _work(self):
+        while True:
+            job, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            try:
+                async with WriteSessionLocal() as db:
+                    result = await job(db)
+            except Exception as e:
+                self.failed += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                self.completed += 1
+                if not future.cancelled():
+                    future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "serialized": self.serialize,
+            "queue_depth": self._queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # The queue belongs to the loop that used it; start afresh if the app is started again
+            self._queue = asyncio.Queue(maxsize=self._queue.maxsize)
+
+# Global instance
+db_writer = DatabaseWriter(SQLITE_SINGLE_WRITER, settings.db_write_queue_size)
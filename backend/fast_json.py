@@ -0,0 +1,35 @@
+"""JSON bodies for hot list endpoints, rendered straight from selected rows.
+
+Handlers build plain dicts in their response schema's field order and pass
+them to dumps(), skipping per-field pydantic validation. The bytes match
+what pydantic renders for the schema: compact separators, UTF-8, and UTC
+datetimes with a Z suffix (checked by bench_serialization.py).
+"""
+from datetime import datetime, timezone
+from typing import Any
+from fastapi import Response
+import pydantic_core
+
+try:
+    import orjson
+except ImportError:  # optional, pydantic_core renders the same bytes a little slower
+    orjson = None
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_UTC_Z)
+    return pydantic_core.to_json(value)
+
+def isoformat(value: datetime) -> str:
+    """A UTC datetime as dumps() renders it, for events built as plain strings"""
+    return value.isoformat().replace("+00:00", "Z")
+
+def chat_dict(chat: dict) -> dict:
+    """A get_user_chats dict with schemas.ChatPublic's defaults applied"""
+    if chat["last_message_at"] is None:
+        # Same fallback as ChatPublic's validator
+        chat = {**chat, "last_message_at": datetime.now(timezone.utc)}
+    return chat
+
+def json_response(value: Any, **kwargs) -> Response:
+    return Response(content=dumps(value), media_type="application/json", **kwargs)
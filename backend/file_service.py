@@ -1,8 +1,16 @@
+import hashlib
 import os
 import uuid
-from fastapi import UploadFile, HTTPException
-from typing import Tuple
-import shutil
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13 names its package multipart
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
 
 UPLOAD_DIR = "uploads"
 IMAGES_DIR = os.path.join(UPLOAD_DIR, "images")
@@ -27,6 +35,8 @@ ALLOWED_DOCUMENT_TYPES = {
 }
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
 
 def get_file_category(mime_type: str) -> str:
     """Determine file category based on MIME type"""
@@ -37,48 +47,145 @@ def get_file_category(mime_type: str) -> str:
     else:
         return 'other'
 
-def validate_file(file: UploadFile) -> Tuple[bool, str]:
-    """Validate file type and size"""
-    # Check file size
-    file.file.seek(0, 2)  # Seek to end
-    file_size = file.file.tell()
-    file.file.seek(0)  # Reset to beginning
-    
-    if file_size > MAX_FILE_SIZE:
-        return False, f"File size {file_size} exceeds maximum allowed size {MAX_FILE_SIZE}"
-    
-    # Check MIME type
-    file_category = get_file_category(file.content_type)
-    if file_category == 'other':
-        return False, f"File type {file.content_type} is not allowed"
-    
-    return True, ""
-
-def save_uploaded_file(file: UploadFile, chat_id: int) -> Tuple[str, str]:
-    """Save uploaded file and return file path and unique filename"""
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    
-    # Determine save directory based on file type
-    file_category = get_file_category(file.content_type)
-    if file_category == 'image':
-        save_dir = IMAGES_DIR
-    else:
-        save_dir = DOCUMENTS_DIR
-    
-    # Create chat-specific subdirectory
-    chat_dir = os.path.join(save_dir, str(chat_id))
-    os.makedirs(chat_dir, exist_ok=True)
-    
-    # Full file path
-    file_path = os.path.join(chat_dir, unique_filename)
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    return file_path, unique_filename
+class StoredUpload(NamedTuple):
+    filename: str
+    mime_type: str
+    file_path: str
+    file_size: int
+    sha256: str
+
+class _PendingUpload:
+    """A file part being written to a temp file beside its final path; methods block, run them in a thread"""
+
+    def __init__(self, chat_id: int, filename: str, mime_type: str):
+        save_dir = IMAGES_DIR if get_file_category(mime_type) == 'image' else DOCUMENTS_DIR
+        chat_dir = os.path.join(save_dir, str(chat_id))
+        os.makedirs(chat_dir, exist_ok=True)
+        self.filename = filename
+        self.mime_type = mime_type
+        self.file_path = os.path.join(chat_dir, f"{uuid.uuid4()}{os.path.splitext(filename)[1]}")
+        self.temp_path = self.file_path + ".part"
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(self.temp_path, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def commit(self) -> StoredUpload:
+        """Make the file durable, then move it into place in one step"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.file_path)
+        return StoredUpload(self.filename, self.mime_type, self.file_path, self.size, self._hash.hexdigest())
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class _MultipartEvents:
+    """python-multipart callbacks, queued as (kind, payload) to be handled between parser writes"""
+
+    def __init__(self):
+        self.events: List[Tuple[str, object]] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._field = b""
+        self._value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+    def on_headers_finished(self):
+        self.events.append(("headers", self._headers))
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        # The parser reuses its buffer, so the slice is copied here
+        self.events.append(("data", data[start:end]))
+
+    def on_part_end(self):
+        self.events.append(("end", None))
+
+    def drain(self) -> List[Tuple[str, object]]:
+        events, self.events = self.events, []
+        return events
+
+async def receive_upload(request: Request, chat_id: int, field_name: str = "file") -> StoredUpload:
+    """Stream the request's multipart file part to disk.
+
+    Chunks are written to a temp file (and hashed) in a worker thread as
+    they arrive, so the event loop never blocks on disk. The upload is
+    refused with 413 as soon as it passes MAX_FILE_SIZE, and with 400 for a
+    disallowed type before any of it is written. The temp file is renamed
+    into place only once the whole body has arrived.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    declared_length = request.headers.get("content-length", "")
+    if declared_length.isdigit() and int(declared_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File exceeds maximum allowed size {MAX_FILE_SIZE}")
+
+    parts = _MultipartEvents()
+    parser = MultipartParser(params[b"boundary"], parts.callbacks())
+    pending: Optional[_PendingUpload] = None
+    complete = False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, payload in parts.drain():
+                if kind == "headers" and pending is None:
+                    _, options = parse_options_header(payload.get(b"content-disposition", b""))
+                    if options.get(b"name") != field_name.encode() or b"filename" not in options:
+                        continue
+                    mime_type = payload.get(b"content-type", b"application/octet-stream").decode("latin-1")
+                    if get_file_category(mime_type) == 'other':
+                        raise HTTPException(status_code=400, detail=f"File type {mime_type} is not allowed")
+                    filename = options[b"filename"].decode("utf-8", "replace")
+                    pending = await run_in_threadpool(_PendingUpload, chat_id, filename, mime_type)
+                elif kind == "data" and pending is not None and not complete:
+                    if pending.size + len(payload) > MAX_FILE_SIZE:
+                        raise HTTPException(status_code=413, detail=f"File exceeds maximum allowed size {MAX_FILE_SIZE}")
+                    await run_in_threadpool(pending.write, payload)
+                elif kind == "end" and pending is not None:
+                    complete = True
+        parser.finalize()
+        if pending is None:
+            raise HTTPException(status_code=400, detail=f"No file in form field '{field_name}'")
+        if not complete:
+            raise HTTPException(status_code=400, detail="Incomplete upload")
+        return await run_in_threadpool(pending.commit)
+    except BaseException as e:
+        # Oversized, malformed or disconnected: leave nothing behind
+        if pending is not None:
+            await run_in_threadpool(pending.discard)
+        if isinstance(e, MultipartParseError):
+            raise HTTPException(status_code=400, detail="Malformed multipart body") from e
+        raise
 
 def get_file_url(file_path: str) -> str:
     """Generate URL for accessing the file"""
@@ -1,21 +1,43 @@
 from fastapi import FastAPI
-from database import engine
-import models
+from starlette.concurrency import run_in_threadpool
 from routers import auth, users, chats
 from fastapi.middleware.cors import CORSMiddleware
-from routers import files
+from routers import files, admin
 from config import settings
+from contextlib import asynccontextmanager
+from websocket_manager import manager
+from database import async_engine, write_engine
+from db_writer import db_writer
+from message_pipeline import message_pipeline
+from password_hasher import password_hasher
+from message_archive import archiver
+import migrate
 
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bring the schema up to date; deployments with several workers run `python migrate.py` first instead
+    if settings.auto_migrate:
+        await run_in_threadpool(migrate.upgrade)
+    # Join the broadcast backplane so events reach sockets on other workers
+    await manager.start()
+    await archiver.start()
+    yield
+    await archiver.stop()
+    await manager.stop()
+    await message_pipeline.stop()
+    await db_writer.stop()
+    await async_engine.dispose()
+    await write_engine.dispose()
+    password_hasher.shutdown()
 
 app = FastAPI(
     title="Chat App API",
     description="Real-time Chat Application", 
     version="1.0.0",
     docs_url="/docs" if settings.environment == "development" else None,
-    redoc_url=None
+    redoc_url=None,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -37,72 +59,77 @@ app.include_router(auth.router, prefix="/auth", tags=["authentication"])
 app.include_router(chats.router, prefix="/chats", tags=["chats"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(files.router, tags=['files'])
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
 
 @app.get("/")
 def read_root():
     return {"message": "Chat App API is running"}
 
+import asyncio
 from fastapi import WebSocket, WebSocketDisconnect
-from websocket_manager import manager
-import json
+from ws_codec import negotiate_codec, decode_frame, OutboundFrame
+from ws_handlers import dispatch
+from typing_service import typing_tracker
+from chat_events import frame_error_event
+from database import AsyncSessionLocal
+import auth
+
+async def _token_matches_user(token: str, user_id: int) -> bool:
+    async with AsyncSessionLocal() as db:
+        return await auth.get_user_id_from_token(db, token) == user_id
+
+async def _authenticate(websocket: WebSocket, codec, user_id: int) -> bool:
+    """Wait for the first frame, {"type": "auth", "token": ...}, and check it is user_id's token.
+
+    The token travels in a frame rather than the URL so it never lands in access logs.
+    """
+    try:
+        message = await asyncio.wait_for(websocket.receive(), settings.ws_auth_timeout_seconds)
+    except asyncio.TimeoutError:
+        return False
+    if message["type"] == "websocket.disconnect":
+        return False
+    try:
+        frame = decode_frame(codec, message)
+    except ValueError:
+        return False
+    if not isinstance(frame, dict) or frame.get("type") != "auth" or not isinstance(frame.get("token"), str):
+        return False
+    return await _token_matches_user(frame["token"], user_id)
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket, user_id)
+    # JSON by default; clients may ask for a binary codec via subprotocol or ?codec=
+    codec, subprotocol = negotiate_codec(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    # Refused before it counts as presence or joins the user's channel
+    if not await _authenticate(websocket, codec, user_id):
+        await websocket.close(code=1008)
+        return
+    connection = await manager.connect(websocket, user_id, codec)
+    connection.authenticated = True
     try:
         while True:
             # Wait for any message from client
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # Handle different types of messages
-            if message_data["type"] == "join_chat":
-                await manager.join_chat(user_id, message_data["chat_id"])
-                print(f"User {user_id} joined chat {message_data['chat_id']}")
-            
-            elif message_data["type"] == "typing":
-                # Broadcast typing indicator to other users in chat
-                await manager.broadcast_to_chat(
-                    json.dumps({
-                        "type": "typing",
-                        "user_id": user_id,
-                        "chat_id": message_data["chat_id"],
-                        "is_typing": message_data["is_typing"]
-                    }),
-                    message_data["chat_id"],
-                    exclude_user_id=user_id
-                )
-                print(f"User {user_id} typing in chat {message_data['chat_id']}")
-            
-            elif message_data["type"] == "message_read":
-                # Handle read receipts
-                await manager.broadcast_to_chat(
-                    json.dumps({
-                        "type": "message_read",
-                        "message_id": message_data["message_id"],
-                        "reader_id": user_id,
-                        "chat_id": message_data["chat_id"]
-                    }),
-                    message_data["chat_id"],
-                    exclude_user_id=user_id
-                )
-            
-            elif message_data["type"] == "file_uploaded":
-                # Handle file upload notifications
-                await manager.broadcast_to_chat(
-                    json.dumps({
-                        "type": "file_uploaded",
-                        "file": message_data["file"],
-                        "chat_id": message_data["chat_id"],
-                        "uploaded_by": user_id
-                    }),
-                    message_data["chat_id"],
-                    exclude_user_id=user_id
-                )
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            connection.touch()
+            try:
+                message_data = decode_frame(codec, message)
+            except ValueError:
+                connection.enqueue(OutboundFrame(frame_error_event(None, "Malformed frame")))
+                continue
+            if message_data is not None:
+                await dispatch(connection, message_data)
                 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
         print(f"User {user_id} disconnected from WebSocket")
+    finally:
+        manager.disconnect(connection)
+        if not manager.is_connected(user_id):
+            await typing_tracker.clear_user(user_id)
         
 
 # In main.py - Add temporary test endpoint
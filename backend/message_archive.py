@@ -0,0 +1,286 @@
+"""Cold storage for old message history.
+
+A background archiver moves each chat's messages older than
+archive_after_days out of the messages table into compressed segments
+(message_archive_segments), oldest first, so a chat's segments in ID order
+followed by its remaining messages are its whole history in (sent_at, id)
+order. chat_crud.get_chat_messages reads through to them when paging back.
+The newest message of a chat always stays in the messages table for the
+chat list preview, and so does every message from the oldest unread one
+on, which keeps read receipts and unread counts working. Archived
+messages are no longer searchable.
+"""
+import asyncio
+import json
+import lzma
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from database import AsyncSessionLocal
+from db_writer import db_writer
+from message_search import unindex_messages
+import models
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    # Segments written from SQLite rows hold naive UTC timestamps
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+def encode_segment(messages: List[models.Message], codec: str) -> bytes:
+    rows = [
+        [m.id, m.sender_id, m.content, _isoformat(m.sent_at), m.is_read, _isoformat(m.read_at), m.client_msg_id]
+        for m in messages
+    ]
+    compress, _ = CODECS[codec]
+    return compress(json.dumps(rows, separators=(",", ":")).encode())
+
+def decode_segment(segment: models.MessageArchiveSegment) -> List[models.Message]:
+    """The segment's messages, oldest first, as transient (unsaved) Message objects"""
+    _, decompress = CODECS[segment.codec]
+    return [
+        models.Message(
+            id=message_id, chat_id=segment.chat_id, sender_id=sender_id, content=content,
+            sent_at=_parse(sent_at), is_read=is_read, read_at=_parse(read_at), client_msg_id=client_msg_id
+        )
+        for message_id, sender_id, content, sent_at, is_read, read_at, client_msg_id
+        in json.loads(decompress(segment.payload))
+    ]
+
+async def _locate(db: AsyncSession, chat_id: int, message_id: int):
+    """(segment, its messages, index of message_id), or None if it is not archived"""
+    candidates = await db.scalars(select(models.MessageArchiveSegment).where(
+        models.MessageArchiveSegment.chat_id == chat_id,
+        models.MessageArchiveSegment.min_message_id <= message_id,
+        models.MessageArchiveSegment.max_message_id >= message_id
+    ))
+    for segment in candidates:
+        messages = decode_segment(segment)
+        for index, message in enumerate(messages):
+            if message.id == message_id:
+                return segment, messages, index
+    return None
+
+async def _next_segment(db: AsyncSession, chat_id: int, boundary: Optional[int], older: bool):
+    query = select(models.MessageArchiveSegment).where(models.MessageArchiveSegment.chat_id == chat_id)
+    if older:
+        if boundary is not None:
+            query = query.where(models.MessageArchiveSegment.id < boundary)
+        query = query.order_by(models.MessageArchiveSegment.id.desc())
+    else:
+        if boundary is not None:
+            query = query.where(models.MessageArchiveSegment.id > boundary)
+        query = query.order_by(models.MessageArchiveSegment.id)
+    return await db.scalar(query.limit(1))
+
+async def archived_before(db: AsyncSession, chat_id: int, message_id: Optional[int], count: int):
+    """Up to count archived messages just before message_id (or the newest ones), oldest first"""
+    if count <= 0:
+        return []
+    chunks, boundary = [], None
+    if message_id is not None:
+        found = await _locate(db, chat_id, message_id)
+        if found is None:
+            return []
+        segment, messages, index = found
+        chunks.append(messages[:index])
+        boundary = segment.id
+    remaining = count - sum(len(chunk) for chunk in chunks)
+    while remaining > 0:
+        segment = await _next_segment(db, chat_id, boundary, older=True)
+        if segment is None:
+            break
+        messages = decode_segment(segment)
+        chunks.append(messages)
+        remaining -= len(messages)
+        boundary = segment.id
+    return [m for chunk in reversed(chunks) for m in chunk][-count:]
+
+async def archived_after(db: AsyncSession, chat_id: int, message_id: int, count: int):
+    """Up to count archived messages just after message_id, oldest first; None if it is not archived"""
+    found = await _locate(db, chat_id, message_id)
+    if found is None:
+        return None
+    segment, messages, index = found
+    collected = messages[index + 1:]
+    boundary = segment.id
+    while len(collected) < count:
+        segment = await _next_segment(db, chat_id, boundary, older=False)
+        if segment is None:
+            break
+        collected.extend(decode_segment(segment))
+        boundary = segment.id
+    return collected[:count]
+
+def _archivable(cutoff: datetime):
+    """Messages that may be archived: sent before cutoff, not their chat's newest, before its oldest unread"""
+    newer = aliased(models.Message)
+    newest_id = select(func.max(newer.id)).where(newer.chat_id == models.Message.chat_id).scalar_subquery()
+    unread = aliased(models.Message)
+    # Segments must stay a prefix of the history, so archiving stops short of the oldest unread message
+    oldest_unread_id = select(func.min(unread.id)).where(
+        unread.chat_id == models.Message.chat_id,
+        unread.is_read == False
+    ).scalar_subquery()
+    return and_(
+        models.Message.sent_at < cutoff,
+        models.Message.id != newest_id,
+        or_(oldest_unread_id.is_(None), models.Message.id < oldest_unread_id)
+    )
+
+async def archive_chat_segment(db: AsyncSession, chat_id: int, cutoff: datetime, size: int, codec: str) -> int:
+    """Move up to size of a chat's oldest messages sent before cutoff into one segment.
+
+    A write job; returns how many messages were archived.
+    """
+    # Row locks keep two workers from archiving the same messages on PostgreSQL
+    messages = (await db.scalars(
+        select(models.Message).where(
+            models.Message.chat_id == chat_id,
+            _archivable(cutoff)
+        ).order_by(models.Message.sent_at, models.Message.id).limit(size).with_for_update()
+    )).all()
+    if not messages:
+        return 0
+
+    ids = [m.id for m in messages]
+    db.add(models.MessageArchiveSegment(
+        chat_id=chat_id,
+        min_message_id=min(ids),
+        max_message_id=max(ids),
+        first_sent_at=messages[0].sent_at,
+        last_sent_at=messages[-1].sent_at,
+        message_count=len(messages),
+        codec=codec,
+        payload=encode_segment(messages, codec)
+    ))
+    await unindex_messages(db, [(m.id, m.content) for m in messages])
+    await db.execute(delete(models.Message).where(models.Message.id.in_(ids)))
+    await db.commit()
+    return len(messages)
+
+async def purge_segments(db: AsyncSession, cutoff: datetime, batch_size: int) -> int:
+    """Delete up to batch_size segments whose newest message is older than cutoff; a write job"""
+    expired = select(models.MessageArchiveSegment.id).where(
+        models.MessageArchiveSegment.last_sent_at < cutoff
+    ).order_by(models.MessageArchiveSegment.id).limit(batch_size)
+    ids = (await db.scalars(expired)).all()
+    if ids:
+        chat_ids = select(models.MessageArchiveSegment.chat_id).where(models.MessageArchiveSegment.id.in_(ids))
+        # Their history pages lose messages
+        await db.execute(
+            update(models.Chat).where(models.Chat.id.in_(chat_ids)).values(version=models.Chat.version + 1),
+            execution_options={"synchronize_session": False}
+        )
+        await db.execute(delete(models.MessageArchiveSegment).where(models.MessageArchiveSegment.id.in_(ids)))
+        await db.commit()
+    return len(ids)
+
+class MessageArchiver:
+    """Periodically archives old messages and purges expired segments"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.segments_written = 0
+        self.messages_archived = 0
+        self.segments_purged = 0
+        self.last_run_at: Optional[float] = None
+        self.last_run_seconds: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.archive_after_days is not None or settings.message_retention_days is not None
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Message archiver run failed: {e}")
+            await asyncio.sleep(settings.archive_interval_seconds)
+
+    async def run_once(self):
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        if settings.archive_after_days is not None:
+            await self._archive(now - timedelta(days=settings.archive_after_days))
+        if settings.message_retention_days is not None:
+            await self._purge(now - timedelta(days=settings.message_retention_days))
+        self.runs += 1
+        self.last_run_at = time.time()
+        self.last_run_seconds = round(time.perf_counter() - started, 3)
+
+    async def _archive(self, cutoff: datetime):
+        budget = settings.archive_max_segments_per_run
+        size = settings.archive_segment_size
+        async with AsyncSessionLocal() as db:
+            chat_ids = (await db.scalars(
+                # Only chats with something to archive, or dormant ones would use up the budget every run
+                select(models.Message.chat_id).where(_archivable(cutoff))
+                .group_by(models.Message.chat_id).limit(budget)
+            )).all()
+        for chat_id in chat_ids:
+            while budget > 0:
+                archived = await db_writer.run(
+                    lambda wdb: archive_chat_segment(wdb, chat_id, cutoff, size, settings.archive_codec)
+                )
+                if archived:
+                    budget -= 1
+                    self.segments_written += 1
+                    self.messages_archived += archived
+                if archived < size:
+                    break
+            if budget <= 0:
+                break
+
+    async def _purge(self, cutoff: datetime):
+        # Bounded batches, each its own short write transaction
+        while True:
+            purged = await db_writer.run(lambda wdb: purge_segments(wdb, cutoff, settings.purge_batch_size))
+            self.segments_purged += purged
+            if purged < settings.purge_batch_size:
+                break
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "archive_after_days": settings.archive_after_days,
+            "message_retention_days": settings.message_retention_days,
+            "runs": self.runs,
+            "segments_written": self.segments_written,
+            "messages_archived": self.messages_archived,
+            "segments_purged": self.segments_purged,
+            "last_run_at": self.last_run_at,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+# Global instance
+archiver = MessageArchiver()
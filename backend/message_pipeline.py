@@ -0,0 +1,104 @@
+import asyncio
+from typing import List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from db_writer import db_writer
+from chat_crud import create_message, create_messages
+import schemas
+
+PendingMessage = Tuple[schemas.MessageCreate, int, int, asyncio.Future]
+
+class MessagePipeline:
+    """Group commit for sent messages.
+
+    Sends arriving within a few milliseconds of each other, or while the
+    previous batch is being written, are created in one write transaction;
+    each sender awaits its own message's future.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[PendingMessage] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages = 0
+        self.largest_batch = 0
+        self.fallbacks = 0
+
+    async def submit(self, message: schemas.MessageCreate, chat_id: int, sender_id: int):
+        """Create a message with the next batch; returns (message, created) like chat_crud.create_message"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._work())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((message, chat_id, sender_id, future))
+        self._wakeup.set()
+        return await future
+
+    async def _work(self):
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent senders a moment to join the batch
+            await asyncio.sleep(self.window)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if not self._pending:
+                self._wakeup.clear()
+            batch = [item for item in batch if not item[3].cancelled()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.messages += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            try:
+                results = await db_writer.run(lambda wdb: self._write(wdb, [item[:3] for item in batch]))
+            except Exception as e:
+                results = [e] * len(batch)
+            for (*_, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def _write(self, db: AsyncSession, items: List[Tuple[schemas.MessageCreate, int, int]]) -> list:
+        try:
+            return await create_messages(db, items)
+        except IntegrityError:
+            await db.rollback()
+        # Another process stored one of the client_msg_ids first; settle each message alone
+        self.fallbacks += 1
+        results = []
+        for message, chat_id, sender_id in items:
+            try:
+                results.append(await create_message(db, message, chat_id, sender_id))
+            except Exception as e:
+                await db.rollback()
+                results.append(e)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "batches": self.batches,
+            "messages": self.messages,
+            "average_batch": round(self.messages / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # The event belongs to the loop that used it; start afresh if the app is started again
+            self._wakeup = asyncio.Event()
+
+# Global instance
+message_pipeline = MessagePipeline(settings.message_batch_window_ms, settings.message_batch_max_size)
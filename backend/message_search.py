@@ -0,0 +1,148 @@
+"""Full-text search over messages.
+
+SQLite keeps an FTS5 table (messages_fts) with the messages table as its
+external content; rows are added by chat_crud.create_messages. PostgreSQL
+has a GIN expression index on the message tsvector, which the INSERT itself
+maintains and which is built concurrently rather than rewriting the table.
+"""
+import base64
+import html
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import UTCDateTime
+
+# Matched terms in snippets, swapped for <mark> after the text is HTML-escaped
+_MARK_START, _MARK_END = "\x02", "\x03"
+_TERM = re.compile(r"\w+", re.UNICODE)
+MAX_TERMS = 8
+# Queries must repeat this expression exactly for PostgreSQL to use the index
+SEARCH_VECTOR = "to_tsvector('simple', content)"
+
+def create_search_index(conn: Connection):
+    """DDL plus backfill of the search index, for the migration"""
+    if conn.dialect.name == "postgresql":
+        from migrate import create_index
+        create_index(conn, "ix_messages_search_vector", "messages", f"({SEARCH_VECTOR})", using="gin")
+    else:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        # Re-read every message from the content table
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+def _dialect(db: AsyncSession) -> str:
+    return db.bind.dialect.name
+
+async def index_messages(db: AsyncSession, rows: List[Tuple[int, str]]):
+    """Add new (id, content) rows to the index, in the caller's transaction"""
+    if _dialect(db) == "sqlite" and rows:
+        await db.execute(
+            text("INSERT INTO messages_fts(rowid, content) VALUES (:id, :content)"),
+            [{"id": message_id, "content": content} for message_id, content in rows]
+        )
+
+async def unindex_messages(db: AsyncSession, rows: List[Tuple[int, str]]):
+    """Remove (id, content) rows that are about to leave the messages table"""
+    if _dialect(db) == "sqlite" and rows:
+        # External content tables need the old content to delete its terms
+        await db.execute(
+            text("INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', :id, :content)"),
+            [{"id": message_id, "content": content} for message_id, content in rows]
+        )
+
+def search_terms(query: str) -> List[str]:
+    return _TERM.findall(query.lower())[:MAX_TERMS]
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"s{rank!r}:{message_id}".encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    """Raises ValueError for a malformed cursor"""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    if not raw.startswith("s"):
+        raise ValueError("Invalid cursor")
+    rank, message_id = raw[1:].split(":")
+    return float(rank), int(message_id)
+
+def _render_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+async def search_messages(db: AsyncSession, user_id: int, terms: List[str], limit: int,
+                          chat_id: Optional[int] = None, after: Optional[Tuple[float, int]] = None):
+    """Best matches first among the user's chats (or one of them).
+
+    Every term must match, the last one as a prefix. Results are ordered by
+    (rank, id), lower rank being better, and `after` continues from a
+    previous page. Returns (hits, has_more); hits carry an HTML-escaped
+    snippet with the matches in <mark>.
+    """
+    params = {"user_id": user_id, "limit": limit + 1}
+    scope = "m.chat_id IN (SELECT id FROM chats WHERE user1_id = :user_id OR user2_id = :user_id)"
+    if chat_id is not None:
+        scope += " AND m.chat_id = :chat_id"
+        params["chat_id"] = chat_id
+    page = "TRUE"
+    if after is not None:
+        page = "(hits.rank > :after_rank OR (hits.rank = :after_rank AND hits.id > :after_id))"
+        params["after_rank"], params["after_id"] = after
+
+    if _dialect(db) == "postgresql":
+        params["query"] = " & ".join(terms[:-1] + [terms[-1] + ":*"])
+        match = f"{SEARCH_VECTOR} @@ to_tsquery('simple', :query)"
+        rank = f"-ts_rank({SEARCH_VECTOR}, to_tsquery('simple', :query))"
+        source = "messages m"
+    else:
+        # Quoted terms so user input is never parsed as FTS5 syntax
+        params["query"] = " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+        match = "messages_fts MATCH :query"
+        rank = "bm25(messages_fts)"
+        source = "messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+
+    rows = (await db.execute(text(f"""
+        SELECT hits.id, hits.chat_id, hits.sender_id, hits.sent_at, hits.rank
+        FROM (
+            SELECT m.id, m.chat_id, m.sender_id, m.sent_at, {rank} AS rank
+            FROM {source}
+            WHERE {match} AND {scope}
+        ) hits
+        WHERE {page}
+        ORDER BY hits.rank, hits.id
+        LIMIT :limit
+    """).columns(sent_at=UTCDateTime()), params)).all()
+    rows, has_more = rows[:limit], len(rows) > limit
+
+    # Snippets are costly, so they are only built for the page being returned
+    snippets = await _snippets(db, params["query"], [row.id for row in rows])
+    hits = [
+        {
+            "id": row.id,
+            "chat_id": row.chat_id,
+            "sender_id": row.sender_id,
+            "sent_at": row.sent_at,
+            "rank": row.rank,
+            "snippet": _render_snippet(snippets.get(row.id, ""))
+        }
+        for row in rows
+    ]
+    return hits, has_more
+
+async def _snippets(db: AsyncSession, query: str, message_ids: List[int]):
+    if not message_ids:
+        return {}
+    if _dialect(db) == "postgresql":
+        sql = text(
+            "SELECT id, ts_headline('simple', content, to_tsquery('simple', :query), "
+            f"'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxFragments=1, MaxWords=24, MinWords=8') "
+            "FROM messages WHERE id IN :ids"
+        )
+    else:
+        sql = text(
+            f"SELECT rowid, snippet(messages_fts, 0, '{_MARK_START}', '{_MARK_END}', '…', 16) "
+            "FROM messages_fts WHERE messages_fts MATCH :query AND rowid IN :ids"
+        )
+    sql = sql.bindparams(bindparam("ids", expanding=True))
+    return dict((await db.execute(sql, {"query": query, "ids": message_ids})).all())
@@ -0,0 +1,194 @@
+"""Versioned schema migrations.
+
+Run `python migrate.py` before starting the app (or let the app do it at
+startup when auto_migrate is on); `python migrate.py status` lists what is
+applied. Each migration runs once and is recorded in schema_version.
+
+The baseline creates any missing tables from the models, so a fresh database
+already has everything later migrations add: keep them idempotent
+(IF NOT EXISTS, check columns before adding them).
+"""
+import sys
+import time
+from typing import Callable, List, NamedTuple, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from database import engine
+from message_search import create_search_index
+import user_search
+import models
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+    # Runs outside a transaction, for CREATE INDEX CONCURRENTLY on PostgreSQL
+    online: bool
+
+migrations: List[Migration] = []
+
+def migration(version: int, name: str, online: bool = False):
+    """Register a migration; versions must be applied in increasing order"""
+    def register(func: Callable[[Connection], None]):
+        migrations.append(Migration(version, name, func, online))
+        migrations.sort(key=lambda m: m.version)
+        return func
+    return register
+
+def create_index(conn: Connection, name: str, table: str, columns: str, unique: bool = False, using: Optional[str] = None):
+    """Build an index without blocking writes where the database supports it.
+
+    Only for online migrations: PostgreSQL refuses CONCURRENTLY inside a
+    transaction, so this fails everywhere else too rather than only there.
+    """
+    if conn.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+        raise RuntimeError(f"create_index({name}) must run in an online migration")
+    unique_sql = "UNIQUE " if unique else ""
+    using_sql = f" USING {using}" if using else ""
+    if conn.dialect.name == "postgresql":
+        # An interrupted concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{using_sql} ({columns})"))
+    else:
+        conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+@migration(1, "baseline")
+def baseline(conn: Connection):
+    # Databases created by the old import-time create_all predate client_msg_id
+    existing = set(inspect(conn).get_table_names())
+    models.Base.metadata.create_all(bind=conn)
+    if "messages" in existing and not has_column(conn, "messages", "client_msg_id"):
+        # Its unique index is built by migration 11, outside this transaction
+        conn.execute(text("ALTER TABLE messages ADD COLUMN client_msg_id VARCHAR(64)"))
+
+@migration(2, "messages_chat_sent_at_id_index", online=True)
+def messages_chat_index(conn: Connection):
+    # Opening a chat, its latest message in the chat list, unread counts per chat
+    create_index(conn, "ix_messages_chat_sent_at_id", "messages", "chat_id, sent_at, id")
+
+@migration(3, "files_chat_uploaded_at_index", online=True)
+def files_chat_index(conn: Connection):
+    # File list of a chat, newest first
+    create_index(conn, "ix_files_chat_uploaded_at", "files", "chat_id, uploaded_at")
+
+@migration(4, "chats_user2_id_index", online=True)
+def chats_user2_index(conn: Connection):
+    # Chats of a user are looked up by either side; user1_id leads unique_user_pair
+    create_index(conn, "ix_chats_user2_id", "chats", "user2_id")
+
+@migration(5, "chat_read_states")
+def chat_read_states(conn: Connection):
+    models.ChatReadState.__table__.create(bind=conn, checkfirst=True)
+    # One row per participant, seeded from the per-message is_read flags
+    conn.execute(text(
+        "INSERT INTO chat_read_states (chat_id, user_id, last_read_message_id, unread_count) "
+        "SELECT p.chat_id, p.user_id, "
+        "(SELECT MAX(m.id) FROM messages m "
+        "WHERE m.chat_id = p.chat_id AND m.sender_id != p.user_id AND m.is_read), "
+        "(SELECT COUNT(*) FROM messages m "
+        "WHERE m.chat_id = p.chat_id AND m.sender_id != p.user_id AND NOT m.is_read) "
+        "FROM (SELECT id AS chat_id, user1_id AS user_id FROM chats "
+        "UNION ALL SELECT id, user2_id FROM chats) p "
+        "WHERE NOT EXISTS (SELECT 1 FROM chat_read_states s "
+        "WHERE s.chat_id = p.chat_id AND s.user_id = p.user_id)"
+    ))
+
+@migration(6, "message_search_index", online=True)
+def message_search_index(conn: Connection):
+    create_search_index(conn)
+
+@migration(7, "user_search_terms")
+def user_search_terms(conn: Connection):
+    models.UserSearchTerm.__table__.create(bind=conn, checkfirst=True)
+    user_search.backfill(conn)
+
+@migration(8, "message_archive_segments")
+def message_archive_segments(conn: Connection):
+    models.MessageArchiveSegment.__table__.create(bind=conn, checkfirst=True)
+
+@migration(9, "chat_versions")
+def chat_versions(conn: Connection):
+    # A constant default, so PostgreSQL adds the column without rewriting the table
+    if not has_column(conn, "chats", "version"):
+        conn.execute(text("ALTER TABLE chats ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+
+@migration(10, "files_sha256")
+def files_sha256(conn: Connection):
+    # Files uploaded before this keep a NULL hash
+    if not has_column(conn, "files", "sha256"):
+        conn.execute(text("ALTER TABLE files ADD COLUMN sha256 VARCHAR(64)"))
+
+@migration(11, "messages_sender_client_msg_index", online=True)
+def messages_sender_client_msg_index(conn: Connection):
+    # Tables created from the models already have it as the unique_sender_client_msg constraint
+    inspector = inspect(conn)
+    existing = [c["column_names"] for c in inspector.get_unique_constraints("messages")]
+    existing += [i["column_names"] for i in inspector.get_indexes("messages") if i["unique"]]
+    if ["sender_id", "client_msg_id"] not in existing:
+        create_index(conn, "unique_sender_client_msg", "messages", "sender_id, client_msg_id", unique=True)
+
+def _ensure_version_table():
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at FLOAT NOT NULL)"
+        ))
+
+def applied_versions() -> set:
+    _ensure_version_table()
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_version"))}
+
+def _record(conn: Connection, m: Migration):
+    conn.execute(
+        text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+        {"version": m.version, "name": m.name, "applied_at": time.time()}
+    )
+
+def upgrade():
+    """Apply every pending migration in order"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        if engine.dialect.name == "postgresql":
+            # Several workers starting at once must not migrate concurrently
+            lock_conn.execute(text("SELECT pg_advisory_lock(hashtext('chat_app_migrations'))"))
+        try:
+            done = applied_versions()
+            for m in migrations:
+                if m.version in done:
+                    continue
+                print(f"Applying migration {m.version} {m.name}")
+                if m.online:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        m.apply(conn)
+                    with engine.begin() as conn:
+                        _record(conn, m)
+                else:
+                    with engine.begin() as conn:
+                        m.apply(conn)
+                        _record(conn, m)
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext('chat_app_migrations'))"))
+
+def status():
+    done = applied_versions()
+    for m in migrations:
+        print(f"{'applied' if m.version in done else 'pending'}  {m.version:>3}  {m.name}")
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        upgrade()
+    elif command == "status":
+        status()
+    else:
+        print("Usage: python migrate.py [upgrade|status]")
+        sys.exit(2)
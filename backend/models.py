@@ -1,8 +1,31 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from datetime import timezone
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 from database import Base
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
+
+class UTCDateTime(TypeDecorator):
+    """DateTime(timezone=True) that always comes back as an aware UTC datetime.
+
+    PostgreSQL returns aware values but SQLite returns naive ones; stored
+    values are UTC on both, so naive ones get the UTC offset attached.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
 
 class User(Base):
     __tablename__ = "users"
@@ -25,8 +48,10 @@ class Chat(Base):
     id = Column(Integer, primary_key=True, index=True)
     user1_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # First participant
     user2_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Second participant
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    last_message_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(UTCDateTime, server_default=func.now())
+    last_message_at = Column(UTCDateTime, server_default=func.now())
+    # Bumped whenever the chat's messages or participants' names change; drives ETags
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     user1 = relationship("User", foreign_keys=[user1_id], back_populates="received_chats_as_user1")
@@ -37,6 +62,7 @@ class Chat(Base):
     # Correct unique constraint syntax
     __table_args__ = (
         UniqueConstraint('user1_id', 'user2_id', name='unique_user_pair'),
+        Index('ix_chats_user2_id', 'user2_id'),
     )
 
 class Message(Base):
@@ -46,14 +72,72 @@ class Message(Base):
     chat_id = Column(Integer, ForeignKey("chats.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
     content = Column(Text, nullable=False)
-    sent_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(UTCDateTime, server_default=func.now())
     is_read = Column(Boolean, default=False)
-    read_at = Column(DateTime(timezone=True), nullable=True)  # ADD THIS
+    read_at = Column(UTCDateTime, nullable=True)  # ADD THIS
+    client_msg_id = Column(String(64), nullable=True)  # Client-generated ID for idempotent retries
     
     # Relationships
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
+
+    __table_args__ = (
+        UniqueConstraint('sender_id', 'client_msg_id', name='unique_sender_client_msg'),
+        # Keyset pagination of a chat's history on (sent_at, id)
+        Index('ix_messages_chat_sent_at_id', 'chat_id', 'sent_at', 'id'),
+    )
     
+class UserSearchTerm(Base):
+    """A normalized username or name term, for indexed prefix search of users"""
+    __tablename__ = "user_search_terms"
+
+    # Byte-order collation on PostgreSQL, so prefix ranges over the index are exact
+    term = Column(String(100).with_variant(String(100, collation="C"), "postgresql"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    kind = Column(Integer, primary_key=True)  # user_search.USERNAME / FULL_NAME / NAME_WORD
+
+    __table_args__ = (
+        Index('ix_user_search_terms_user_id', 'user_id'),
+    )
+
+class ChatReadState(Base):
+    """How far a participant has read the other participant's messages, and how many they have not"""
+    __tablename__ = "chat_read_states"
+
+    chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # Newest of the other participant's messages this user has read; only ever moves forward
+    last_read_message_id = Column(Integer, nullable=True)
+    # Kept up to date on send and on read, so nobody counts messages
+    unread_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_chat_read_states_user_id', 'user_id'),
+    )
+
+class MessageArchiveSegment(Base):
+    """A compressed run of a chat's oldest messages, moved out of the messages table"""
+    __tablename__ = "message_archive_segments"
+
+    id = Column(Integer, primary_key=True)  # Increases with age order within a chat
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    min_message_id = Column(Integer, nullable=False)
+    max_message_id = Column(Integer, nullable=False)
+    first_sent_at = Column(UTCDateTime, nullable=False)
+    last_sent_at = Column(UTCDateTime, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    codec = Column(String(10), nullable=False)  # message_archive.CODECS
+    payload = Column(LargeBinary, nullable=False)
+    archived_at = Column(UTCDateTime, server_default=func.now())
+
+    __table_args__ = (
+        # Walking a chat's segments, and finding the one holding a message ID
+        Index('ix_message_archive_segments_chat_id', 'chat_id', 'id'),
+        Index('ix_message_archive_segments_chat_message_ids', 'chat_id', 'min_message_id', 'max_message_id'),
+        # Retention purge, oldest first
+        Index('ix_message_archive_segments_last_sent_at', 'last_sent_at'),
+    )
+
 class File(Base):
     __tablename__ = "files"
     
@@ -62,10 +146,15 @@ class File(Base):
     file_path = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
     mime_type = Column(String, nullable=False)
+    sha256 = Column(String(64), nullable=True)  # Hex digest of the content, computed while uploading
     chat_id = Column(Integer, ForeignKey("chats.id"))
     uploaded_by = Column(Integer, ForeignKey("users.id"))
-    uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+    uploaded_at = Column(UTCDateTime, server_default=func.now())
     
     # Relationships
     chat = relationship("Chat", back_populates="files")
-    uploader = relationship("User", foreign_keys=[uploaded_by])
\ No newline at end of file
+    uploader = relationship("User", foreign_keys=[uploaded_by])
+
+    __table_args__ = (
+        Index('ix_files_chat_uploaded_at', 'chat_id', 'uploaded_at'),
+    )
\ No newline at end of file
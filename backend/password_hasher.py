@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from config import settings
+from auth import pwd_context
+
+class PasswordHasherBusy(Exception):
+    """More hashing work is waiting than the queue allows"""
+
+class PasswordHasher:
+    """bcrypt on its own small thread pool, so a login burst cannot starve other threadpool work.
+
+    At most max_queue jobs wait for a worker; beyond that callers get
+    PasswordHasherBusy straight away instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Jobs submitted and not finished yet; beyond `workers` of them are queued
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        # (wait, run) seconds of recent jobs
+        self._latencies: deque = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.pending - self.workers)
+
+    async def _submit(self, func, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        submitted = time.perf_counter()
+        started = None
+
+        def run():
+            nonlocal started
+            started = time.perf_counter()
+            return func(*args)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+        finally:
+            self.pending -= 1
+            if started is not None:
+                self.completed += 1
+                self._latencies.append((started - submitted, time.perf_counter() - started))
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(valid, new_hash); new_hash is set when the stored hash uses an outdated work factor"""
+        valid, new_hash = await self._submit(pwd_context.verify_and_update, password, hashed_password)
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        latencies = list(self._latencies)
+        waits = sorted(wait for wait, _ in latencies)
+        runs = sorted(run for _, run in latencies)
+
+        def percentile(values, fraction):
+            return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queue_depth,
+            "running": min(self.pending, self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "wait_seconds_p50": percentile(waits, 0.5),
+            "wait_seconds_p99": percentile(waits, 0.99),
+            "run_seconds_p50": percentile(runs, 0.5),
+            "run_seconds_p99": percentile(runs, 0.99),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Global instance
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_queue)
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List
+from config import settings
+from database import AsyncSessionLocal
+from chat_crud import get_chat_partner_ids
+from websocket_manager import manager
+
+class PresenceService:
+    """Online/offline presence pushed only to the users who share a chat with someone.
+
+    A user is online while they have a socket on any process. Every process
+    learns of the same transitions through the backplane and tells only the
+    sockets it holds, so each peer gets one event however many workers run.
+    Transitions are debounced: a user who reconnects within
+    presence_debounce_seconds (page reload, network blip, another worker)
+    produces no event.
+    """
+
+    def __init__(self, debounce_seconds: float, max_last_seen: int):
+        self.debounce_seconds = debounce_seconds
+        self.max_last_seen = max_last_seen
+        # user_id -> pending debounce timer
+        self._pending: Dict[int, asyncio.TimerHandle] = {}
+        # Users last announced as online; an offline settle removes them
+        self._announced_online = set()
+        # user_id -> when their last socket on any process closed, offline users only, oldest first
+        self.last_seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def on_presence_change(self, user_id: int, online: bool):
+        """ConnectionManager listener: online somewhere / offline everywhere"""
+        if online:
+            # status() only reports last_seen while offline
+            self.last_seen.pop(user_id, None)
+        else:
+            self.last_seen[user_id] = time.time()
+            self.last_seen.move_to_end(user_id)
+            if len(self.last_seen) > self.max_last_seen:
+                self.last_seen.popitem(last=False)
+        timer = self._pending.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._pending[user_id] = asyncio.get_running_loop().call_later(
+            self.debounce_seconds, self._settle_soon, user_id
+        )
+
+    def _settle_soon(self, user_id: int):
+        self._pending.pop(user_id, None)
+        asyncio.create_task(self._settle(user_id))
+
+    async def _settle(self, user_id: int):
+        online = manager.is_online(user_id)
+        if online == (user_id in self._announced_online):
+            return
+        if online:
+            self._announced_online.add(user_id)
+        else:
+            self._announced_online.discard(user_id)
+        if not manager.active_connections:
+            return
+
+        audience = await _load_audience(user_id)
+        event = {"type": "presence", **self.status(user_id)}
+        for peer_id in audience:
+            # The other processes tell the peer's sockets they hold
+            manager.send_local_message(event, peer_id)
+
+    def status(self, user_id: int) -> dict:
+        online = manager.is_online(user_id)
+        return {
+            "user_id": user_id,
+            "status": "online" if online else "offline",
+            "last_seen": None if online else self.last_seen.get(user_id),
+        }
+
+    def bulk_status(self, user_ids: List[int]) -> List[dict]:
+        return [self.status(user_id) for user_id in user_ids]
+
+async def _load_audience(user_id: int):
+    async with AsyncSessionLocal() as db:
+        return await get_chat_partner_ids(db, user_id)
+
+# Global instance
+presence_service = PresenceService(settings.presence_debounce_seconds, settings.presence_max_last_seen)
+manager.add_presence_listener(presence_service.on_presence_change)
@@ -0,0 +1,66 @@
+from collections import OrderedDict, deque
+from itertools import count
+from typing import Callable, List, Optional, Tuple
+
+class ChatEventLog:
+    """Recent events of one chat, each stamped with a per-chat sequence number"""
+    __slots__ = ("epoch", "seq", "events")
+
+    def __init__(self, epoch: str, size: int):
+        # A new epoch means the numbering restarted, so old seqs are meaningless
+        self.epoch = epoch
+        self.seq = 0
+        # (seq, event, exclude_user_id)
+        self.events: deque = deque(maxlen=size)
+
+    def append(self, event: dict, exclude_user_id: Optional[int]) -> dict:
+        self.seq += 1
+        stamped = {**event, "seq": self.seq, "epoch": self.epoch}
+        self.events.append((self.seq, stamped, exclude_user_id))
+        return stamped
+
+    def since(self, last_seq: int, user_id: int) -> Optional[List[dict]]:
+        """Events after last_seq meant for user_id, or None if the gap is no longer buffered"""
+        if last_seq >= self.seq:
+            return []
+        oldest = self.events[0][0] if self.events else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
+        return [event for seq, event, excluded in self.events if seq > last_seq and excluded != user_id]
+
+class ReplayBuffers:
+    """Bounded LRU of per-chat event logs for clients resuming after a reconnect"""
+
+    def __init__(self, node_id: str, events_per_chat: int, max_chats: int, on_evict: Callable[[int], None]):
+        self.node_id = node_id
+        self.events_per_chat = events_per_chat
+        self.max_chats = max_chats
+        self.on_evict = on_evict
+        self._logs: "OrderedDict[int, ChatEventLog]" = OrderedDict()
+        self._generation = count(1)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._logs
+
+    def get(self, chat_id: int) -> ChatEventLog:
+        """The chat's log, created (and the least recently used one evicted) if needed"""
+        log = self._logs.get(chat_id)
+        if log is not None:
+            self._logs.move_to_end(chat_id)
+            return log
+
+        log = ChatEventLog(f"{self.node_id}.{next(self._generation)}", self.events_per_chat)
+        self._logs[chat_id] = log
+        if len(self._logs) > self.max_chats:
+            evicted_chat_id, _ = self._logs.popitem(last=False)
+            self.on_evict(evicted_chat_id)
+        return log
+
+    def record(self, chat_id: int, event: dict, exclude_user_id: Optional[int]) -> dict:
+        return self.get(chat_id).append(event, exclude_user_id)
+
+    def resume(self, chat_id: int, epoch: Optional[str], last_seq: int, user_id: int) -> Tuple[ChatEventLog, Optional[List[dict]]]:
+        log = self.get(chat_id)
+        if epoch != log.epoch:
+            return log, None
+        return log, log.since(last_seq, user_id)
@@ -0,0 +1,62 @@
+import secrets
+from fastapi import APIRouter, Depends, Header, HTTPException
+from typing import Optional
+from config import settings
+from websocket_manager import manager
+from auth_cache import principal_cache
+from password_hasher import password_hasher
+from db_writer import db_writer
+from message_pipeline import message_pipeline
+from message_archive import archiver
+from conditional import render_cache
+
+router = APIRouter()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Operator endpoints need X-Admin-Token; with no token configured they are hidden unless explicitly opened"""
+    if settings.admin_token is None:
+        if not settings.admin_allow_unauthenticated:
+            raise HTTPException(status_code=404, detail="Not found")
+        return
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+@router.get("/connections", dependencies=[Depends(require_admin)])
+async def get_connection_stats():
+    """WebSocket accounting: queued bytes, frames sent, last activity per connection"""
+    return manager.connection_stats()
+
+@router.get("/auth-cache", dependencies=[Depends(require_admin)])
+async def get_auth_cache_stats():
+    """Principal cache hit/miss counters and size"""
+    return principal_cache.stats()
+
+@router.get("/password-hasher", dependencies=[Depends(require_admin)])
+async def get_password_hasher_stats():
+    """bcrypt pool queue depth, rejections and wait/run latency"""
+    return password_hasher.stats()
+
+@router.get("/db-writer", dependencies=[Depends(require_admin)])
+async def get_db_writer_stats():
+    """Write queue depth and completed/failed write transactions"""
+    return db_writer.stats()
+
+@router.get("/message-pipeline", dependencies=[Depends(require_admin)])
+async def get_message_pipeline_stats():
+    """Group commit batches of sent messages"""
+    return message_pipeline.stats()
+
+@router.get("/archive", dependencies=[Depends(require_admin)])
+async def get_archive_stats():
+    """Archiver runs, segments written and purged"""
+    return archiver.stats()
+
+@router.get("/render-cache", dependencies=[Depends(require_admin)])
+async def get_render_cache_stats():
+    """Cached response bodies, hits and 304s"""
+    return render_cache.stats()
+
+@router.get("/backplane", dependencies=[Depends(require_admin)])
+async def get_backplane_stats():
+    """Cross-process links: frames sent, buffered, dropped and missed per peer"""
+    return manager.backplane.stats()
@@ -1,20 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 import schemas, crud, auth
+from password_hasher import password_hasher, PasswordHasherBusy
+from db_writer import db_writer
 
 router = APIRouter()
 
+def _busy():
+    return HTTPException(status_code=503, detail="Too many logins in progress, try again shortly", headers={"Retry-After": "1"})
+
 @router.post("/register", response_model=schemas.UserPublic)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    try:
+        # bcrypt runs on its own pool, before the write so it never holds the writer
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordHasherBusy:
+        raise _busy()
+    return await db_writer.run(lambda wdb: crud.create_user(wdb, user, hashed_password))
 
 @router.post("/login")
-def login(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login(form_data: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await crud.get_user_by_username(db, username=form_data.username)
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(form_data.password, user.hashed_password)
+    except PasswordHasherBusy:
+        raise _busy()
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
+    if new_hash:
+        # Stored with an old work factor (or scheme): replace it now that we know the password
+        await db_writer.run(lambda wdb: crud.update_password_hash(wdb, user.id, new_hash))
     return {"access_token": auth.create_access_token(data={"sub": user.username}), "token_type": "bearer"}
\ No newline at end of file
@@ -1,53 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
-import models
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from database import get_async_db
 import schemas
 import auth
-from chat_crud import get_chat_between_users, create_chat, create_message, get_user_chats, get_chat_messages,mark_messages_as_read, get_unread_message_count
+from auth_cache import Principal
+from crud import get_user_by_username
+from chat_crud import get_chat_between_users, get_chat_for_user, create_chat, get_user_chats, get_chat_messages,mark_messages_as_read, get_unread_message_count
+from chat_crud import mark_chat_read_up_to
+from chat_crud import encode_message_cursor, decode_message_cursor, get_chat_version, get_chat_list_version, message_dict
+from conditional import conditional_response, make_etag
+import fast_json
+from message_search import search_terms, search_messages, encode_search_cursor, decode_search_cursor
 from websocket_manager import manager
-import json
+from chat_events import new_message_event, messages_read_event
+from typing_service import typing_tracker
+from db_writer import db_writer
+from message_pipeline import message_pipeline
 
 router = APIRouter()
 
-# ADD THIS FUNCTION IF IT'S MISSING
-def enhance_chat_with_user_data(chat, current_user_id: int, db: Session):
-    """Add other_user information to chat object"""
-    # Determine who the other user is
-    other_user_id = chat.user2_id if chat.user1_id == current_user_id else chat.user1_id
-    other_user = db.query(models.User).filter(models.User.id == other_user_id).first()
-    
-    # Get last message if exists
-    last_message = db.query(models.Message).filter(
-        models.Message.chat_id == chat.id
-    ).order_by(models.Message.sent_at.desc()).first()
-    
-    # Create the response data
-    chat_data = {
-        "id": chat.id,
-        "user1_id": chat.user1_id,
-        "user2_id": chat.user2_id,
-        "created_at": chat.created_at,
-        "last_message_at": chat.last_message_at,
-        "other_user": {
-            "id": other_user.id,
-            "username": other_user.username,
-            "full_name": other_user.full_name
-        },
-        "last_message": last_message
-    }
-    
-    return chat_data
-
 @router.post("/", response_model=schemas.ChatPublic)
 async def create_or_get_chat(
     recipient_username: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
     # Check if recipient exists
-    recipient = db.query(models.User).filter(models.User.username == recipient_username).first()
+    recipient = await get_user_by_username(db, recipient_username)
     if not recipient:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -55,102 +35,174 @@ async def create_or_get_chat(
     if recipient.id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot create chat with yourself")
     
-    # Check if chat already exists
-    existing_chat = get_chat_between_users(db, current_user.id, recipient.id)
-    if existing_chat:
-        # Return the existing chat with proper other_user data
-        return enhance_chat_with_user_data(existing_chat, current_user.id, db)
+    # Check if chat already exists, create it otherwise
+    chat = await get_chat_between_users(db, current_user.id, recipient.id)
+    if not chat:
+        chat = await db_writer.run(lambda wdb: create_chat(wdb, current_user.id, recipient.id))
     
-    # Create new chat
-    new_chat = create_chat(db, current_user.id, recipient.id)
-    # Return the new chat with proper other_user data
-    return enhance_chat_with_user_data(new_chat, current_user.id, db)
+    # Same single-query path as the chat list, for proper other_user data
+    return (await get_user_chats(db, current_user.id, chat_id=chat.id))[0]
 
 @router.get("/", response_model=List[schemas.ChatPublic])
 async def get_my_chats(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
+):
+    """The caller's chats, with ETag revalidation"""
+    count, version = await get_chat_list_version(db, current_user.id)
+
+    async def render():
+        return fast_json.dumps([fast_json.chat_dict(chat) for chat in await get_user_chats(db, current_user.id)])
+    return await conditional_response(request, make_etag("l", current_user.id, count, version), render)
+
+async def _search(db: AsyncSession, user_id: int, q: str, limit: int, cursor: Optional[str], chat_id: Optional[int] = None):
+    terms = search_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search needs at least one word")
+    try:
+        after = decode_search_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    hits, has_more = await search_messages(db, user_id, terms, limit, chat_id=chat_id, after=after)
+    return {
+        "results": hits,
+        "next_cursor": encode_search_cursor(hits[-1]["rank"], hits[-1]["id"]) if hits and has_more else None
+    }
+
+@router.get("/search", response_model=schemas.MessageSearchPage)
+async def search_all_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
+):
+    """Full-text search across all of the caller's chats, best match first"""
+    return await _search(db, current_user.id, q, limit, cursor)
+
+@router.get("/{chat_id}/search", response_model=schemas.MessageSearchPage)
+async def search_chat_messages(
+    chat_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    chats = get_user_chats(db, current_user.id)
-    return chats
+    """Full-text search within one chat"""
+    if not await get_chat_for_user(db, chat_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return await _search(db, current_user.id, q, limit, cursor, chat_id=chat_id)
 
 @router.post("/{chat_id}/messages", response_model=schemas.MessagePublic)
 async def send_message(
     chat_id: int,
     message: schemas.MessageCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
     # Verify user is participant in this chat
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-    if not chat or (chat.user1_id != current_user.id and chat.user2_id != current_user.id):
+    chat = await get_chat_for_user(db, chat_id, current_user.id)
+    if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    # Create message in database
-    db_message = create_message(db, message, chat_id, current_user.id)
+    # Create message in database (a retry with the same client_msg_id is not stored twice)
+    db_message, created = await message_pipeline.submit(message, chat_id, current_user.id)
+    if not created:
+        return db_message
     
-    # Broadcast via WebSocket to other participants
+    await typing_tracker.stop(current_user.id, chat_id)
+    # Broadcast via WebSocket to the chat, the sender's other devices included
     await manager.broadcast_to_chat(
-        json.dumps({
-            "type": "new_message",
-            "message": {
-                "id": db_message.id,
-                "content": db_message.content,
-                "sender_id": db_message.sender_id,
-                "sent_at": db_message.sent_at.isoformat(),
-                "is_read": db_message.is_read
-            },
-            "chat_id": chat_id
-        }),
-        chat_id,
-        exclude_user_id=current_user.id
+        new_message_event(db_message, chat_id),
+        chat_id
     )
     
     print(f"Message broadcasted to chat {chat_id}")
     return db_message
 
-@router.get("/{chat_id}/messages", response_model=List[schemas.MessagePublic])
+@router.get("/{chat_id}/messages", response_model=schemas.MessagePage)
 async def get_messages(
+    request: Request,
     chat_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    messages = get_chat_messages(db, chat_id, current_user.id)
-    if messages is None:
+    """One page of history; without cursors, the latest messages. Supports ETag revalidation."""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    try:
+        before_id = decode_message_cursor(before) if before else None
+        after_id = decode_message_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Also the participant check; the page is the same for both participants
+    version = await get_chat_version(db, chat_id, current_user.id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Chat not found")
-    return messages
+
+    async def render():
+        page = await get_chat_messages(db, chat_id, current_user.id, limit, before=before_id, after=after_id)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        messages, has_older, has_newer = page
+        return fast_json.dumps({
+            "messages": [message_dict(m) for m in messages],
+            "prev_cursor": encode_message_cursor(messages[0].id) if messages and has_older else None,
+            "next_cursor": encode_message_cursor(messages[-1].id) if messages and has_newer else None
+        })
+    etag = make_etag("m", chat_id, version, limit, before_id or "", after_id or "")
+    return await conditional_response(request, etag, render)
 
 @router.put("/messages/read")
 async def mark_messages_read(
     read_data: schemas.MessageReadUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
     """Mark multiple messages as read"""
-    updated_messages = mark_messages_as_read(db, read_data.message_ids, current_user.id)
+    read_summaries = await db_writer.run(lambda wdb: mark_messages_as_read(wdb, read_data.message_ids, current_user.id))
     
-    # Notify senders via WebSocket that their messages were read
-    for message in updated_messages:
+    # Notify senders (and the reader's other devices) via WebSocket with one receipt per chat
+    for summary in read_summaries:
         await manager.broadcast_to_chat(
-            json.dumps({
-                "type": "message_read",
-                "message_id": message.id,
-                "reader_id": current_user.id,
-                "chat_id": message.chat_id,
-                "read_at": message.read_at.isoformat() if message.read_at else None
-            }),
-            message.chat_id,
-            exclude_user_id=current_user.id
+            messages_read_event(summary, current_user.id),
+            summary["chat_id"]
         )
     
-    return {"updated_count": len(updated_messages)}
+    return {"updated_count": sum(summary["count"] for summary in read_summaries)}
+
+@router.put("/{chat_id}/read")
+async def mark_chat_read(
+    chat_id: int,
+    read_data: schemas.ChatReadUpTo,
+    current_user: Principal = Depends(auth.get_current_user)
+):
+    """Mark everything the other participant sent up to a message as read"""
+    read_summaries = await db_writer.run(
+        lambda wdb: mark_chat_read_up_to(wdb, chat_id, current_user.id, read_data.up_to_message_id)
+    )
+    if read_summaries is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    # One receipt to the sender (and the reader's other devices), however many messages were read
+    for summary in read_summaries:
+        await manager.broadcast_to_chat(messages_read_event(summary, current_user.id), chat_id)
+
+    return {"updated_count": sum(summary["count"] for summary in read_summaries)}
 
 @router.get("/unread-count")
 async def get_unread_count(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
     """Get total unread messages count for current user"""
-    count = get_unread_message_count(db, current_user.id)
+    count = await get_unread_message_count(db, current_user.id)
     return {"unread_count": count}
 
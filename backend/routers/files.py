@@ -1,56 +1,75 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
 from fastapi.responses import FileResponse
 import os
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from database import get_db
-import schemas, models, auth
-from file_service import save_uploaded_file, validate_file, get_file_url, delete_file, UPLOAD_DIR
-from chat_crud import create_file_record, get_file_by_id, get_chat_files, delete_file_record
+from database import get_async_db
+import schemas, auth
+from auth_cache import Principal
+from starlette.concurrency import run_in_threadpool
+from file_service import receive_upload, get_file_url, delete_file, UPLOAD_DIR
+from chat_crud import get_chat_for_user, create_file_record, get_file_by_id, get_chat_files, delete_file_record
 from websocket_manager import manager
-import json
+from db_writer import db_writer
+from fast_json import isoformat
+import fast_json
 
 router = APIRouter()
 
-@router.post("/chats/{chat_id}/files", response_model=schemas.FilePublic)
+# The body is parsed by file_service.receive_upload, so describe it for the docs by hand
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
+
+@router.post("/chats/{chat_id}/files", response_model=schemas.FilePublic, openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_file(
     chat_id: int,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    # Verify user is participant in this chat
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-    if not chat or (chat.user1_id != current_user.id and chat.user2_id != current_user.id):
+    # Verify user is participant in this chat, before reading any of the body
+    chat = await get_chat_for_user(db, chat_id, current_user.id)
+    if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
+    # Give the pooled connection back; a slow client must not hold it for the whole upload
+    await db.close()
     
-    # Validate file
-    is_valid, error_message = validate_file(file)
-    if not is_valid:
-        raise HTTPException(status_code=400, detail=error_message)
+    # Stream the file to disk, checking type and size as it arrives
+    upload = await receive_upload(request, chat_id)
+    db_file = None
     
     try:
-        # Save file to filesystem
-        file_path, unique_filename = save_uploaded_file(file, chat_id)
-        
         # Create file record in database
         file_data = {
-            "filename": file.filename,
-            "file_path": file_path,
-            "file_size": os.path.getsize(file_path),
-            "mime_type": file.content_type,
+            "filename": upload.filename,
+            "file_path": upload.file_path,
+            "file_size": upload.file_size,
+            "mime_type": upload.mime_type,
+            "sha256": upload.sha256,
             "chat_id": chat_id,
             "uploaded_by": current_user.id
         }
         
-        db_file = create_file_record(db, file_data)
+        db_file = await db_writer.run(lambda wdb: create_file_record(wdb, file_data))
         
         # Generate download URL
-        download_url = get_file_url(file_path)
+        download_url = get_file_url(upload.file_path)
         
-        # Notify other chat participants via WebSocket
+        # Notify the chat via WebSocket, the uploader's other devices included
         await manager.broadcast_to_chat(
-            json.dumps({
+            {
                 "type": "file_uploaded",
                 "file": {
                     "id": db_file.id,
@@ -58,14 +77,13 @@ async def upload_file(
                     "file_size": db_file.file_size,
                     "mime_type": db_file.mime_type,
                     "uploaded_by": db_file.uploaded_by,
-                    "uploaded_at": db_file.uploaded_at.isoformat(),
+                    "uploaded_at": isoformat(db_file.uploaded_at),
                     "download_url": download_url
                 },
                 "chat_id": chat_id,
                 "uploaded_by": current_user.id
-            }),
-            chat_id,
-            exclude_user_id=current_user.id
+            },
+            chat_id
         )
         
         return {
@@ -74,6 +92,9 @@ async def upload_file(
         }
         
     except Exception as e:
+        if db_file is None:
+            # No record points at it
+            await run_in_threadpool(delete_file, upload.file_path)
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
 @router.get("/files/{file_path:path}")
@@ -89,30 +110,37 @@ async def get_file(file_path: str):
 @router.get("/chats/{chat_id}/files", response_model=List[schemas.FilePublic])
 async def get_files(
     chat_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
     # Verify user is participant in this chat
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
-    if not chat or (chat.user1_id != current_user.id and chat.user2_id != current_user.id):
+    chat = await get_chat_for_user(db, chat_id, current_user.id)
+    if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    files = get_chat_files(db, chat_id)
-    
-    # Add download URLs
-    for file in files:
-        file.download_url = get_file_url(file.file_path)
-    
-    return files
+    # Rendered straight from the selected columns, in FilePublic's shape
+    return fast_json.json_response([
+        {
+            "filename": file.filename,
+            "file_size": file.file_size,
+            "mime_type": file.mime_type,
+            "id": file.id,
+            "chat_id": file.chat_id,
+            "uploaded_by": file.uploaded_by,
+            "uploaded_at": file.uploaded_at,
+            "download_url": get_file_url(file.file_path)
+        }
+        for file in await get_chat_files(db, chat_id)
+    ])
 
 @router.delete("/files/{file_id}")
 async def delete_uploaded_file(
     file_id: int,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    file = get_file_by_id(db, file_id)
+    file = await get_file_by_id(db, file_id)
     
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
@@ -121,22 +149,21 @@ async def delete_uploaded_file(
         raise HTTPException(status_code=403, detail="Not authorized to delete this file")
     
     # Delete file record from database
-    success = delete_file_record(db, file_id, current_user.id)
+    success = await db_writer.run(lambda wdb: delete_file_record(wdb, file_id, current_user.id))
     
     if success:
         # Schedule file deletion from filesystem
         background_tasks.add_task(delete_file, file.file_path)
         
-        # Notify other chat participants
+        # Notify the chat, the deleter's other devices included
         await manager.broadcast_to_chat(
-            json.dumps({
+            {
                 "type": "file_deleted",
                 "file_id": file_id,
                 "chat_id": file.chat_id,
                 "deleted_by": current_user.id
-            }),
-            file.chat_id,
-            exclude_user_id=current_user.id
+            },
+            file.chat_id
         )
         
         return {"message": "File deleted successfully"}
@@ -1,47 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from database import get_db
-import models
+from database import get_async_db
 import schemas
 import auth
+from auth_cache import Principal, principal_cache
+from chat_crud import get_chat_partner_ids
+from presence_service import presence_service
+import user_search
+import crud
+from db_writer import db_writer
 
 router = APIRouter()
 
 @router.get("/me", response_model=schemas.UserPublic)
-async def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
+async def read_users_me(current_user: Principal = Depends(auth.get_current_user)):
     return current_user
 
 @router.put("/me", response_model=schemas.UserPublic)
 async def update_user_profile(
     full_name: str,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    current_user.full_name = full_name
-    db.commit()
-    db.refresh(current_user)
-    return current_user
+    user = await db_writer.run(lambda wdb: crud.update_user_full_name(wdb, current_user.id, full_name))
+    # Later requests must not see the old name
+    principal_cache.invalidate(user.username)
+    return user
 
 @router.get("/search", response_model=List[schemas.UserPublic])
 async def search_users(
-    q: str = Query(..., min_length=1, max_length=20),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    q: str = Query(..., min_length=1, max_length=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
+):
+    # Username or any word of the full name, exact and prefix hits first
+    return await user_search.search_users(db, q, exclude_user_id=current_user.id)
+
+@router.get("/presence", response_model=List[schemas.UserPresence])
+async def get_presence(
+    user_ids: List[int] = Query(..., max_length=200),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    # Normalize search term to lowercase
-    search_term = q.lower().strip()
-    
-    # Use ilike for case-insensitive search and broader matching
-    users = db.query(models.User).filter(
-        models.User.username.ilike(f"{search_term}%"),  # Changed to ilike
-        models.User.id != current_user.id
-    ).limit(10).all()
-    
-    return users
+    """Bulk presence lookup, limited to users the caller shares a chat with"""
+    visible = (await get_chat_partner_ids(db, current_user.id)) | {current_user.id}
+    return presence_service.bulk_status([user_id for user_id in user_ids if user_id in visible])
 
 # @router.get("/debug/all-users", response_model=List[schemas.UserPublic])
-# async def get_all_users(db: Session = Depends(get_db)):
+# async def get_all_users(db: AsyncSession = Depends(get_async_db)):
 #     """Temporary endpoint to see all users - remove in production!"""
 #     users = db.query(models.User).all()
 #     return users
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, validator, field_validator
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Optional
 import re
 
@@ -51,7 +51,14 @@ class MessageBase(BaseModel):
     content: str
 
 class MessageCreate(MessageBase):
-    pass
+    client_msg_id: Optional[str] = None  # Lets a client retry a send without duplicating it
+
+    @field_validator('client_msg_id')
+    @classmethod
+    def validate_client_msg_id(cls, v):
+        if v is not None and not 1 <= len(v) <= 64:
+            raise ValueError('client_msg_id must be 1-64 characters.')
+        return v
 
 class MessagePublic(MessageBase):
     id: int
@@ -63,9 +70,28 @@ class MessagePublic(MessageBase):
     class Config:
         from_attributes = True
 
+class MessagePage(BaseModel):
+    messages: List[MessagePublic]  # Oldest first
+    prev_cursor: Optional[str] = None  # Pass as ?before= for older messages, None at the start
+    next_cursor: Optional[str] = None  # Pass as ?after= for newer messages, None at the end
+
+class MessageSearchHit(BaseModel):
+    id: int
+    chat_id: int
+    sender_id: int
+    sent_at: datetime
+    snippet: str  # HTML-escaped, matched terms wrapped in <mark>
+
+class MessageSearchPage(BaseModel):
+    results: List[MessageSearchHit]  # Best match first
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for more results
+
 class MessageReadUpdate(BaseModel):
     message_ids: List[int]
 
+class ChatReadUpTo(BaseModel):
+    up_to_message_id: int  # Newest message the reader has on screen
+
 class ChatParticipantInfo(BaseModel):
     id: int
     username: str
@@ -82,13 +108,15 @@ class ChatPublic(BaseModel):
     last_message_at: datetime
     other_user: ChatParticipantInfo  # The user you're chatting with
     last_message: Optional[MessagePublic] = None
+    last_read_message_id: Optional[int] = None  # Newest message from the other user you have read
+    unread_count: int = 0  # Messages from the other user you have not read
     
     @field_validator('last_message_at', mode='before')
     @classmethod
     def ensure_last_message_at(cls, v):
         # If last_message_at is None, use current time
         if v is None:
-            return datetime.now()
+            return datetime.now(timezone.utc)
         return v
     
     class Config:
@@ -106,6 +134,11 @@ class UserSearchResult(BaseModel):
     class Config:
         from_attributes = True
 
+class UserPresence(BaseModel):
+    user_id: int
+    status: str  # "online" or "offline"
+    last_seen: Optional[float] = None  # Unix time, when known and offline
+
 # ===== TOKEN SCHEMAS =====
 class Token(BaseModel):
     access_token: str
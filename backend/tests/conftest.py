@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+
+# Settings and engines are built at import time, so point them at a scratch database first
+SCRATCH_DIR = tempfile.mkdtemp(prefix="chat-tests-")
+DB_PATH = os.path.join(SCRATCH_DIR, "test.db")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# file_service creates and writes uploads/ relative to the working directory
+os.chdir(SCRATCH_DIR)
+
+import asyncio
+import pytest
+
+@pytest.fixture
+def fresh_db():
+    """An empty database file; engines are disposed so no connection outlives it"""
+    from database import engine, async_engine, write_engine
+    engine.dispose()
+    asyncio.run(async_engine.dispose())
+    asyncio.run(write_engine.dispose())
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    yield DB_PATH
+
+@pytest.fixture
+def chat_db(fresh_db):
+    """A migrated database where Ann (1) and Bob (2) share chat 1 and Cy (3) is in no chat"""
+    from sqlalchemy import text
+    import migrate
+    from database import engine
+    migrate.upgrade()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO users (id, full_name, username, email, hashed_password) VALUES "
+            "(1, 'Ann', 'ann', 'ann@x.io', 'h'), (2, 'Bob', 'bob', 'bob@x.io', 'h'), (3, 'Cy', 'cy', 'cy@x.io', 'h')"
+        ))
+        conn.execute(text("INSERT INTO chats (id, user1_id, user2_id, version) VALUES (1, 1, 2, 0)"))
+        conn.execute(text(
+            "INSERT INTO chat_read_states (chat_id, user_id, unread_count) VALUES (1, 1, 0), (1, 2, 0)"
+        ))
+    yield fresh_db
+
+@pytest.fixture
+def tokens():
+    """Bearer tokens of chat_db's users by user_id"""
+    import auth
+    return {user_id: auth.create_access_token({"sub": name}) for user_id, name in ((1, "ann"), (2, "bob"), (3, "cy"))}
+
+@pytest.fixture
+def client(chat_db, monkeypatch):
+    """The app on one event loop for the whole test, so db_writer's worker stays on the loop it started on"""
+    from fastapi.testclient import TestClient
+    import conditional
+    import main
+    from password_hasher import password_hasher
+    # Its pool is process-wide; later tests still need it after this app shuts down
+    monkeypatch.setattr(password_hasher, "shutdown", lambda: None)
+    # Each test's database starts its chat versions afresh, so earlier tests' bodies would match their ETags
+    monkeypatch.setattr(conditional, "render_cache", conditional.RenderCache(conditional.settings.render_cache_max_entries))
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,22 @@
+import pytest
+from config import settings
+
+@pytest.mark.parametrize("environment", ["development", "production"])
+def test_admin_is_hidden_without_a_configured_token(client, monkeypatch, environment):
+    monkeypatch.setattr(settings, "environment", environment)
+    assert client.get("/admin/connections").status_code == 404
+
+def test_admin_can_be_opened_explicitly(client, monkeypatch):
+    monkeypatch.setattr(settings, "admin_allow_unauthenticated", True)
+    assert client.get("/admin/connections").status_code == 200
+
+@pytest.mark.parametrize("headers, status", [
+    ({}, 403),
+    ({"X-Admin-Token": "wrong"}, 403),
+    ({"X-Admin-Token": "s3cret"}, 200),
+])
+def test_configured_token_is_required(client, monkeypatch, headers, status):
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    # The opt-in only applies when no token is configured
+    monkeypatch.setattr(settings, "admin_allow_unauthenticated", True)
+    assert client.get("/admin/connections", headers=headers).status_code == status
@@ -0,0 +1,77 @@
+import time
+from types import SimpleNamespace
+import pytest
+import auth_cache
+from auth_cache import Principal, PrincipalCache, TTLCache, principal_cache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the cache's clock; asyncio keeps the real one
+    monkeypatch.setattr(auth_cache, "time", SimpleNamespace(monotonic=clock, time=time.time))
+    return clock
+
+def _principal(username="ann", full_name="Ann"):
+    return Principal(1, username, full_name, f"{username}@x.io", True)
+
+def test_entries_expire(clock):
+    cache = TTLCache(10)
+    cache.set("k", "v", ttl=5)
+    clock.now += 4.9
+    assert cache.get("k") == "v"
+    clock.now += 0.1
+    assert cache.get("k") is None and len(cache) == 0
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TTLCache(2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+    assert (cache.get("a"), cache.get("b"), cache.get("c"), cache.evictions) == (1, None, 3, 1)
+
+def test_tokens_are_kept_no_longer_than_they_are_valid(clock):
+    cache = PrincipalCache(True, ttl=60, max_entries=10)
+    cache.set_username("soon", "ann", token_expires_at=time.time() + 5)
+    cache.set_username("expired", "ann", token_expires_at=time.time() - 1)
+    assert (cache.get_username("soon"), cache.get_username("expired")) == ("ann", None)
+    clock.now += 5
+    assert cache.get_username("soon") is None
+
+def test_principals_expire_and_can_be_invalidated(clock):
+    cache = PrincipalCache(True, ttl=60, max_entries=10)
+    cache.set_principal(_principal())
+    assert cache.get_principal("ann") == _principal()
+    cache.invalidate("ann")
+    assert cache.get_principal("ann") is None
+
+    cache.set_principal(_principal())
+    clock.now += 60
+    assert cache.get_principal("ann") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 2)
+
+def test_disabled_cache_keeps_nothing(clock):
+    cache = PrincipalCache(False, ttl=60, max_entries=10)
+    cache.set_username("t", "ann", None)
+    cache.set_principal(_principal())
+    assert (cache.get_username("t"), cache.get_principal("ann")) == (None, None)
+
+def test_rename_is_seen_by_the_next_request(client, tokens):
+    principal_cache.tokens.clear()
+    principal_cache.principals.clear()
+    headers = {"Authorization": f"Bearer {tokens[2]}"}
+    hits = principal_cache.hits
+
+    assert client.get("/users/me", headers=headers).json()["full_name"] == "Bob"
+    assert client.get("/users/me", headers=headers).json()["full_name"] == "Bob"
+    assert principal_cache.hits == hits + 1
+
+    assert client.put("/users/me", params={"full_name": "Robert"}, headers=headers).status_code == 200
+    assert client.get("/users/me", headers=headers).json()["full_name"] == "Robert"
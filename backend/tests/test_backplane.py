@@ -0,0 +1,94 @@
+import asyncio
+from backplane import UnixSocketBackplane
+
+async def _wait_for(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+def _pair(directory, max_buffer_bytes=8 * 1024 * 1024):
+    received = {"a": [], "b": []}
+    a = UnixSocketBackplane(lambda channel, payload: received["a"].append(payload), directory, max_buffer_bytes)
+    b = UnixSocketBackplane(lambda channel, payload: received["b"].append(payload), directory, max_buffer_bytes)
+    return a, b, received
+
+def test_stream_delivers_everything_in_order(tmp_path):
+    async def scenario():
+        a, b, received = _pair(str(tmp_path))
+        a.set_presence(7, True)
+        await a.start()
+        await b.start()
+        b.subscribe("chat:1")
+        await _wait_for(lambda: b.is_online(7) and a.node_id in b.links and b.node_id in a.links)
+
+        big = "x" * 300_000  # too long for one datagram
+        for i in range(2000):
+            a.publish("chat:1", {"n": i, "text": big if i == 0 else ""})
+        await _wait_for(lambda: len(received["b"]) == 2000)
+        assert [payload["n"] for payload in received["b"]] == list(range(2000))
+        assert b.frames_missed == 0 and a.stats()["dropped"] == 0
+
+        await a.stop()
+        await _wait_for(lambda: not b.is_online(7))
+        await b.stop()
+
+    asyncio.run(scenario())
+
+def test_overflow_is_counted_on_both_sides(tmp_path):
+    async def scenario():
+        a, b, received = _pair(str(tmp_path), max_buffer_bytes=2000)
+        await a.start()
+        await b.start()
+        b.subscribe("chat:1")
+        await _wait_for(lambda: a.node_id in b.links and b.node_id in a.links)
+
+        # Published without yielding, so the link cannot drain in between
+        for i in range(100):
+            a.publish("chat:1", {"n": i})
+        dropped = a.stats()["dropped"]
+        assert dropped > 0
+        await _wait_for(lambda: a.links[b.node_id].buffered_bytes == 0)
+        a.publish("chat:1", {"n": "after"})
+        await _wait_for(lambda: received["b"] and received["b"][-1]["n"] == "after")
+        assert b.stats()["frames_missed"] == dropped
+        await a.stop()
+        await b.stop()
+
+    asyncio.run(scenario())
+
+def test_presence_flips_only_when_no_process_has_the_user(tmp_path):
+    async def scenario():
+        flips = {"a": [], "b": []}
+        a = UnixSocketBackplane(lambda channel, payload: None, str(tmp_path), 1 << 20,
+                                lambda user_id, online: flips["a"].append((user_id, online)))
+        b = UnixSocketBackplane(lambda channel, payload: None, str(tmp_path), 1 << 20,
+                                lambda user_id, online: flips["b"].append((user_id, online)))
+        await a.start()
+        await b.start()
+        await _wait_for(lambda: a.node_id in b.links and b.node_id in a.links)
+
+        a.set_presence(7, True)
+        await _wait_for(lambda: b.is_online(7))
+        # The user moves to the other worker: online somewhere the whole time
+        b.set_presence(7, True)
+        await _wait_for(lambda: 7 in a.remote_presence.get(b.node_id, ()))
+        a.set_presence(7, False)
+        await asyncio.sleep(0.05)
+        assert flips == {"a": [(7, True)], "b": [(7, True)]}
+
+        # b never saw the first connect, yet reports the user gone once its last socket closes
+        b.set_presence(7, False)
+        await _wait_for(lambda: not a.is_online(7))
+        assert flips == {"a": [(7, True), (7, False)], "b": [(7, True), (7, False)]}
+
+        # A worker exiting takes its users offline everywhere else
+        b.set_presence(8, True)
+        await _wait_for(lambda: a.is_online(8))
+        await b.stop()
+        await _wait_for(lambda: not a.is_online(8))
+        assert flips["a"][-2:] == [(8, True), (8, False)]
+        await a.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import timedelta
+from sqlalchemy import func, select
+from chat_events import new_message_event
+from database import WriteSessionLocal
+import chat_crud
+import fast_json
+import models
+import schemas
+
+async def _unread(db, user_id):
+    return (await db.scalars(
+        select(models.ChatReadState.unread_count).where(models.ChatReadState.user_id == user_id)
+    )).one()
+
+async def _last_read(db, user_id):
+    return (await db.scalars(
+        select(models.ChatReadState.last_read_message_id).where(models.ChatReadState.user_id == user_id)
+    )).one()
+
+def test_unread_counters_follow_sends_and_reads(chat_db):
+    async def scenario():
+        async with WriteSessionLocal() as db:
+            results = await chat_crud.create_messages(db, [
+                (schemas.MessageCreate(content=f"m{i}"), 1, 1) for i in range(3)
+            ] + [(schemas.MessageCreate(content="back"), 1, 2)])
+            ids = [message.id for message, _ in results]
+            assert (await _unread(db, 2), await _unread(db, 1)) == (3, 1)
+            # Sending is not reading
+            assert (await _last_read(db, 2), await _last_read(db, 1)) == (None, None)
+
+            summaries = await chat_crud.mark_messages_as_read(db, ids[:2], 2)
+            assert [(s["chat_id"], s["first_message_id"], s["last_message_id"], s["count"]) for s in summaries] == [
+                (1, ids[0], ids[1], 2)
+            ]
+            # Reading them again, along with Bob's own message, changes nothing
+            assert await chat_crud.mark_messages_as_read(db, ids[:2] + ids[3:], 2) == []
+            assert (await _unread(db, 2), await _last_read(db, 2)) == (1, ids[1])
+            await chat_crud.mark_messages_as_read(db, ids, 2)
+            assert (await _unread(db, 2), await _unread(db, 1)) == (0, 1)
+            [chat] = await chat_crud.get_user_chats(db, 2)
+            assert (chat["last_read_message_id"], chat["unread_count"]) == (ids[2], 0)
+
+    asyncio.run(scenario())
+
+def test_timestamps_come_back_as_utc(chat_db):
+    async def scenario():
+        async with WriteSessionLocal() as db:
+            [(sent, _)] = await chat_crud.create_messages(db, [(schemas.MessageCreate(content="hi"), 1, 1)])
+            stored = (await db.execute(select(*chat_crud.message_columns()))).one()
+        return sent, stored
+
+    sent, stored = asyncio.run(scenario())
+    assert stored.sent_at == sent.sent_at and stored.sent_at.utcoffset() == timedelta(0)
+    # Events and HTTP bodies render it identically
+    assert new_message_event(sent, 1)["message"]["sent_at"].encode() == fast_json.dumps(stored.sent_at).strip(b'"')
+
+def test_read_up_to_covers_unread_beyond_the_page(client, tokens):
+    """A reader who only ever sees the latest page still reads everything older"""
+    async def send():
+        async with WriteSessionLocal() as db:
+            results = await chat_crud.create_messages(
+                db, [(schemas.MessageCreate(content=f"m{i}"), 1, 1) for i in range(120)]
+                + [(schemas.MessageCreate(content="mine"), 1, 2)]
+            )
+        return [message.id for message, _ in results]
+
+    ids = asyncio.run(send())
+    bob = {"Authorization": f"Bearer {tokens[2]}"}
+    page = client.get("/chats/1/messages", params={"limit": 50}, headers=bob).json()["messages"]
+    assert len(page) == 50
+    [chat] = client.get("/chats", headers=bob).json()
+    assert chat["unread_count"] == 120
+
+    response = client.put("/chats/1/read", json={"up_to_message_id": page[-1]["id"]}, headers=bob)
+    assert response.json() == {"updated_count": 120}
+    [chat] = client.get("/chats", headers=bob).json()
+    assert (chat["unread_count"], chat["last_read_message_id"]) == (0, ids[119])
+    # Again, or by someone outside the chat, changes nothing
+    assert client.put("/chats/1/read", json={"up_to_message_id": ids[-1]}, headers=bob).json() == {"updated_count": 0}
+    cy = {"Authorization": f"Bearer {tokens[3]}"}
+    assert client.put("/chats/1/read", json={"up_to_message_id": ids[-1]}, headers=cy).status_code == 404
+
+    async def unread_rows():
+        async with WriteSessionLocal() as db:
+            return await db.scalar(select(func.count()).where(models.Message.is_read == False))
+
+    # Only Bob's own message is left for Ann to read, so nothing holds back archiving
+    assert asyncio.run(unread_rows()) == 1
@@ -0,0 +1,51 @@
+import pytest
+
+def _auth(tokens, user_id):
+    return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+def _chat_list(client, tokens, etag=None):
+    headers = _auth(tokens, 1)
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    return client.get("/chats/", headers=headers)
+
+@pytest.mark.parametrize("prefix", ["", "W/"])
+def test_unchanged_chat_list_is_not_sent_again(client, tokens, prefix):
+    first = _chat_list(client, tokens)
+    assert first.status_code == 200 and len(first.json()) == 1
+
+    again = _chat_list(client, tokens, prefix + first.headers["ETag"])
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["ETag"] == first.headers["ETag"]
+
+def test_send_read_and_rename_change_the_chat_list_etag(client, tokens):
+    etags = [_chat_list(client, tokens).headers["ETag"]]
+
+    sent = client.post("/chats/1/messages", json={"content": "hi"}, headers=_auth(tokens, 2))
+    assert sent.status_code == 200
+    etags.append(_chat_list(client, tokens).headers["ETag"])
+
+    read = client.put("/chats/messages/read", json={"message_ids": [sent.json()["id"]]}, headers=_auth(tokens, 1))
+    assert read.status_code == 200
+    etags.append(_chat_list(client, tokens).headers["ETag"])
+
+    renamed = client.put("/users/me", params={"full_name": "Robert"}, headers=_auth(tokens, 2))
+    assert renamed.status_code == 200
+    response = _chat_list(client, tokens, etags[-1])
+    etags.append(response.headers["ETag"])
+
+    assert len(set(etags)) == 4
+    # The old ETag no longer matches, so the new name comes back
+    assert response.status_code == 200 and response.json()[0]["other_user"]["full_name"] == "Robert"
+
+def test_unchanged_message_page_is_not_sent_again(client, tokens):
+    client.post("/chats/1/messages", json={"content": "hi"}, headers=_auth(tokens, 2))
+    first = client.get("/chats/1/messages", headers=_auth(tokens, 1))
+    assert first.status_code == 200
+
+    again = client.get("/chats/1/messages", headers={**_auth(tokens, 1), "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.content == b""
+
+    client.post("/chats/1/messages", json={"content": "again"}, headers=_auth(tokens, 2))
+    changed = client.get("/chats/1/messages", headers={**_auth(tokens, 1), "If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200 and len(changed.json()["messages"]) == 2
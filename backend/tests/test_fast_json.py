@@ -0,0 +1,52 @@
+import asyncio
+from typing import List
+import pytest
+from pydantic import TypeAdapter
+from database import AsyncSessionLocal, WriteSessionLocal
+import bench_serialization
+import chat_crud
+import fast_json
+import schemas
+
+@pytest.mark.parametrize("endpoint", ["messages", "chats", "files"])
+def test_fast_path_matches_pydantic_on_bench_rows(endpoint):
+    pydantic_path, fast_path = bench_serialization.paths(20)[endpoint]
+    assert fast_path() == pydantic_path()
+
+def test_fast_path_matches_pydantic_on_stored_rows(chat_db):
+    """What the endpoints select really renders like the schemas, fields added to either included"""
+    async def scenario():
+        async with WriteSessionLocal() as db:
+            results = await chat_crud.create_messages(db, [
+                (schemas.MessageCreate(content=f"m{i}"), 1, 1 + i % 2) for i in range(3)
+            ])
+            await chat_crud.mark_messages_as_read(db, [results[0][0].id], 2)
+        async with AsyncSessionLocal() as db:
+            chats = await chat_crud.get_user_chats(db, 2)
+            messages, _, _ = await chat_crud.get_chat_messages(db, 1, 2)
+        return chats, messages
+
+    chats, messages = asyncio.run(scenario())
+    assert chats[0]["last_read_message_id"] is not None
+
+    chats_adapter = TypeAdapter(List[schemas.ChatPublic])
+    assert fast_json.dumps([fast_json.chat_dict(chat) for chat in chats]) == chats_adapter.dump_json(
+        chats_adapter.validate_python(chats)
+    )
+    page = {"messages": [chat_crud.message_dict(m) for m in messages], "prev_cursor": None, "next_cursor": None}
+    page_adapter = TypeAdapter(schemas.MessagePage)
+    assert fast_json.dumps(page) == page_adapter.dump_json(page_adapter.validate_python(page))
+
+def test_timestamps_are_utc_with_a_z_suffix(client, tokens):
+    """The wire format for every timestamp, over HTTP and the socket alike"""
+    headers = {"Authorization": f"Bearer {tokens[2]}"}
+    with client.websocket_connect("/ws/2") as ws:
+        ws.send_json({"type": "auth", "token": tokens[2]})
+        ws.send_json({"type": "send_message", "chat_id": 1, "client_msg_id": "z-1", "content": "hi"})
+        ack = ws.receive_json()
+    assert ack["type"] == "message_ack"
+    page = client.get("/chats/1/messages", headers=headers).json()
+    [chat] = client.get("/chats", headers=headers).json()
+    stamps = [ack["message"]["sent_at"], page["messages"][0]["sent_at"], chat["created_at"], chat["last_message_at"]]
+    assert all(stamp.endswith("Z") and "+00:00" not in stamp for stamp in stamps)
+    assert ack["message"]["sent_at"] == page["messages"][0]["sent_at"]
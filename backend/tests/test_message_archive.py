@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, text
+from database import WriteSessionLocal, engine
+from db_writer import db_writer
+from config import settings
+from message_archive import MessageArchiver, archive_chat_segment
+import chat_crud
+import models
+
+def _insert_messages(rows, chat_id=1):
+    """rows: (sender_id, is_read) oldest first, all sent a year ago"""
+    sent_at = datetime.now(timezone.utc) - timedelta(days=365)
+    with engine.begin() as conn:
+        for sender_id, is_read in rows:
+            conn.execute(text(
+                "INSERT INTO messages (chat_id, sender_id, content, sent_at, is_read) VALUES (:c, :s, 'x', :t, :r)"
+            ), {"c": chat_id, "s": sender_id, "t": sent_at, "r": is_read})
+            sent_at += timedelta(seconds=1)
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+        unread = sum(1 for sender_id, is_read in rows if sender_id == 1 and not is_read)
+        conn.execute(text("UPDATE chat_read_states SET unread_count = :n WHERE chat_id = 1 AND user_id = 2"), {"n": unread})
+
+def test_archiving_stops_at_the_oldest_unread_message(chat_db):
+    # Ann's 3rd message is still unread by Bob; the 5th is the chat's newest
+    _insert_messages([(1, True), (2, True), (1, False), (2, True), (1, False)])
+
+    async def scenario():
+        async with WriteSessionLocal() as db:
+            archived = await archive_chat_segment(db, 1, datetime.now(timezone.utc), 100, "zlib")
+            remaining = (await db.scalars(select(models.Message.id).order_by(models.Message.id))).all()
+            # Bob reads everything he can still see; nothing unread was archived, so the counter reaches zero
+            await chat_crud.mark_messages_as_read(db, remaining, 2)
+            unread = await chat_crud.get_unread_message_count(db, 2)
+        return archived, remaining, unread
+
+    archived, remaining, unread = asyncio.run(scenario())
+    assert archived == 2
+    assert remaining == [3, 4, 5]
+    assert unread == 0
+
+def test_dormant_chats_do_not_use_up_the_budget(chat_db, monkeypatch):
+    monkeypatch.setattr(settings, "archive_after_days", 30)
+    monkeypatch.setattr(settings, "archive_max_segments_per_run", 2)
+    monkeypatch.setattr(settings, "archive_segment_size", 5)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO chats (id, user1_id, user2_id, version) VALUES (2, 1, 3, 0), (3, 2, 3, 0)"))
+    # Chat 1: its only message is the newest; chat 2: the oldest message is unread
+    _insert_messages([(1, True)], chat_id=1)
+    _insert_messages([(1, False), (3, True)], chat_id=2)
+    _insert_messages([(2, True)] * 11, chat_id=3)
+
+    archiver = MessageArchiver()
+
+    async def scenario():
+        await archiver.run_once()
+        # The writer's worker would otherwise be left on this loop
+        await db_writer.stop()
+
+    asyncio.run(scenario())
+    assert (archiver.segments_written, archiver.messages_archived) == (2, 10)
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import text
+from chat_crud import encode_message_cursor
+from database import WriteSessionLocal, engine
+from message_archive import archive_chat_segment
+
+def _auth(tokens, user_id):
+    return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+def _insert_messages(count, start=None):
+    """count messages a year old, two per sent_at so ties are broken by id"""
+    start = start or datetime.now(timezone.utc) - timedelta(days=365)
+    with engine.begin() as conn:
+        for i in range(count):
+            conn.execute(text(
+                "INSERT INTO messages (chat_id, sender_id, content, sent_at, is_read) VALUES (1, :s, :c, :t, 1)"
+            ), {"s": 1 + i % 2, "c": f"m{i}", "t": start + timedelta(seconds=i // 2)})
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+def _page(client, tokens, **params):
+    response = client.get("/chats/1/messages", params=params, headers=_auth(tokens, 1))
+    assert response.status_code == 200
+    page = response.json()
+    return [m["id"] for m in page["messages"]], page["prev_cursor"], page["next_cursor"]
+
+def _walk_back(client, tokens, limit):
+    pages = []
+    ids, prev_cursor, next_cursor = _page(client, tokens, limit=limit)
+    assert next_cursor is None
+    pages.append(ids)
+    while prev_cursor is not None:
+        ids, prev_cursor, next_cursor = _page(client, tokens, limit=limit, before=prev_cursor)
+        assert next_cursor is not None
+        pages.append(ids)
+    return pages
+
+def test_pages_walk_back_and_forward_without_gaps(client, tokens):
+    _insert_messages(7)
+    assert _walk_back(client, tokens, 3) == [[5, 6, 7], [2, 3, 4], [1]]
+
+    forward = []
+    next_cursor = encode_message_cursor(1)
+    while next_cursor is not None:
+        ids, prev_cursor, next_cursor = _page(client, tokens, limit=3, after=next_cursor)
+        assert prev_cursor is not None
+        forward.append(ids)
+    assert forward == [[2, 3, 4], [5, 6, 7]]
+
+def test_new_messages_do_not_shift_older_pages(client, tokens):
+    _insert_messages(6)
+    _, prev_cursor, _ = _page(client, tokens, limit=3)
+    client.post("/chats/1/messages", json={"content": "new"}, headers=_auth(tokens, 2))
+    older, _, next_cursor = _page(client, tokens, limit=3, before=prev_cursor)
+    assert older == [1, 2, 3]
+    assert _page(client, tokens, limit=3, after=next_cursor)[0] == [4, 5, 6]
+
+def test_pages_continue_into_archived_messages(client, tokens):
+    _insert_messages(7)
+
+    async def archive():
+        async with WriteSessionLocal() as db:
+            return await archive_chat_segment(db, 1, datetime.now(timezone.utc), 4, "zlib")
+
+    assert asyncio.run(archive()) == 4
+    assert _walk_back(client, tokens, 3) == [[5, 6, 7], [2, 3, 4], [1]]
+
+@pytest.mark.parametrize("params, status", [
+    ({"before": "bTE", "after": "bTE"}, 400),
+    ({"before": "not-a-cursor"}, 400),
+    ({"limit": 0}, 422),
+])
+def test_bad_page_requests(client, tokens, params, status):
+    assert client.get("/chats/1/messages", params=params, headers=_auth(tokens, 1)).status_code == status
+
+def test_non_participant_gets_no_pages(client, tokens):
+    assert client.get("/chats/1/messages", headers=_auth(tokens, 3)).status_code == 404
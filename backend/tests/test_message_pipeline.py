@@ -0,0 +1,102 @@
+import asyncio
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from database import WriteSessionLocal
+from db_writer import db_writer
+from message_pipeline import MessagePipeline
+import chat_crud
+import message_pipeline as pipeline_module
+import models
+import schemas
+
+async def _unread():
+    """unread_count by user_id in chat 1"""
+    async with WriteSessionLocal() as db:
+        rows = await db.execute(select(models.ChatReadState.user_id, models.ChatReadState.unread_count))
+        return dict(rows.all())
+
+def _run(pipeline, sends, return_exceptions=False):
+    """Submit every (content, client_msg_id, sender_id) at once; returns results and unread counts"""
+    async def scenario():
+        try:
+            results = await asyncio.gather(*(
+                pipeline.submit(schemas.MessageCreate(content=content, client_msg_id=client_msg_id), 1, sender_id)
+                for content, client_msg_id, sender_id in sends
+            ), return_exceptions=return_exceptions)
+            return results, await _unread()
+        finally:
+            await pipeline.stop()
+            # The writer's worker would otherwise be left on this loop
+            await db_writer.stop()
+
+    return asyncio.run(scenario())
+
+def test_concurrent_sends_share_one_batch(chat_db):
+    pipeline = MessagePipeline(window_ms=5, max_batch=256)
+    results, unread = _run(pipeline, [(f"m{i}", None, 1) for i in range(4)] + [("back", None, 2)])
+    assert (pipeline.batches, pipeline.messages, pipeline.fallbacks) == (1, 5, 0)
+    assert all(created for _, created in results)
+    assert [message.content for message, _ in results] == ["m0", "m1", "m2", "m3", "back"]
+    assert unread == {1: 1, 2: 4}
+
+def test_batches_are_split_at_max_batch(chat_db):
+    pipeline = MessagePipeline(window_ms=5, max_batch=2)
+    results, unread = _run(pipeline, [(f"m{i}", None, 1) for i in range(5)])
+    assert (pipeline.batches, pipeline.largest_batch, pipeline.messages) == (3, 2, 5)
+    assert len({message.id for message, _ in results}) == 5 and unread[2] == 5
+
+def test_a_retry_in_the_same_batch_is_stored_once(chat_db):
+    pipeline = MessagePipeline(window_ms=5, max_batch=256)
+    results, unread = _run(pipeline, [("hi", "c-1", 1), ("hi", "c-1", 1), ("other", "c-2", 1)])
+    (first, first_created), (retry, retry_created), (_, other_created) = results
+    assert (first_created, retry_created, other_created) == (True, False, True)
+    assert retry.id == first.id and pipeline.batches == 1
+    assert unread[2] == 2
+
+def test_a_conflict_falls_back_to_one_message_at_a_time(chat_db, monkeypatch):
+    async def store_first():
+        async with WriteSessionLocal() as db:
+            [(stored, _)] = await chat_crud.create_messages(db, [(schemas.MessageCreate(content="hi", client_msg_id="c-1"), 1, 1)])
+        return stored.id
+
+    stored_id = asyncio.run(store_first())
+
+    async def conflicting(db, items):
+        # As if another process stored c-1 between this batch's lookup and its insert
+        raise IntegrityError("INSERT INTO messages", None, Exception("unique_sender_client_msg"))
+
+    monkeypatch.setattr(pipeline_module, "create_messages", conflicting)
+    pipeline = MessagePipeline(window_ms=5, max_batch=256)
+    results, unread = _run(pipeline, [("hi", "c-1", 1), ("new", "c-2", 1)])
+    assert pipeline.fallbacks == 1
+    assert [(message.id == stored_id, created) for message, created in results] == [(True, False), (False, True)]
+    assert unread[2] == 2
+
+def test_a_failing_message_fails_only_its_own_sender(chat_db, monkeypatch):
+    real_create_message = pipeline_module.create_message
+
+    async def create_message(db, message, chat_id, sender_id):
+        if message.content == "bad":
+            raise ValueError("rejected")
+        return await real_create_message(db, message, chat_id, sender_id)
+
+    async def conflicting(db, items):
+        raise IntegrityError("INSERT INTO messages", None, Exception("unique_sender_client_msg"))
+
+    monkeypatch.setattr(pipeline_module, "create_messages", conflicting)
+    monkeypatch.setattr(pipeline_module, "create_message", create_message)
+    pipeline = MessagePipeline(window_ms=5, max_batch=256)
+    results, unread = _run(pipeline, [("ok", None, 1), ("bad", None, 1), ("fine", None, 1)], return_exceptions=True)
+    assert isinstance(results[1], ValueError)
+    assert [results[0][1], results[2][1]] == [True, True]
+    assert unread[2] == 2
+
+def test_a_failed_batch_fails_every_sender(chat_db, monkeypatch):
+    async def broken(db, items):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(pipeline_module, "create_messages", broken)
+    pipeline = MessagePipeline(window_ms=5, max_batch=256)
+    results, unread = _run(pipeline, [("a", None, 1), ("b", None, 2)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert (pipeline.batches, pipeline.fallbacks) == (1, 0) and unread == {1: 0, 2: 0}
@@ -0,0 +1,74 @@
+import pytest
+
+def _auth(tokens, user_id):
+    return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+def _send(client, tokens, content, user_id=1):
+    response = client.post("/chats/1/messages", json={"content": content}, headers=_auth(tokens, user_id))
+    assert response.status_code == 200
+    return response.json()["id"]
+
+def _search(client, tokens, q, user_id=1, url="/chats/search", **params):
+    response = client.get(url, params={"q": q, **params}, headers=_auth(tokens, user_id))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_best_match_first_every_term_last_as_prefix(client, tokens):
+    loose = _send(client, tokens, "the apple was left on a table next to some bread and cheese")
+    dense = _send(client, tokens, "apple apple pie", user_id=2)
+    _send(client, tokens, "banana bread")
+    prefix = _send(client, tokens, "an applesauce recipe")
+
+    ranked = [hit["id"] for hit in _search(client, tokens, "apple")["results"]]
+    assert ranked[0] == dense and sorted(ranked[1:]) == [loose, prefix]
+    # Every term must match; only the last may be a prefix
+    assert [hit["id"] for hit in _search(client, tokens, "apple bre")["results"]] == [loose]
+    assert [hit["id"] for hit in _search(client, tokens, "apple pi")["results"]] == [dense]
+    assert _search(client, tokens, "appl pie")["results"] == []
+
+def test_pages_continue_after_the_cursor(client, tokens):
+    ids = {_send(client, tokens, f"report number {i}") for i in range(5)}
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = _search(client, tokens, "report", **params)
+        seen += [hit["id"] for hit in page["results"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(ids) and len(seen) == len(ids)
+
+@pytest.mark.parametrize("q, matches", [
+    ('"apple', True),
+    ("apple*", True),
+    ("-apple", True),
+    ("apple^", True),
+    # Only the words count: OR, NEAR and column filters are terms like any other
+    ('apple" OR secret', False),
+    ("NEAR(apple", False),
+    ("content:apple", False),
+])
+def test_search_syntax_in_the_query_is_plain_text(client, tokens, q, matches):
+    apple = _send(client, tokens, "apple")
+    _send(client, tokens, "secret plans")
+    assert [hit["id"] for hit in _search(client, tokens, q)["results"]] == ([apple] if matches else [])
+
+@pytest.mark.parametrize("q", ['"', "***", "-"])
+def test_query_without_words_is_refused(client, tokens, q):
+    response = client.get("/chats/search", params={"q": q}, headers=_auth(tokens, 1))
+    assert (response.status_code, response.json()["detail"]) == (400, "Search needs at least one word")
+
+def test_snippets_are_html_escaped(client, tokens):
+    _send(client, tokens, "<script>alert('apple')</script>")
+    [hit] = _search(client, tokens, "apple")["results"]
+    assert "<script>" not in hit["snippet"] and "&lt;script&gt;" in hit["snippet"]
+    assert "<mark>apple</mark>" in hit["snippet"]
+
+def test_only_the_callers_chats_are_searched(client, tokens):
+    _send(client, tokens, "apple")
+    assert _search(client, tokens, "apple", user_id=3)["results"] == []
+    assert len(_search(client, tokens, "apple", user_id=2, url="/chats/1/search")["results"]) == 1
+    response = client.get("/chats/1/search", params={"q": "apple"}, headers=_auth(tokens, 3))
+    assert response.status_code == 404
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import inspect, text
+import migrate
+from database import engine
+
+# The schema as the app's import-time create_all left it before versioned migrations
+PRE_SERIES_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, full_name VARCHAR, username VARCHAR(20) NOT NULL UNIQUE, "
+    "email VARCHAR NOT NULL UNIQUE, hashed_password VARCHAR NOT NULL, email_verified BOOLEAN)",
+    "CREATE TABLE chats (id INTEGER PRIMARY KEY, user1_id INTEGER NOT NULL, user2_id INTEGER NOT NULL, "
+    "created_at DATETIME, last_message_at DATETIME, CONSTRAINT unique_user_pair UNIQUE (user1_id, user2_id))",
+    "CREATE TABLE messages (id INTEGER PRIMARY KEY, chat_id INTEGER, sender_id INTEGER, content TEXT NOT NULL, "
+    "sent_at DATETIME DEFAULT CURRENT_TIMESTAMP, is_read BOOLEAN, read_at DATETIME)",
+    "CREATE TABLE files (id INTEGER PRIMARY KEY, filename VARCHAR NOT NULL, file_path VARCHAR NOT NULL, "
+    "file_size INTEGER NOT NULL, mime_type VARCHAR NOT NULL, chat_id INTEGER, uploaded_by INTEGER, uploaded_at DATETIME)",
+    "INSERT INTO users VALUES (1, 'Ann', 'ann', 'ann@x.io', 'h', 0), (2, 'Bob', 'bob', 'bob@x.io', 'h', 0)",
+    "INSERT INTO chats VALUES (1, 1, 2, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+    "INSERT INTO messages (chat_id, sender_id, content, is_read) VALUES (1, 1, 'hi', 0), (1, 2, 'hello', 1)",
+]
+
+def test_pre_series_schema_upgrades(fresh_db):
+    with engine.begin() as conn:
+        for statement in PRE_SERIES_SCHEMA:
+            conn.execute(text(statement))
+
+    migrate.upgrade()
+
+    assert migrate.applied_versions() == {m.version for m in migrate.migrations}
+    with engine.connect() as conn:
+        indexes = {i["name"]: i for i in inspect(conn).get_indexes("messages")}
+        assert indexes["unique_sender_client_msg"]["unique"]
+        # Bob has not read Ann's message; Ann has read Bob's
+        assert conn.execute(text(
+            "SELECT user_id, last_read_message_id, unread_count FROM chat_read_states WHERE chat_id = 1 ORDER BY user_id"
+        )).all() == [(1, 2, 0), (2, None, 1)]
+
+def test_fresh_database_upgrades_without_duplicate_index(fresh_db):
+    migrate.upgrade()
+    with engine.connect() as conn:
+        names = [i["name"] for i in inspect(conn).get_indexes("messages")]
+    assert "unique_sender_client_msg" not in names
+
+def test_offline_migrations_never_build_concurrent_indexes(fresh_db):
+    # PostgreSQL rejects CREATE INDEX CONCURRENTLY in a transaction block; create_index refuses on every database
+    with engine.begin() as conn:
+        with pytest.raises(RuntimeError):
+            migrate.create_index(conn, "ix_test", "users", "email")
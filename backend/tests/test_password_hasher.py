@@ -0,0 +1,80 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from passlib.context import CryptContext
+from sqlalchemy import text
+from database import engine
+import password_hasher as password_hasher_module
+from password_hasher import PasswordHasher, PasswordHasherBusy, password_hasher
+import routers.auth
+
+@pytest.fixture
+def rounds(monkeypatch):
+    """Hashes are checked at 5 rounds; returns a hasher for 4, the 'outdated' work factor"""
+    monkeypatch.setattr(password_hasher_module, "pwd_context", CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5
+    ))
+    return CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+def _set_password_hash(user_id, hashed_password):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET hashed_password = :h WHERE id = :id"), {"h": hashed_password, "id": user_id})
+
+def _password_hash(user_id):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT hashed_password FROM users WHERE id = :id"), {"id": user_id}).scalar()
+
+def _login(client, password):
+    return client.post("/auth/login", json={"username": "ann", "password": password})
+
+def test_outdated_hash_is_replaced_on_login(client, rounds):
+    _set_password_hash(1, rounds.hash("pw"))
+    rehashed = password_hasher.rehashed
+
+    assert _login(client, "pw").status_code == 200
+    upgraded = _password_hash(1)
+    assert upgraded.startswith("$2b$05$") and password_hasher.rehashed == rehashed + 1
+
+    # Already current: the next login keeps it
+    assert _login(client, "pw").status_code == 200
+    assert _password_hash(1) == upgraded and password_hasher.rehashed == rehashed + 1
+
+def test_wrong_password_keeps_the_old_hash(client, rounds):
+    old = rounds.hash("pw")
+    _set_password_hash(1, old)
+    response = _login(client, "nope")
+    assert (response.status_code, response.json()["detail"]) == (400, "Incorrect username or password")
+    assert _password_hash(1) == old
+
+def test_full_hasher_answers_503(client, rounds, monkeypatch):
+    _set_password_hash(1, rounds.hash("pw"))
+    monkeypatch.setattr(routers.auth, "password_hasher", PasswordHasher(workers=1, max_queue=0))
+    response = _login(client, "pw")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+def test_jobs_beyond_the_queue_are_rejected_straight_away(monkeypatch):
+    def slow_hash(password):
+        time.sleep(0.2)
+        return password
+
+    monkeypatch.setattr(password_hasher_module, "pwd_context", SimpleNamespace(hash=slow_hash))
+    hasher = PasswordHasher(workers=1, max_queue=1)
+
+    async def scenario():
+        running = asyncio.create_task(hasher.hash("a"))
+        queued = asyncio.create_task(hasher.hash("b"))
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash("c")
+        rejected_after = time.perf_counter() - started
+        return await running, await queued, rejected_after
+
+    try:
+        first, second, rejected_after = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    # Not queued behind the running job
+    assert (first, second) == ("a", "b") and rejected_after < 0.1
+    assert (hasher.completed, hasher.rejected) == (2, 1)
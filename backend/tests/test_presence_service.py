@@ -0,0 +1,30 @@
+import asyncio
+from presence_service import PresenceService
+
+def test_last_seen_keeps_only_the_most_recently_offline():
+    async def scenario():
+        presence = PresenceService(debounce_seconds=60, max_last_seen=2)
+        for user_id in (1, 2, 3):
+            presence.on_presence_change(user_id, False)
+        kept_after_offline = list(presence.last_seen)
+        # Coming back online needs no last_seen; going offline again makes it the newest
+        presence.on_presence_change(2, True)
+        presence.on_presence_change(4, False)
+        presence.on_presence_change(2, False)
+        for timer in presence._pending.values():
+            timer.cancel()
+        return kept_after_offline, list(presence.last_seen)
+
+    kept_after_offline, kept = asyncio.run(scenario())
+    assert kept_after_offline == [2, 3]
+    assert kept == [4, 2]
+
+def test_settled_offline_users_are_forgotten(chat_db):
+    async def scenario():
+        presence = PresenceService(debounce_seconds=60, max_last_seen=10)
+        # Announced online earlier; no socket of theirs is open now
+        presence._announced_online.add(5)
+        await presence._settle(5)
+        return presence._announced_online
+
+    assert asyncio.run(scenario()) == set()
@@ -0,0 +1,63 @@
+import os
+import pytest
+from database import async_engine
+import file_service
+import routers.files
+
+@pytest.fixture(autouse=True)
+def upload_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_service, "IMAGES_DIR", str(tmp_path / "images"))
+    monkeypatch.setattr(file_service, "DOCUMENTS_DIR", str(tmp_path / "documents"))
+    monkeypatch.setattr(file_service, "MAX_FILE_SIZE", 1000)
+
+def _stored_files(tmp_path):
+    return sorted(name for _, _, names in os.walk(tmp_path) for name in names)
+
+def _auth(tokens, user_id):
+    return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+def test_upload_is_stored_and_hashed(client, tokens, tmp_path):
+    response = client.post("/chats/1/files", files={"file": ("a.txt", b"hello", "text/plain")}, headers=_auth(tokens, 1))
+    assert response.status_code == 200
+    assert response.json()["file_size"] == 5
+    [name] = _stored_files(tmp_path)
+    assert name.endswith(".txt")
+
+def test_no_pooled_connection_is_held_while_the_body_streams(client, tokens, monkeypatch):
+    checked_out = []
+
+    async def receive_upload(request, chat_id):
+        checked_out.append(async_engine.pool.checkedout())
+        return await file_service.receive_upload(request, chat_id)
+
+    monkeypatch.setattr(routers.files, "receive_upload", receive_upload)
+    response = client.post("/chats/1/files", files={"file": ("a.txt", b"hello", "text/plain")}, headers=_auth(tokens, 1))
+    assert response.status_code == 200 and checked_out == [0]
+
+@pytest.mark.parametrize("body, content_type, status, detail", [
+    # Over the limit: refused, and nothing is left on disk
+    (b"--BB\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.txt\"\r\n"
+     b"Content-Type: text/plain\r\n\r\n" + b"x" * 2000 + b"\r\n--BB--\r\n",
+     "multipart/form-data; boundary=BB", 413, "File exceeds maximum allowed size 1000"),
+    (b"garbage without any boundary", "multipart/form-data; boundary=BB", 400, "Malformed multipart body"),
+    (b"--BB\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.txt\"\r\n"
+     b"Content-Type: text/plain\r\n\r\nabc", "multipart/form-data; boundary=BB", 400, "Incomplete upload"),
+    (b"--BB\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.exe\"\r\n"
+     b"Content-Type: application/x-msdownload\r\n\r\nMZ\r\n--BB--\r\n",
+     "multipart/form-data; boundary=BB", 400, "File type application/x-msdownload is not allowed"),
+    (b"{}", "application/json", 400, "Expected a multipart/form-data upload"),
+])
+def test_bad_uploads_are_refused(client, tokens, tmp_path, body, content_type, status, detail):
+    response = client.post("/chats/1/files", content=body, headers={**_auth(tokens, 1), "Content-Type": content_type})
+    assert (response.status_code, response.json()["detail"]) == (status, detail)
+    assert _stored_files(tmp_path) == []
+
+def test_declared_length_over_the_limit_is_refused_up_front(client, tokens):
+    body = b"x" * (1000 + file_service.MULTIPART_OVERHEAD + 1)
+    response = client.post("/chats/1/files", content=body,
+                           headers={**_auth(tokens, 1), "Content-Type": "multipart/form-data; boundary=BB"})
+    assert response.status_code == 413
+
+def test_non_participant_cannot_upload(client, tokens):
+    response = client.post("/chats/1/files", files={"file": ("a.txt", b"hi", "text/plain")}, headers=_auth(tokens, 3))
+    assert response.status_code == 404
@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import text
+from database import engine
+import user_search
+
+@pytest.fixture
+def people(chat_db):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO users (id, full_name, username, email, hashed_password) VALUES "
+            "(4, 'Belle Smith', 'annabel', 'a4@x.io', 'h'), (5, 'Ann', 'zz5', 'a5@x.io', 'h'), "
+            "(6, 'Annika Berg', 'qq6', 'a6@x.io', 'h'), (7, 'Mary Ann', 'ww7', 'a7@x.io', 'h'), "
+            "(8, 'Lee Annetta', 'vv8', 'a8@x.io', 'h'), (9, 'Åsa Öberg', 'asa', 'a9@x.io', 'h')"
+        ))
+        user_search.backfill(conn)
+
+def _search(client, tokens, q, user_id=3):
+    response = client.get("/users/search", params={"q": q}, headers={"Authorization": f"Bearer {tokens[user_id]}"})
+    assert response.status_code == 200, response.text
+    return [user["username"] for user in response.json()]
+
+def test_ranked_username_then_full_name_then_later_words(client, tokens, people):
+    assert _search(client, tokens, "ann") == ["ann", "annabel", "zz5", "qq6", "ww7", "vv8"]
+
+@pytest.mark.parametrize("q", ["ÖBER", "ober", "  Öberg!", "asa"])
+def test_case_and_accents_do_not_matter(client, tokens, people, q):
+    assert _search(client, tokens, q) == ["asa"]
+
+@pytest.mark.parametrize("q", ["%", "_", "*", "a%n", "."])
+def test_wildcards_are_not_patterns(client, tokens, people, q):
+    # % and the like are dropped or matched literally, never as "anything"; as LIKE, a%n would match ann
+    assert _search(client, tokens, q) == []
+
+def test_the_caller_is_not_a_result(client, tokens, people):
+    assert "ann" not in _search(client, tokens, "ann", user_id=1)
+
+def test_renamed_users_are_found_by_their_new_name(client, tokens, people):
+    headers = {"Authorization": f"Bearer {tokens[2]}"}
+    assert client.put("/users/me", params={"full_name": "Xavier Bob"}, headers=headers).status_code == 200
+    assert _search(client, tokens, "xav") == ["bob"]
+    assert _search(client, tokens, "bob") == ["bob"]
@@ -0,0 +1,97 @@
+import asyncio
+from config import settings
+from websocket_manager import ConnectionManager
+
+class StalledSocket:
+    """Accepts frames into nothing: every send waits forever, so the queue fills"""
+
+    def __init__(self):
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+class RecordingSocket(StalledSocket):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+def test_slow_consumer_disconnect_during_broadcast(monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 2)
+    monkeypatch.setattr(settings, "ws_slow_consumer_policy", "disconnect")
+
+    async def scenario():
+        manager = ConnectionManager()
+        slow = await manager.connect(StalledSocket(), user_id=1)
+        fast = await manager.connect(StalledSocket(), user_id=2)
+        await manager.join_chat(1, 10)
+        await manager.join_chat(2, 10)
+        fast.max_queue = 100
+
+        for i in range(5):
+            await manager.broadcast_to_chat({"type": "new_message", "n": i}, 10)
+        await asyncio.sleep(0.01)
+
+        assert slow.closed and slow.websocket.closed_with == 1013
+        assert 1 not in manager.active_connections
+        # The other member kept every message (one is in flight, the rest queued)
+        assert not fast.closed and fast.dropped_frames == 0 and len(fast._queue) == 4
+        for connection in (slow, fast):
+            connection.close()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+
+def test_broadcast_skips_only_the_originating_socket():
+    async def scenario():
+        manager = ConnectionManager()
+        sender_tab = await manager.connect(RecordingSocket(), user_id=1)
+        sender_phone = await manager.connect(RecordingSocket(), user_id=1)
+        recipient = await manager.connect(RecordingSocket(), user_id=2)
+        await manager.join_chat(1, 10)
+        await manager.join_chat(2, 10)
+
+        await manager.broadcast_to_chat({"type": "new_message"}, 10, exclude_connection_id=sender_tab.id)
+        await asyncio.sleep(0.01)
+        counts = [len(c.websocket.sent) for c in (sender_tab, sender_phone, recipient)]
+        for connection in (sender_tab, sender_phone, recipient):
+            connection.close()
+        await asyncio.sleep(0)
+        return counts
+
+    assert asyncio.run(scenario()) == [0, 1, 1]
+
+def test_heartbeat_pings_and_reaps_silent_sockets(monkeypatch):
+    monkeypatch.setattr(settings, "ws_ping_interval_seconds", 0.05)
+    monkeypatch.setattr(settings, "ws_idle_timeout_seconds", 0.15)
+
+    async def scenario():
+        manager = ConnectionManager()
+        await manager.start()
+        answering = await manager.connect(RecordingSocket(), user_id=1)
+        silent = await manager.connect(RecordingSocket(), user_id=2)
+        pongs = 0
+        for _ in range(20):
+            await asyncio.sleep(0.02)
+            # What the receive loop does when the pong arrives
+            if len([frame for frame in answering.websocket.sent if '"ping"' in frame]) > pongs:
+                pongs += 1
+                answering.touch()
+        await asyncio.sleep(0.01)
+        await manager.stop()
+        return manager, answering, silent, pongs
+
+    manager, answering, silent, pongs = asyncio.run(scenario())
+    assert pongs >= 2 and not answering.closed
+    assert any('"ping"' in frame for frame in silent.websocket.sent)
+    assert silent.closed and silent.websocket.closed_with == 1001
+    assert manager.reaped_connections == 1
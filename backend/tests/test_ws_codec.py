@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from websocket_manager import ConnectionManager
+from ws_codec import CODECS, JSON, JsonCodec, decode_frame
+
+# msgpack is optional; the JSON codec needs nothing extra
+needs_msgpack = pytest.mark.skipif("msgpack" not in CODECS, reason="msgpack is not installed")
+
+class CountingCodec(JsonCodec):
+    name = "counting"
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, event):
+        self.encoded += 1
+        return super().encode(event)
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        pass
+
+def test_broadcast_is_encoded_once_per_codec():
+    codec = CountingCodec()
+
+    async def scenario():
+        manager = ConnectionManager()
+        connections = [await manager.connect(RecordingSocket(), user_id, codec) for user_id in (1, 1, 2)]
+        connections.append(await manager.connect(RecordingSocket(), 2))
+        await manager.join_chat(1, 10)
+        await manager.join_chat(2, 10)
+
+        await manager.broadcast_to_chat({"type": "new_message", "chat_id": 10}, 10)
+        await asyncio.sleep(0.01)
+        sent = [c.websocket.sent for c in connections]
+        for connection in connections:
+            connection.close()
+        await asyncio.sleep(0)
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert codec.encoded == 1
+    # Same frame text for every recipient, whichever codec encoded it
+    assert len({frames[0] for frames in sent}) == 1 and all(len(frames) == 1 for frames in sent)
+
+@needs_msgpack
+def test_binary_codec_accepts_json_text_control_frames():
+    msgpack = CODECS["msgpack"]
+    assert decode_frame(msgpack, {"text": '{"type": "ping"}'}) == {"type": "ping"}
+    assert decode_frame(msgpack, {"bytes": msgpack.encode({"type": "ping"})}) == {"type": "ping"}
+    assert decode_frame(JSON, {"type": "websocket.receive"}) is None
+
+def _authenticate(ws, tokens):
+    # Control frames may always be JSON text
+    ws.send_json({"type": "auth", "token": tokens[2]})
+
+@needs_msgpack
+@pytest.mark.parametrize("url, subprotocols, accepted", [
+    ("/ws/2", ["chat.msgpack"], "chat.msgpack"),
+    ("/ws/2?codec=msgpack", [], None),
+])
+def test_msgpack_is_negotiated(client, tokens, url, subprotocols, accepted):
+    with client.websocket_connect(url, subprotocols=subprotocols) as ws:
+        assert ws.accepted_subprotocol == accepted
+        _authenticate(ws, tokens)
+        msgpack = CODECS["msgpack"]
+        ws.send_bytes(msgpack.encode({"type": "ping", "ts": 1}))
+        assert msgpack.decode(ws.receive_bytes()) == {"type": "pong", "ts": 1}
+
+@pytest.mark.parametrize("url, subprotocols", [
+    ("/ws/2", []),
+    ("/ws/2?codec=nope", []),
+    ("/ws/2", ["chat.nope"]),
+])
+def test_json_is_the_default(client, tokens, url, subprotocols):
+    with client.websocket_connect(url, subprotocols=subprotocols) as ws:
+        assert ws.accepted_subprotocol is None
+        _authenticate(ws, tokens)
+        ws.send_json({"type": "ping", "ts": 1})
+        assert ws.receive_json() == {"type": "pong", "ts": 1}
+
+def test_unknown_frame_types_are_ignored(client, tokens):
+    with client.websocket_connect("/ws/2") as ws:
+        _authenticate(ws, tokens)
+        ws.send_json({"type": "no_such_frame"})
+        ws.send_json({"type": "ping", "ts": 2})
+        assert ws.receive_json() == {"type": "pong", "ts": 2}
+
+@pytest.mark.parametrize("send, frame_type", [
+    (lambda ws: ws.send_text("{not json"), None),
+    (lambda ws: ws.send_json([1, 2]), None),
+    (lambda ws: ws.send_json({"type": "resume", "chat_id": 1, "epoch": None, "last_seq": "x"}), "resume"),
+    (lambda ws: ws.send_json({"type": "resume", "chat_id": 1, "epoch": None, "last_seq": None}), "resume"),
+])
+def test_malformed_frames_answer_an_error(client, tokens, send, frame_type):
+    with client.websocket_connect("/ws/2") as ws:
+        _authenticate(ws, tokens)
+        send(ws)
+        assert ws.receive_json() == {"type": "error", "frame_type": frame_type, "detail": "Malformed frame"}
+        # The socket is still served
+        ws.send_json({"type": "ping", "ts": 3})
+        assert ws.receive_json() == {"type": "pong", "ts": 3}
+
+@needs_msgpack
+def test_malformed_msgpack_is_a_value_error():
+    with pytest.raises(ValueError):
+        decode_frame(CODECS["msgpack"], {"bytes": b"\xc1"})
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import func, select, text
+from starlette.websockets import WebSocketDisconnect
+from config import settings
+from database import engine
+from presence_service import presence_service
+from websocket_manager import manager
+import models
+
+@pytest.mark.parametrize("first_frame", [
+    {"type": "auth"},
+    {"type": "auth", "token": "garbage"},
+    # Ann's valid token does not open Bob's socket either
+    {"type": "auth", "token": "{ann}"},
+    {"type": "ping", "ts": 1},
+])
+def test_socket_without_the_users_token_is_refused(client, tokens, first_frame):
+    if first_frame.get("token") == "{ann}":
+        first_frame = {**first_frame, "token": tokens[1]}
+    with client.websocket_connect("/ws/2") as ws:
+        ws.send_json(first_frame)
+        with pytest.raises(WebSocketDisconnect) as refused:
+            ws.receive_json()
+    assert refused.value.code == 1008
+    assert not manager.is_online(2)
+    assert presence_service.status(2)["status"] == "offline"
+
+def test_token_in_the_url_is_not_accepted(client, tokens):
+    with client.websocket_connect(f"/ws/2?token={tokens[2]}") as ws:
+        ws.send_json({"type": "ping", "ts": 1})
+        with pytest.raises(WebSocketDisconnect) as refused:
+            ws.receive_json()
+    assert refused.value.code == 1008
+
+def test_socket_that_never_authenticates_is_closed(client, monkeypatch):
+    monkeypatch.setattr(settings, "ws_auth_timeout_seconds", 0.05)
+    with client.websocket_connect("/ws/2") as ws:
+        with pytest.raises(WebSocketDisconnect) as refused:
+            ws.receive_json()
+    assert refused.value.code == 1008 and not manager.is_online(2)
+
+def test_socket_with_the_users_token_is_online(client, tokens):
+    with client.websocket_connect("/ws/2") as ws:
+        ws.send_json({"type": "auth", "token": tokens[2]})
+        ws.send_json({"type": "ping", "ts": 1})
+        assert ws.receive_json() == {"type": "pong", "ts": 1}
+        assert manager.is_online(2)
+
+def test_send_message_is_acked_once_and_retries_are_idempotent(client, tokens):
+    frame = {"type": "send_message", "chat_id": 1, "content": "hi", "client_msg_id": "c-1"}
+    with client.websocket_connect("/ws/1") as ws:
+        ws.send_json({"type": "auth", "token": tokens[1]})
+        ws.send_json(frame)
+        ack = ws.receive_json()
+        # The ack was lost, say; the client sends the same frame again
+        ws.send_json(frame)
+        retry = ws.receive_json()
+
+    assert (ack["type"], ack["client_msg_id"], ack["duplicate"]) == ("message_ack", "c-1", False)
+    assert ack["message"]["id"] and ack["message"]["sent_at"].endswith("Z")
+    assert (retry["type"], retry["duplicate"], retry["message"]) == ("message_ack", True, ack["message"])
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(models.Message.__table__)).scalar() == 1
+        assert conn.execute(text(
+            "SELECT unread_count FROM chat_read_states WHERE chat_id = 1 AND user_id = 2"
+        )).scalar() == 1
+
+@pytest.mark.parametrize("frame, detail", [
+    ({"type": "send_message", "chat_id": 1, "content": "hi"}, "chat_id and client_msg_id are required"),
+    ({"type": "send_message", "chat_id": 1, "client_msg_id": "c-2"}, "Invalid message"),
+])
+def test_bad_sends_get_an_error_instead_of_an_ack(client, tokens, frame, detail):
+    with client.websocket_connect("/ws/1") as ws:
+        ws.send_json({"type": "auth", "token": tokens[1]})
+        ws.send_json(frame)
+        reply = ws.receive_json()
+    assert (reply["type"], reply["detail"]) == ("message_error", detail)
+
+def test_non_participant_cannot_send(client, tokens):
+    with client.websocket_connect("/ws/3") as ws:
+        ws.send_json({"type": "auth", "token": tokens[3]})
+        ws.send_json({"type": "send_message", "chat_id": 1, "content": "hi", "client_msg_id": "c-3"})
+        reply = ws.receive_json()
+    assert (reply["type"], reply["detail"]) == ("message_error", "Chat not found")
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import pytest
+from replay_buffer import ReplayBuffers
+from websocket_manager import manager
+import ws_handlers
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        pass
+
+async def _frames(connection, frame):
+    await ws_handlers.dispatch(connection, frame)
+    await asyncio.sleep(0.01)
+    return connection.websocket.sent
+
+@pytest.mark.parametrize("frame_type", ["join_chat", "resume"])
+@pytest.mark.parametrize("user_id, authenticated, detail", [
+    (2, False, "Authentication required"),
+    (3, True, "Chat not found"),
+])
+def test_join_and_resume_refused(chat_db, frame_type, user_id, authenticated, detail):
+    async def scenario():
+        connection = await manager.connect(RecordingSocket(), user_id)
+        connection.authenticated = authenticated
+        # Someone is talking in chat 1, so a resume would have events to replay
+        await manager.broadcast_to_chat({"type": "new_message", "chat_id": 1}, 1)
+        sent = await _frames(connection, {"type": frame_type, "chat_id": 1, "epoch": None, "last_seq": 0})
+        manager.disconnect(connection)
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 1 and '"chat_error"' in sent[0] and detail in sent[0]
+    assert user_id not in manager.chat_connections.get(1, set())
+
+def test_participant_joins(chat_db):
+    async def scenario():
+        connection = await manager.connect(RecordingSocket(), 2)
+        connection.authenticated = True
+        sent = await _frames(connection, {"type": "join_chat", "chat_id": 1})
+        joined = 2 in manager.chat_connections.get(1, set())
+        manager.disconnect(connection)
+        return sent, joined
+
+    sent, joined = asyncio.run(scenario())
+    assert joined and '"chat_joined"' in sent[0]
+
+@pytest.mark.parametrize("user_id, authenticated, join", [
+    (2, False, False),
+    (3, True, False),
+    # Joined, but the frame names a chat the socket never joined
+    (2, True, True),
+])
+def test_typing_refused_outside_joined_chats(chat_db, user_id, authenticated, join):
+    async def scenario():
+        listener = await manager.connect(RecordingSocket(), 1)
+        log = await manager.join_chat(1, 1)
+        connection = await manager.connect(RecordingSocket(), user_id)
+        connection.authenticated = authenticated
+        if join:
+            await _frames(connection, {"type": "join_chat", "chat_id": 1})
+            connection.websocket.sent.clear()
+        seq = log.seq
+        sent = await _frames(connection, {"type": "typing", "chat_id": 2 if join else 1, "is_typing": True})
+        manager.disconnect(connection)
+        manager.disconnect(listener)
+        return sent, listener.websocket.sent, log.seq - seq
+
+    sent, heard, recorded = asyncio.run(scenario())
+    assert len(sent) == 1 and '"chat_error"' in sent[0] and "Join the chat first" in sent[0]
+    # Neither delivered nor kept for replay
+    assert not [frame for frame in heard if '"typing"' in frame] and recorded == 0
+
+def test_typing_reaches_the_room_once_joined(chat_db):
+    async def scenario():
+        listener = await manager.connect(RecordingSocket(), 1)
+        await manager.join_chat(1, 1)
+        connection = await manager.connect(RecordingSocket(), 2)
+        connection.authenticated = True
+        await _frames(connection, {"type": "join_chat", "chat_id": 1})
+        await _frames(connection, {"type": "typing", "chat_id": 1, "is_typing": True})
+        await _frames(connection, {"type": "typing", "chat_id": 1, "is_typing": False})
+        manager.disconnect(connection)
+        manager.disconnect(listener)
+        return listener.websocket.sent
+
+    heard = asyncio.run(scenario())
+    assert len([frame for frame in heard if '"typing"' in frame]) == 2
+
+@pytest.mark.parametrize("frame", [
+    # The upload route announces files itself, clients cannot
+    {"type": "file_uploaded", "chat_id": 1, "file": {"filename": "x.exe", "download_url": "http://evil"}},
+    # Receipts are persisted by PUT /chats/messages/read, never relayed unstored
+    {"type": "message_read", "chat_id": 1, "message_id": 1},
+])
+def test_client_cannot_announce_into_a_chat(chat_db, frame):
+    async def scenario():
+        listener = await manager.connect(RecordingSocket(), 1)
+        log = await manager.join_chat(1, 1)
+        connection = await manager.connect(RecordingSocket(), 3)
+        connection.authenticated = True
+        seq = log.seq
+        await _frames(connection, frame)
+        manager.disconnect(connection)
+        manager.disconnect(listener)
+        return listener.websocket.sent, log.seq - seq
+
+    heard, recorded = asyncio.run(scenario())
+    assert not [sent for sent in heard if f'"{frame["type"]}"' in sent] and recorded == 0
+
+async def _missed_while_away(events, evict=False):
+    """Join chat 1 as Bob, drop the socket, broadcast events, then resume on a new one"""
+    connection = await manager.connect(RecordingSocket(), 2)
+    connection.authenticated = True
+    [joined] = [json.loads(frame) for frame in await _frames(connection, {"type": "join_chat", "chat_id": 1})]
+    manager.disconnect(connection)
+
+    for event, exclude_user_id in events:
+        await manager.broadcast_to_chat(event, 1, exclude_user_id=exclude_user_id)
+    if evict:
+        # Another chat takes the only slot, so chat 1's log is dropped
+        manager.replay.get(99)
+    await asyncio.sleep(0.01)
+
+    connection = await manager.connect(RecordingSocket(), 2)
+    connection.authenticated = True
+    sent = await _frames(connection, {
+        "type": "resume", "chat_id": 1, "epoch": joined["epoch"], "last_seq": joined["seq"]
+    })
+    manager.disconnect(connection)
+    return joined, [json.loads(frame) for frame in sent]
+
+@pytest.fixture
+def small_replay(monkeypatch):
+    """Fresh logs of four events, for at most one chat"""
+    monkeypatch.setattr(manager, "replay", ReplayBuffers(manager.backplane.node_id, 4, 1, manager._replay_evicted))
+
+def test_resume_replays_the_gap(chat_db, small_replay):
+    events = [
+        ({"type": "new_message", "chat_id": 1, "n": 1}, None),
+        # Bob's own send, already acked to him
+        ({"type": "new_message", "chat_id": 1, "n": 2}, 2),
+        ({"type": "new_message", "chat_id": 1, "n": 3}, None),
+    ]
+    joined, sent = asyncio.run(_missed_while_away(events))
+    *replayed, resumed = sent
+    assert [(frame["n"], frame["seq"]) for frame in replayed] == [(1, joined["seq"] + 1), (3, joined["seq"] + 3)]
+    assert resumed == {
+        "type": "resumed", "chat_id": 1, "seq": joined["seq"] + 3, "epoch": joined["epoch"], "reason": None
+    }
+
+def test_resume_beyond_the_buffer_asks_for_a_refetch(chat_db, small_replay):
+    events = [({"type": "new_message", "chat_id": 1, "n": n}, None) for n in range(6)]
+    joined, sent = asyncio.run(_missed_while_away(events))
+    assert sent == [{
+        "type": "resume_failed", "chat_id": 1, "seq": joined["seq"] + 6, "epoch": joined["epoch"], "reason": "too_old"
+    }]
+
+def test_resume_after_eviction_starts_a_new_epoch(chat_db, small_replay):
+    joined, sent = asyncio.run(_missed_while_away([({"type": "new_message", "chat_id": 1}, None)], evict=True))
+    [failed] = sent
+    assert failed["type"] == "resume_failed" and failed["reason"] == "too_old"
+    assert failed["epoch"] != joined["epoch"] and failed["seq"] == 0
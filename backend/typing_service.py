@@ -0,0 +1,76 @@
+import asyncio
+from typing import Dict, Set, Tuple
+from config import settings
+from websocket_manager import manager
+
+class TypingTracker:
+    """Per-(user, chat) typing state, so the room only hears start and stop transitions.
+
+    Repeated is_typing=true frames just push the expiry back. A user who goes
+    quiet for typing_timeout_seconds, or disconnects, is reported as stopped.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        # (user_id, chat_id) -> expiry timer of a user currently typing
+        self._active: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        # user_id -> chats they are typing in, for cleanup on disconnect
+        self._user_chats: Dict[int, Set[int]] = {}
+
+    async def update(self, user_id: int, chat_id: int, is_typing: bool):
+        if is_typing:
+            await self.start(user_id, chat_id)
+        else:
+            await self.stop(user_id, chat_id)
+
+    async def start(self, user_id: int, chat_id: int):
+        key = (user_id, chat_id)
+        timer = self._active.get(key)
+        if timer is not None:
+            timer.cancel()
+        self._active[key] = asyncio.get_running_loop().call_later(self.timeout, self._expire, key)
+        if timer is None:
+            self._user_chats.setdefault(user_id, set()).add(chat_id)
+            await self._broadcast(user_id, chat_id, True)
+
+    async def stop(self, user_id: int, chat_id: int):
+        if self._forget((user_id, chat_id)):
+            await self._broadcast(user_id, chat_id, False)
+
+    async def clear_user(self, user_id: int):
+        """Stop every typing indicator of a user, e.g. when their last socket closes"""
+        for chat_id in list(self._user_chats.get(user_id, ())):
+            await self.stop(user_id, chat_id)
+
+    def _forget(self, key: Tuple[int, int]) -> bool:
+        timer = self._active.pop(key, None)
+        if timer is None:
+            return False
+        timer.cancel()
+        user_id, chat_id = key
+        chats = self._user_chats.get(user_id)
+        if chats is not None:
+            chats.discard(chat_id)
+            if not chats:
+                del self._user_chats[user_id]
+        return True
+
+    def _expire(self, key: Tuple[int, int]):
+        asyncio.create_task(self.stop(*key))
+
+    async def _broadcast(self, user_id: int, chat_id: int, is_typing: bool):
+        await manager.broadcast_to_chat(
+            {
+                "type": "typing",
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "is_typing": is_typing
+            },
+            chat_id,
+            exclude_user_id=user_id,
+            # Only the latest typing state matters to a backed-up client
+            coalesce_key=("typing", chat_id, user_id)
+        )
+
+# Global instance
+typing_tracker = TypingTracker(settings.typing_timeout_seconds)
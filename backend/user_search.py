@@ -0,0 +1,91 @@
+"""Prefix search over users by username and full name.
+
+Each user has a few normalized terms in user_search_terms: the username,
+the whole full name and each later word of it. A search is one range scan
+of the term index, so its cost does not grow with the users table.
+"""
+import re
+import unicodedata
+from typing import List, Tuple
+from sqlalchemy import delete, insert, select, func, case, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+
+# Term kinds, in ranking order
+USERNAME, FULL_NAME, NAME_WORD = 0, 1, 2
+# Index entries read per search; exact matches sort first within the range
+MAX_CANDIDATES = 500
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def normalize(value: str) -> str:
+    """Lowercase, accents stripped, words separated by single spaces"""
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(_WORD.findall(stripped))
+
+def user_terms(username: str, full_name: str) -> List[Tuple[str, int]]:
+    """(term, kind) pairs of a user; the first name word is covered by the full name"""
+    terms = [(normalize(username), USERNAME)]
+    name = normalize(full_name or "")
+    if name:
+        terms.append((name, FULL_NAME))
+        terms.extend((word, NAME_WORD) for word in set(name.split(" ")[1:]))
+    return [(term[:100], kind) for term, kind in terms if term]
+
+def _rows(user_id: int, username: str, full_name: str) -> List[dict]:
+    return [
+        {"term": term, "user_id": user_id, "kind": kind}
+        for term, kind in set(user_terms(username, full_name))
+    ]
+
+async def index_user(db: AsyncSession, user: models.User):
+    """Replace a user's terms, in the caller's transaction"""
+    await db.execute(delete(models.UserSearchTerm).where(models.UserSearchTerm.user_id == user.id))
+    await db.execute(insert(models.UserSearchTerm), _rows(user.id, user.username, user.full_name))
+
+def backfill(conn: Connection, batch_size: int = 1000):
+    """Index every user that has no terms yet, for the migration"""
+    last_id = 0
+    while True:
+        users = conn.execute(text(
+            "SELECT id, username, full_name FROM users WHERE id > :last_id "
+            "AND NOT EXISTS (SELECT 1 FROM user_search_terms t WHERE t.user_id = users.id) "
+            "ORDER BY id LIMIT :batch_size"
+        ), {"last_id": last_id, "batch_size": batch_size}).all()
+        if not users:
+            return
+        rows = [row for user in users for row in _rows(*user)]
+        if rows:
+            conn.execute(insert(models.UserSearchTerm), rows)
+        last_id = users[-1].id
+
+def _range_end(prefix: str) -> str:
+    # Smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+async def search_users(db: AsyncSession, query: str, exclude_user_id: int, limit: int = 10):
+    """Users whose username or name starts with the query.
+
+    Ranked: exact username, username prefix, exact full name, full name
+    prefix, exact later name word, name word prefix; then by username.
+    """
+    prefix = normalize(query)
+    if not prefix:
+        return []
+
+    terms = models.UserSearchTerm
+    candidates = select(terms.user_id, terms.term, terms.kind).where(
+        terms.term >= prefix,
+        terms.term < _range_end(prefix),
+        terms.user_id != exclude_user_id
+    ).order_by(terms.term).limit(MAX_CANDIDATES).subquery()
+
+    score = func.min(case((candidates.c.term == prefix, candidates.c.kind * 2), else_=candidates.c.kind * 2 + 1))
+    ranked = select(candidates.c.user_id, score.label("score")).group_by(candidates.c.user_id).subquery()
+
+    return (await db.scalars(
+        select(models.User).join(ranked, ranked.c.user_id == models.User.id)
+        .order_by(ranked.c.score, models.User.username)
+        .limit(limit)
+    )).all()
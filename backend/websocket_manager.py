@@ -1,50 +1,368 @@
 from fastapi import WebSocket
-from typing import Dict, List
-import json
+from typing import Callable, Dict, Hashable, List, Optional, Set
+from collections import deque
+from config import settings
+from backplane import create_backplane
+from ws_codec import JSON, OutboundFrame
+from replay_buffer import ReplayBuffers
+import asyncio
+import time
+import uuid
+
+class ClientConnection:
+    """One WebSocket with a bounded outbound queue drained by its own writer task"""
+
+    def __init__(self, websocket: WebSocket, user_id: int, on_close: Callable[["ClientConnection"], None], codec=JSON):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Unique across processes, so a broadcast can skip the socket it came from
+        self.id = uuid.uuid4().hex[:16]
+        self.codec = codec
+        # Set by the endpoint once the token is checked; handlers refuse sockets without it
+        self.authenticated = False
+        self.max_queue = settings.ws_send_queue_size
+        self.policy = settings.ws_slow_consumer_policy
+        self.send_timeout = settings.ws_send_timeout_seconds
+        self.closed = False
+        # Set when a close is scheduled; no more frames are queued from then on
+        self.closing = False
+        # Accounting, exposed to operators through stats()
+        self.connected_at = time.time()
+        self.last_activity = time.monotonic()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_received = 0
+        self.dropped_frames = 0
+        self.queued_bytes = 0
+        # Entries are [coalesce_key, encoded data] so a pending frame can be replaced in place
+        self._queue: deque = deque()
+        self._pending_by_key: Dict[Hashable, list] = {}
+        self._wakeup = asyncio.Event()
+        self._on_close = on_close
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: OutboundFrame, coalesce_key: Optional[Hashable] = None) -> bool:
+        """Queue a frame without waiting for the socket. Returns False if it was not queued."""
+        if self.closed or self.closing:
+            return False
+        # Encoded here so queued_bytes is exact; the frame caches it for the other recipients
+        data = frame.encode(self.codec)
+
+        # Coalesce: a newer frame with the same key replaces the one still waiting to be sent
+        if self.policy == "coalesce" and coalesce_key is not None:
+            pending = self._pending_by_key.get(coalesce_key)
+            if pending is not None:
+                self.queued_bytes += len(data) - len(pending[1])
+                pending[1] = data
+                return True
+
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                print(f"User {self.user_id} send queue full, disconnecting slow consumer")
+                # Deferred: the caller may be iterating over the sets close() removes this connection from
+                self.closing = True
+                asyncio.get_running_loop().call_soon(self.close, 1013)
+                return False
+            self._forget(self._queue.popleft())
+            self.dropped_frames += 1
+
+        entry = [coalesce_key, data]
+        self.queued_bytes += len(data)
+        self._queue.append(entry)
+        if self.policy == "coalesce" and coalesce_key is not None:
+            self._pending_by_key[coalesce_key] = entry
+        self._wakeup.set()
+        return True
+
+    def touch(self):
+        """Record inbound activity (any frame, including pong)"""
+        self.last_activity = time.monotonic()
+        self.frames_received += 1
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "codec": self.codec.name,
+            "authenticated": self.authenticated,
+            "connected_at": self.connected_at,
+            "idle_seconds": round(self.idle_seconds(), 3),
+            "queued_frames": len(self._queue),
+            "queued_bytes": self.queued_bytes,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "frames_received": self.frames_received,
+            "dropped_frames": self.dropped_frames,
+        }
+
+    def _forget(self, entry: list):
+        self.queued_bytes -= len(entry[1])
+        if entry[0] is not None and self._pending_by_key.get(entry[0]) is entry:
+            del self._pending_by_key[entry[0]]
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                entry = self._queue.popleft()
+                self._forget(entry)
+                data = entry[1]
+                send = self.websocket.send_bytes if self.codec.binary else self.websocket.send_text
+                await asyncio.wait_for(send(data), timeout=self.send_timeout)
+                self.frames_sent += 1
+                self.bytes_sent += len(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Stalled or broken socket - drop the connection instead of blocking the room
+            print(f"User {self.user_id} writer stopped: {e!r}")
+            self.close(code=1011)
+
+    def close(self, code: int = 1000):
+        """Stop the writer and close the socket. Safe to call more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._pending_by_key.clear()
+        self.queued_bytes = 0
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        asyncio.create_task(self._close_socket(code))
+        self._on_close(self)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
 
 class ConnectionManager:
     def __init__(self):
-        # user_id -> WebSocket
-        self.active_connections: Dict[int, WebSocket] = {}
-        # chat_id -> List[user_id]
-        self.chat_connections: Dict[int, List[int]] = {}
-    
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        print(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
-    
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            self.active_connections.pop(user_id)
-        # Remove user from all chat rooms
-        for chat_id, users in self.chat_connections.items():
-            if user_id in users:
-                users.remove(user_id)
+        # user_id -> every open socket of that user (tabs, phones...)
+        self.active_connections: Dict[int, Set[ClientConnection]] = {}
+        # chat_id -> Set[user_id]
+        self.chat_connections: Dict[int, Set[int]] = {}
+        # user_id -> Set[chat_id], so leaving every room only touches that user's rooms
+        self.user_chats: Dict[int, Set[int]] = {}
+        # Carries broadcasts and presence to the other app processes
+        self.backplane = create_backplane(settings.backplane_url, self._on_backplane_message, self._notify_presence)
+        # Recent sequenced events per chat; a chat stays subscribed while its log is kept
+        self.replay = ReplayBuffers(
+            self.backplane.node_id,
+            settings.replay_buffer_size,
+            settings.replay_max_chats,
+            self._replay_evicted
+        )
+        self.reaped_connections = 0
+        # Called with (user_id, online) when a user comes online on any process or is gone from all of them
+        self._presence_listeners: List[Callable[[int, bool], None]] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.backplane.start()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        await self.backplane.stop()
+
+    async def _heartbeat_loop(self):
+        """Ping quiet sockets and reap the ones that stopped answering (half-open TCP)"""
+        interval = settings.ws_ping_interval_seconds
+        timeout = settings.ws_idle_timeout_seconds
+        while True:
+            await asyncio.sleep(interval)
+            ping = OutboundFrame({"type": "ping", "ts": time.time()})
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections):
+                    idle = connection.idle_seconds()
+                    if idle >= timeout:
+                        print(f"User {connection.user_id} idle for {idle:.0f}s, reaping connection")
+                        self.reaped_connections += 1
+                        connection.close(code=1001)
+                    elif idle >= interval:
+                        connection.enqueue(ping)
+
+    def add_presence_listener(self, listener: Callable[[int, bool], None]):
+        self._presence_listeners.append(listener)
+
+    def _notify_presence(self, user_id: int, online: bool):
+        for listener in self._presence_listeners:
+            listener(user_id, online)
+
+    def connection_stats(self) -> dict:
+        """Per-connection accounting plus totals, for operators"""
+        connections = [
+            connection.stats()
+            for user_connections in self.active_connections.values()
+            for connection in user_connections
+        ]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(connections),
+            "chats": len(self.chat_connections),
+            "queued_bytes": sum(c["queued_bytes"] for c in connections),
+            "reaped_connections": self.reaped_connections,
+            "details": connections,
+        }
+
+    async def connect(self, websocket: WebSocket, user_id: int, codec=JSON):
+        """Register an accepted, authenticated socket"""
+        connection = ClientConnection(websocket, user_id, self._connection_closed, codec)
+        connections = self.active_connections.setdefault(user_id, set())
+        connections.add(connection)
+        self.backplane.subscribe(f"user:{user_id}")
+        self.backplane.set_presence(user_id, True)
+        connection.start()
+        print(f"User {user_id} connected ({len(self.active_connections[user_id])} devices). Total users: {len(self.active_connections)}")
+        return connection
+
+    def disconnect(self, connection: ClientConnection):
+        connection.close()
+
+    def _connection_closed(self, connection: ClientConnection):
+        user_id = connection.user_id
+        connections = self.active_connections.get(user_id)
+        if connections is None or connection not in connections:
+            return
+        connections.discard(connection)
+        self.backplane.set_presence(user_id, False)
+        if connections:
+            print(f"User {user_id} closed a device, {len(connections)} still connected.")
+            return
+
+        # Last device gone - remove user from their chat rooms
+        del self.active_connections[user_id]
+        self.backplane.unsubscribe(f"user:{user_id}")
+        for chat_id in self.user_chats.pop(user_id, ()):
+            self._remove_member(chat_id, user_id)
         print(f"User {user_id} disconnected.")
-    
-    async def join_chat(self, user_id: int, chat_id: int):
+
+    def _remove_member(self, chat_id: int, user_id: int):
+        members = self.chat_connections.get(chat_id)
+        if members is None:
+            return
+        members.discard(user_id)
+        if not members:
+            del self.chat_connections[chat_id]
+            # Still subscribed while the replay log exists, so resuming clients see no gap
+            if chat_id not in self.replay:
+                self.backplane.unsubscribe(f"chat:{chat_id}")
+
+    def _replay_evicted(self, chat_id: int):
         if chat_id not in self.chat_connections:
-            self.chat_connections[chat_id] = []
-        
-        if user_id not in self.chat_connections[chat_id]:
-            self.chat_connections[chat_id].append(user_id)
-        
+            self.backplane.unsubscribe(f"chat:{chat_id}")
+
+    async def join_chat(self, user_id: int, chat_id: int):
+        """Add the user to the chat room. Returns the chat's replay log (current seq and epoch)."""
+        return self._join(user_id, chat_id)
+
+    def _join(self, user_id: int, chat_id: int):
+        log = self.replay.get(chat_id)
+        self.backplane.subscribe(f"chat:{chat_id}")
+        self.chat_connections.setdefault(chat_id, set()).add(user_id)
+        self.user_chats.setdefault(user_id, set()).add(chat_id)
         print(f"User {user_id} joined chat {chat_id}")
-    
+        return log
+
+    async def resume_chat(self, connection: ClientConnection, chat_id: int, epoch: Optional[str], last_seq: int):
+        """Rejoin a chat and queue the events missed since last_seq.
+
+        Returns the chat log and whether the gap could be replayed. Joining and
+        replaying happen without yielding, so no live event slips in between.
+        """
+        self._join(connection.user_id, chat_id)
+        log, missed = self.replay.resume(chat_id, epoch, last_seq, connection.user_id)
+        if missed is None:
+            return log, False
+        for event in missed:
+            connection.enqueue(OutboundFrame(event))
+        return log, True
+
     async def leave_chat(self, user_id: int, chat_id: int):
-        if chat_id in self.chat_connections and user_id in self.chat_connections[chat_id]:
-            self.chat_connections[chat_id].remove(user_id)
-    
-    async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
-    
-    async def broadcast_to_chat(self, message: str, chat_id: int, exclude_user_id: int = None):
-        if chat_id in self.chat_connections:
-            for user_id in self.chat_connections[chat_id]:
-                if user_id != exclude_user_id and user_id in self.active_connections:
-                    await self.active_connections[user_id].send_text(message)
+        self._remove_member(chat_id, user_id)
+        chats = self.user_chats.get(user_id)
+        if chats is not None:
+            chats.discard(chat_id)
+            if not chats:
+                del self.user_chats[user_id]
+
+    def user_connection_count(self, user_id: int) -> int:
+        """Number of open sockets for a user"""
+        return len(self.active_connections.get(user_id, ()))
+
+    def chat_connection_count(self, chat_id: int) -> int:
+        """Number of open sockets that receive a chat's events"""
+        return sum(self.user_connection_count(user_id) for user_id in self.chat_connections.get(chat_id, ()))
+
+    def is_connected(self, user_id: int) -> bool:
+        return user_id in self.active_connections
+
+    def is_online(self, user_id: int) -> bool:
+        """True if the user has a socket on any app process"""
+        return self.backplane.is_online(user_id)
+
+    async def send_personal_message(self, event: dict, user_id: int):
+        self.backplane.publish(f"user:{user_id}", {"event": event})
+
+    def send_local_message(self, event: dict, user_id: int):
+        """Queue an event for the user's sockets on this process only"""
+        # One frame per delivery, so each codec encodes the event once for all local recipients
+        frame = OutboundFrame(event)
+        for connection in list(self.active_connections.get(user_id, ())):
+            connection.enqueue(frame)
+
+    async def broadcast_to_chat(self, event: dict, chat_id: int, exclude_user_id: int = None,
+                                exclude_connection_id: str = None, coalesce_key: Hashable = None):
+        """Publish an event to the chat on every process and return without waiting on any socket.
+
+        exclude_user_id skips all of a user's sockets, exclude_connection_id
+        only the one the event came from.
+        """
+        self.backplane.publish(f"chat:{chat_id}", {
+            "event": event,
+            "exclude_user_id": exclude_user_id,
+            "exclude_connection_id": exclude_connection_id,
+            "coalesce_key": list(coalesce_key) if coalesce_key is not None else None,
+        })
+
+    def _on_backplane_message(self, channel: str, payload: dict):
+        kind, _, target = channel.partition(":")
+        if kind == "user":
+            self.send_local_message(payload["event"], int(target))
+        elif kind == "chat":
+            chat_id = int(target)
+            # Stamp with the chat's next seq and keep it for clients that resume later
+            event = self.replay.record(chat_id, payload["event"], payload.get("exclude_user_id"))
+            coalesce_key = payload.get("coalesce_key")
+            self._deliver_to_chat(
+                OutboundFrame(event),
+                chat_id,
+                payload.get("exclude_user_id"),
+                payload.get("exclude_connection_id"),
+                tuple(coalesce_key) if coalesce_key is not None else None,
+            )
+
+    def _deliver_to_chat(self, frame: OutboundFrame, chat_id: int, exclude_user_id: Optional[int],
+                         exclude_connection_id: Optional[str], coalesce_key: Optional[Hashable]):
+        """Queue a frame for every local member of the chat"""
+        # Snapshots: a connection that is closed while enqueuing leaves these sets
+        for user_id in list(self.chat_connections.get(chat_id, ())):
+            if user_id == exclude_user_id:
+                continue
+            for connection in list(self.active_connections.get(user_id, ())):
+                if connection.id != exclude_connection_id:
+                    connection.enqueue(frame, coalesce_key)
 
 # Global instance
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
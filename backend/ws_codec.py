@@ -0,0 +1,96 @@
+from fastapi import WebSocket
+from typing import Dict, Optional, Union
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, speeds up the JSON codec
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, enables the binary codec
+    msgpack = None
+
+class JsonCodec:
+    """Default codec: JSON in text frames"""
+    name = "json"
+    binary = False
+
+    def encode(self, event: dict) -> str:
+        if orjson is not None:
+            return orjson.dumps(event).decode()
+        return json.dumps(event)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+class MsgpackCodec:
+    """Compact MessagePack encoding in binary frames"""
+    name = "msgpack"
+    binary = True
+
+    def encode(self, event: dict) -> bytes:
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, data: bytes) -> dict:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as exc:
+            # msgpack signals bad input with several unrelated exception types
+            raise ValueError("Malformed msgpack frame") from exc
+
+JSON = JsonCodec()
+
+CODECS: Dict[str, object] = {"json": JSON}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+SUBPROTOCOL_PREFIX = "chat."
+
+def negotiate_codec(websocket: WebSocket):
+    """Pick a codec from the offered subprotocols (chat.msgpack, chat.json) or ?codec=.
+
+    Returns (codec, subprotocol to accept with or None).
+    """
+    offered = websocket.headers.get("sec-websocket-protocol", "")
+    for protocol in (p.strip() for p in offered.split(",") if p.strip()):
+        name = protocol[len(SUBPROTOCOL_PREFIX):] if protocol.startswith(SUBPROTOCOL_PREFIX) else None
+        if name in CODECS:
+            return CODECS[name], protocol
+
+    name = websocket.query_params.get("codec", "json")
+    return CODECS.get(name, JSON), None
+
+class OutboundFrame:
+    """An event plus its encodings, so a broadcast is serialized once per codec, not per recipient"""
+    __slots__ = ("event", "_encoded")
+
+    def __init__(self, event: dict):
+        self.event = event
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encode(self, codec) -> Union[str, bytes]:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = codec.encode(self.event)
+            self._encoded[codec.name] = data
+        return data
+
+def decode_frame(codec, message: dict) -> Optional[dict]:
+    """Decode a raw ASGI websocket.receive message, None if it carries no data.
+
+    Raises ValueError when the data does not decode to an object.
+    """
+    if message.get("bytes") is not None:
+        frame = codec.decode(message["bytes"])
+    elif message.get("text") is not None:
+        # Binary-codec clients may still send control frames as JSON text
+        frame = JSON.decode(message["text"]) if codec.binary else codec.decode(message["text"])
+    else:
+        return None
+    if not isinstance(frame, dict):
+        raise ValueError("Frame is not an object")
+    return frame
@@ -0,0 +1,147 @@
+from typing import Awaitable, Callable, Dict
+from pydantic import ValidationError
+from websocket_manager import manager, ClientConnection
+from typing_service import typing_tracker
+from ws_codec import OutboundFrame
+from database import AsyncSessionLocal
+from chat_crud import get_chat_for_user
+from message_pipeline import message_pipeline
+from chat_events import new_message_event, message_ack_event, message_error_event, chat_error_event, frame_error_event
+import schemas
+
+# Frame "type" -> coroutine handling it
+WSHandler = Callable[[ClientConnection, dict], Awaitable[None]]
+handlers: Dict[str, WSHandler] = {}
+
+def ws_handler(frame_type: str):
+    """Register a handler for one client frame type"""
+    def register(func: WSHandler) -> WSHandler:
+        handlers[frame_type] = func
+        return func
+    return register
+
+async def dispatch(connection: ClientConnection, message_data: dict):
+    frame_type = message_data.get("type")
+    handler = handlers.get(frame_type)
+    if handler is None:
+        print(f"User {connection.user_id} sent unknown frame type {frame_type!r}")
+        return
+    try:
+        await handler(connection, message_data)
+    except (KeyError, TypeError, ValueError) as exc:
+        # A malformed payload answers the one frame; the socket stays open
+        print(f"User {connection.user_id} sent a malformed {frame_type!r} frame: {exc!r}")
+        connection.enqueue(OutboundFrame(frame_error_event(frame_type, "Malformed frame")))
+
+@ws_handler("ping")
+async def handle_ping(connection: ClientConnection, message_data: dict):
+    connection.enqueue(OutboundFrame({"type": "pong", "ts": message_data.get("ts")}))
+
+@ws_handler("pong")
+async def handle_pong(connection: ClientConnection, message_data: dict):
+    # Activity is already recorded by the receive loop
+    pass
+
+async def _may_join(connection: ClientConnection, chat_id) -> bool:
+    """Only an authenticated participant may join a chat room or replay its events"""
+    if not connection.authenticated:
+        detail = "Authentication required"
+    elif not isinstance(chat_id, int):
+        detail = "chat_id is required"
+    else:
+        async with AsyncSessionLocal() as db:
+            if await get_chat_for_user(db, chat_id, connection.user_id) is not None:
+                return True
+        detail = "Chat not found"
+    connection.enqueue(OutboundFrame(chat_error_event(chat_id, detail)))
+    return False
+
+@ws_handler("join_chat")
+async def handle_join_chat(connection: ClientConnection, message_data: dict):
+    if not await _may_join(connection, message_data.get("chat_id")):
+        return
+    log = await manager.join_chat(connection.user_id, message_data["chat_id"])
+    # Baseline for a later resume
+    connection.enqueue(OutboundFrame({
+        "type": "chat_joined",
+        "chat_id": message_data["chat_id"],
+        "seq": log.seq,
+        "epoch": log.epoch
+    }))
+
+@ws_handler("resume")
+async def handle_resume(connection: ClientConnection, message_data: dict):
+    """Replay what a reconnecting client missed, or tell it to refetch history"""
+    chat_id = message_data.get("chat_id")
+    if not await _may_join(connection, chat_id):
+        return
+    log, replayed = await manager.resume_chat(
+        connection,
+        chat_id,
+        message_data.get("epoch"),
+        int(message_data.get("last_seq", 0))
+    )
+    connection.enqueue(OutboundFrame({
+        "type": "resumed" if replayed else "resume_failed",
+        "chat_id": chat_id,
+        "seq": log.seq,
+        "epoch": log.epoch,
+        # resume_failed: the gap is older than the buffer, reload via GET /chats/{chat_id}/messages
+        "reason": None if replayed else "too_old"
+    }))
+
+def _has_joined(connection: ClientConnection, chat_id) -> bool:
+    """Joining ran _may_join, so this is the same check without a query per frame"""
+    return connection.authenticated and chat_id in manager.user_chats.get(connection.user_id, ())
+
+@ws_handler("typing")
+async def handle_typing(connection: ClientConnection, message_data: dict):
+    chat_id = message_data.get("chat_id")
+    if not _has_joined(connection, chat_id):
+        connection.enqueue(OutboundFrame(chat_error_event(chat_id, "Join the chat first")))
+        return
+    # Only start/stop transitions reach the room, not every keystroke
+    await typing_tracker.update(connection.user_id, chat_id, bool(message_data.get("is_typing")))
+
+async def _store_message(chat_id: int, sender_id: int, message: schemas.MessageCreate):
+    """Returns (message, created), or None if the sender is not in the chat"""
+    async with AsyncSessionLocal() as db:
+        if await get_chat_for_user(db, chat_id, sender_id) is None:
+            return None
+    return await message_pipeline.submit(message, chat_id, sender_id)
+
+@ws_handler("send_message")
+async def handle_send_message(connection: ClientConnection, message_data: dict):
+    """Store a message sent over the socket and ack it to the sender"""
+    client_msg_id = message_data.get("client_msg_id")
+    chat_id = message_data.get("chat_id")
+
+    def reply_error(detail: str):
+        connection.enqueue(OutboundFrame(message_error_event(client_msg_id, chat_id, detail)))
+
+    if not connection.authenticated:
+        reply_error("Authentication required")
+        return
+    if not client_msg_id or not isinstance(chat_id, int):
+        reply_error("chat_id and client_msg_id are required")
+        return
+    try:
+        message = schemas.MessageCreate(content=message_data.get("content"), client_msg_id=client_msg_id)
+    except ValidationError:
+        reply_error("Invalid message")
+        return
+
+    result = await _store_message(chat_id, connection.user_id, message)
+    if result is None:
+        reply_error("Chat not found")
+        return
+
+    db_message, created = result
+    await typing_tracker.stop(connection.user_id, chat_id)
+    connection.enqueue(OutboundFrame(message_ack_event(db_message, chat_id, client_msg_id, duplicate=not created)))
+    if created:
+        await manager.broadcast_to_chat(
+            new_message_event(db_message, chat_id),
+            chat_id,
+            exclude_connection_id=connection.id
+        )
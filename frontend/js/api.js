@@ -98,6 +98,11 @@ class API {
         return this.request(`/users/search?q=${encodeURIComponent(query)}`);
     }
 
+    async getPresence(userIds) {
+        const query = userIds.map(id => `user_ids=${encodeURIComponent(id)}`).join('&');
+        return this.request(`/users/presence?${query}`);
+    }
+
     // Chat endpoints
     async getChats() {
         return this.request('/chats/');
@@ -115,21 +120,24 @@ class API {
         });
     }
 
-    async getChatMessages(chatId) {
-        return this.request(`/chats/${chatId}/messages`);
+    async getChatMessages(chatId, { before = null, after = null, limit = 50 } = {}) {
+        const params = new URLSearchParams({ limit });
+        if (before) params.set('before', before);
+        if (after) params.set('after', after);
+        return this.request(`/chats/${chatId}/messages?${params}`);
     }
 
-    async sendMessage(chatId, content) {
+    async sendMessage(chatId, content, clientMsgId = null) {
         return this.request(`/chats/${chatId}/messages`, {
             method: 'POST',
-            body: JSON.stringify({ content }),
+            body: JSON.stringify({ content, client_msg_id: clientMsgId }),
         });
     }
 
-    async markMessagesRead(messageIds) {
-        return this.request('/chats/messages/read', {
+    async markChatRead(chatId, upToMessageId) {
+        return this.request(`/chats/${chatId}/read`, {
             method: 'PUT',
-            body: JSON.stringify({ message_ids: messageIds }),
+            body: JSON.stringify({ up_to_message_id: upToMessageId }),
         });
     }
 
@@ -4,6 +4,9 @@ class ChatManager {
         this.chats = [];
         this.typingUsers = new Map();
         this.typingTimeout = null;
+        // Cursor for the next older page of the open chat, null once at the start
+        this.olderCursor = null;
+        this.loadingOlder = false;
     }
 
     init() {
@@ -28,6 +31,10 @@ class ChatManager {
 
         sendBtn.addEventListener('click', () => this.sendMessage());
 
+        document.getElementById('messages-container').addEventListener('scroll', (e) => {
+            if (e.target.scrollTop < 50) this.loadOlderMessages();
+        });
+
         document.getElementById('attachment-btn').addEventListener('click', () => {
             ui.showFileUploadModal();
         });
@@ -83,6 +90,8 @@ class ChatManager {
         this.chats.forEach(chat => {
             const lastMessage = chat.last_message?.content || 'No messages yet';
             const time = chat.last_message_at ? this.formatTime(chat.last_message_at) : '';
+            // The open chat is being read as messages arrive
+            const showUnread = chat.unread_count > 0 && this.currentChat?.id !== chat.id;
             
             const chatElement = document.createElement('div');
             chatElement.className = `chat-item ${this.currentChat?.id === chat.id ? 'active' : ''}`;
@@ -96,7 +105,7 @@ class ChatManager {
                     </div>
                     <div class="chat-last-message">${lastMessage}</div>
                 </div>
-                <div class="chat-unread" style="display: none">0</div>
+                <div class="chat-unread" style="display: ${showUnread ? 'flex' : 'none'}">${chat.unread_count}</div>
             `;
 
             chatElement.addEventListener('click', () => {
@@ -140,17 +149,71 @@ class ChatManager {
         document.getElementById('partner-name').textContent = chat.other_user.full_name;
         document.getElementById('partner-avatar').src = 
             `https://ui-avatars.com/api/?name=${encodeURIComponent(chat.other_user.full_name)}&background=10b981&color=fff`;
+        this.loadPartnerPresence(chat.other_user.id);
+    }
+
+    async loadPartnerPresence(userId) {
+        try {
+            const [presence] = await api.getPresence([userId]);
+            if (presence) this.handlePresence(presence.user_id, presence.status);
+        } catch (error) {
+            console.error('Failed to load presence:', error);
+        }
+    }
+
+    handlePresence(userId, status) {
+        if (!this.currentChat || this.currentChat.other_user.id !== userId) return;
+
+        const partnerStatus = document.getElementById('partner-status');
+        if (partnerStatus) {
+            partnerStatus.textContent = status === 'online' ? 'Online' : 'Offline';
+        }
     }
 
     async loadMessages(chatId) {
         try {
-            const messages = await api.getChatMessages(chatId);
+            const page = await api.getChatMessages(chatId);
+            const messages = page.messages;
+            this.olderCursor = page.prev_cursor;
             this.renderMessages(messages);
+
+            // One request (and one receipt to the sender) for everything unread, older pages included
+            const currentUserId = authManager.getCurrentUser().id;
+            const hasUnread = (this.currentChat && this.currentChat.unread_count > 0) ||
+                messages.some(message => message.sender_id !== currentUserId && !message.is_read);
+            if (hasUnread && messages.length > 0) {
+                this.markChatRead(chatId, messages[messages.length - 1].id);
+            }
         } catch (error) {
             ui.showToast('Failed to load messages', 'error');
         }
     }
 
+    async loadOlderMessages() {
+        if (!this.currentChat || !this.olderCursor || this.loadingOlder) return;
+
+        const chatId = this.currentChat.id;
+        this.loadingOlder = true;
+        try {
+            const page = await api.getChatMessages(chatId, { before: this.olderCursor });
+            if (!this.currentChat || this.currentChat.id !== chatId) return;
+            this.olderCursor = page.prev_cursor;
+
+            const container = document.getElementById('messages-container');
+            // Keep the message the user is looking at in place
+            const previousHeight = container.scrollHeight;
+            const firstMessage = container.firstChild;
+            page.messages.forEach(message => {
+                container.insertBefore(this.createMessageElement(message), firstMessage);
+            });
+            container.scrollTop += container.scrollHeight - previousHeight;
+        } catch (error) {
+            ui.showToast('Failed to load older messages', 'error');
+        } finally {
+            this.loadingOlder = false;
+        }
+    }
+
     renderMessages(messages) {
         const container = document.getElementById('messages-container');
         container.innerHTML = '';
@@ -164,6 +227,12 @@ class ChatManager {
 
     appendMessage(message) {
         const container = document.getElementById('messages-container');
+        // The sender's other tabs get their messages over the socket too
+        if (container.querySelector(`[data-message-id="${message.id}"]`)) return;
+        container.appendChild(this.createMessageElement(message));
+    }
+
+    createMessageElement(message) {
         const isSent = message.sender_id === authManager.getCurrentUser().id;
         
         const messageElement = document.createElement('div');
@@ -178,7 +247,7 @@ class ChatManager {
             ${isSent ? `<div class="message-status">${message.is_read ? '✓✓' : '✓'}</div>` : ''}
         `;
 
-        container.appendChild(messageElement);
+        return messageElement;
     }
 
     async sendMessage() {
@@ -187,10 +256,19 @@ class ChatManager {
 
         if (!content || !this.currentChat) return;
 
+        const chatId = this.currentChat.id;
+        // Same ID on both paths, so an HTTP retry after a lost ack is not stored twice
+        const clientMsgId = crypto.randomUUID();
+
         try {
             input.value = '';
 
-            const message = await api.sendMessage(this.currentChat.id, content);
+            let message;
+            try {
+                message = await websocketManager.sendChatMessage(chatId, content, clientMsgId);
+            } catch (wsError) {
+                message = await api.sendMessage(chatId, content, clientMsgId);
+            }
             
             this.appendMessage(message);
             this.scrollToBottom();
@@ -208,7 +286,9 @@ class ChatManager {
             this.appendMessage(message);
             this.scrollToBottom();
             
-            this.markMessagesAsRead([message.id]);
+            if (message.sender_id !== authManager.getCurrentUser().id) {
+                this.markChatRead(chatId, message.id);
+            }
         }
 
         this.loadChats();
@@ -430,8 +510,32 @@ class ChatManager {
         this.renderChatsList();
     }
 
-    markMessagesAsRead(messageIds = null) {
-        if (!this.currentChat) return;
+    async markChatRead(chatId, upToMessageId) {
+        // Paged clients never hold every unread ID, so read up to the newest one on screen
+        if (!this.currentChat || this.currentChat.id !== chatId) return;
+
+        try {
+            await api.markChatRead(chatId, upToMessageId);
+        } catch (error) {
+            console.error('Failed to mark messages as read:', error);
+        }
+    }
+
+    handleMessagesRead(chatId, firstMessageId, lastMessageId, readerId) {
+        if (readerId === authManager.getCurrentUser().id) {
+            // Read on another of our tabs: only the unread badges change
+            this.loadChats();
+            return;
+        }
+        if (!this.currentChat || this.currentChat.id !== chatId) return;
+
+        document.querySelectorAll('#messages-container .message.sent').forEach(element => {
+            const messageId = Number(element.dataset.messageId);
+            if (messageId >= firstMessageId && messageId <= lastMessageId) {
+                const status = element.querySelector('.message-status');
+                if (status) status.textContent = '✓✓';
+            }
+        });
     }
 
     scrollToBottom() {
@@ -440,6 +544,7 @@ class ChatManager {
     }
 
     formatTime(dateString) {
+        // The server sends UTC with a Z suffix, so Date converts it to local time
         const date = new Date(dateString);
         const now = new Date();
         const diffMs = now - date;
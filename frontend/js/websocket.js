@@ -6,6 +6,11 @@ class WebSocketManager {
         this.maxReconnectAttempts = 5;
         this.reconnectDelay = 1000;
         this.currentChatId = null;
+        // client_msg_id -> { resolve, reject, timer } for sends awaiting a server ack
+        this.pendingSends = new Map();
+        this.ackTimeout = 5000;
+        // chat_id -> { seq, epoch } of the last event seen, for resuming after a reconnect
+        this.chatCursors = new Map();
     }
 
     connect() {
@@ -27,9 +32,12 @@ class WebSocketManager {
     setupEventHandlers() {
         this.socket.onopen = () => {
             console.log('WebSocket connected');
+            // The token goes in the first frame, never in the URL
+            this.socket.send(JSON.stringify({ type: 'auth', token: api.token }));
             this.isConnected = true;
             this.reconnectAttempts = 0;
             ui.showToast('Connected', 'success');
+            this.resumeCurrentChat();
         };
 
         this.socket.onmessage = (event) => {
@@ -62,13 +70,17 @@ class WebSocketManager {
     }
 
     handleMessage(data) {
+        if (data.seq !== undefined && data.chat_id !== undefined) {
+            this.chatCursors.set(data.chat_id, { seq: data.seq, epoch: data.epoch });
+        }
+
         switch (data.type) {
             case 'new_message':
                 chatManager.handleNewMessage(data.message, data.chat_id);
                 break;
                 
-            case 'message_read':
-                chatManager.handleMessageRead(data.message_id, data.reader_id);
+            case 'messages_read':
+                chatManager.handleMessagesRead(data.chat_id, data.first_message_id, data.last_message_id, data.reader_id);
                 break;
                 
             case 'typing':
@@ -82,6 +94,91 @@ class WebSocketManager {
             case 'file_deleted':
                 chatManager.handleFileDeleted(data.file_id, data.chat_id);
                 break;
+
+            case 'presence':
+                chatManager.handlePresence(data.user_id, data.status);
+                break;
+
+            case 'resume_failed':
+                // Missed too much for the server buffer - reload the history instead
+                if (data.chat_id === this.currentChatId) {
+                    chatManager.loadMessages(data.chat_id);
+                }
+                break;
+
+            case 'chat_error':
+                // join_chat, resume or typing refused: not signed in on this socket, or not a participant
+                console.warn(`Chat ${data.chat_id}: ${data.detail}`);
+                break;
+
+            case 'ping':
+                // Server heartbeat: answer so the connection is not reaped as dead
+                this.send({ type: 'pong', ts: data.ts });
+                break;
+
+            case 'message_ack':
+                this.settleSend(data.client_msg_id, null, data.message);
+                break;
+
+            case 'message_error':
+                this.settleSend(data.client_msg_id, new Error(data.detail));
+                break;
+
+            case 'error':
+                // The server could not decode or use one of our frames
+                console.warn(`Frame ${data.frame_type} rejected: ${data.detail}`);
+                break;
+        }
+    }
+
+    resumeCurrentChat() {
+        if (!this.currentChatId) return;
+
+        const cursor = this.chatCursors.get(this.currentChatId);
+        if (!cursor) {
+            this.joinChat(this.currentChatId);
+            return;
+        }
+        this.send({
+            type: 'resume',
+            chat_id: this.currentChatId,
+            last_seq: cursor.seq,
+            epoch: cursor.epoch
+        });
+    }
+
+    sendChatMessage(chatId, content, clientMsgId) {
+        // Resolves with the stored message once the server acks it
+        return new Promise((resolve, reject) => {
+            if (!this.socket || !this.isConnected) {
+                reject(new Error('WebSocket not connected'));
+                return;
+            }
+
+            const timer = setTimeout(() => {
+                this.settleSend(clientMsgId, new Error('Send timed out'));
+            }, this.ackTimeout);
+            this.pendingSends.set(clientMsgId, { resolve, reject, timer });
+
+            this.send({
+                type: 'send_message',
+                chat_id: chatId,
+                content: content,
+                client_msg_id: clientMsgId
+            });
+        });
+    }
+
+    settleSend(clientMsgId, error, message = null) {
+        const pending = this.pendingSends.get(clientMsgId);
+        if (!pending) return;
+
+        clearTimeout(pending.timer);
+        this.pendingSends.delete(clientMsgId);
+        if (error) {
+            pending.reject(error);
+        } else {
+            pending.resolve(message);
         }
     }
 
@@ -107,14 +204,6 @@ class WebSocketManager {
         });
     }
 
-    sendReadReceipt(messageId, chatId) {
-        this.send({
-            type: 'message_read',
-            message_id: messageId,
-            chat_id: chatId
-        });
-    }
-
     disconnect() {
         if (this.socket) {
             this.socket.close();